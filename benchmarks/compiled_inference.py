@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Eager vs compiled (vs XLA) OOBNet inference, per batch size.
+
+For every batch size the first call (which includes tracing/compilation)
+and the steady-state time per frame are measured. Batch sizes that are
+not a bucket show the cost of padding; in eager mode they show nothing
+special, in compiled mode they reuse an existing trace.
+
+    python -m benchmarks.compiled_inference --batch-sizes 1 7 16 33 64 100 --output compiled.json
+
+Without --weights the model runs with random weights, which is enough
+for timing.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from endoshare.processing.engine import InferenceEngine
+
+VARIANTS = {
+    "eager": dict(compiled=False, jit_compile=False),
+    "compiled": dict(compiled=True, jit_compile=False),
+    "compiled+xla": dict(compiled=True, jit_compile=True),
+}
+
+
+def bench_variant(engine, batch_sizes, repeats):
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = rng.uniform(-1, 1, size=[batch_size] + engine.input_shape + [3]).astype(np.float32)
+        engine.reset()
+        start_time = time.perf_counter()
+        engine.predict(batch)
+        first_call = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            engine.predict(batch)
+        steady = (time.perf_counter() - start_time) / repeats
+        results[batch_size] = {
+            "first_call_ms": 1000 * first_call,
+            "steady_ms": 1000 * steady,
+            "ms_per_frame": 1000 * steady / batch_size,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 7, 16, 33, 64, 100])
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--weights", default=None, help="OOBNet checkpoint (default: random weights)")
+    parser.add_argument("--output", metavar="JSON")
+    args = parser.parse_args()
+
+    report = {}
+    for name in args.variants:
+        engine = InferenceEngine(ckpt_path=args.weights, **VARIANTS[name])
+        start_time = time.perf_counter()
+        engine.load()
+        load_ms = 1000 * (time.perf_counter() - start_time)
+        report[name] = {"load_ms": load_ms, "batches": bench_variant(engine, args.batch_sizes, args.repeats)}
+
+    print(f"{'batch':>6} " + " ".join(f"{name + ' ms/frame':>22}" for name in args.variants))
+    for batch_size in args.batch_sizes:
+        row = [report[name]["batches"][batch_size]["ms_per_frame"] for name in args.variants]
+        print(f"{batch_size:>6} " + " ".join(f"{v:>22.3f}" for v in row))
+    if "eager" in report:
+        for name in args.variants:
+            if name == "eager":
+                continue
+            gains = [
+                report["eager"]["batches"][b]["steady_ms"] / report[name]["batches"][b]["steady_ms"]
+                for b in args.batch_sizes
+            ]
+            print(f"{name} speed-up over eager: " + ", ".join(f"{b}: {g:.2f}x" for b, g in zip(args.batch_sizes, gains)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
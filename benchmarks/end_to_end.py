@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+End-to-end NORMAL (Fast) and ADVANCED pipeline benchmark.
+
+Test videos are generated locally and deterministically with ffmpeg lavfi
+sources: a reddish moving fractal stands in for the inside of the body and
+a bright test pattern for out-of-body footage, alternating at a given
+number of transitions per minute. Every combination of length, resolution
+and transition density is run through the selected pipelines headlessly,
+each run in a fresh process so that peak RSS belongs to that run alone.
+
+    python -m benchmarks.end_to_end --lengths 60 600 --resolutions 480 1080 \\
+        --densities 0.5 4 --modes NORMAL ADVANCED --output e2e.json
+
+The JSON holds wall time, per-phase time, peak RSS (this process and its
+ffmpeg children) and realtime factor per case, plus the git revision, so
+runs of different versions can be compared. Fixtures are cached in
+~/.endoshare/benchmarks (see --fixtures) and reused while their
+parameters are unchanged. Without --weights the model runs with random
+weights, which is enough for timing.
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SEED = 0
+FPS = 25
+INSIDE = "mandelbrot=size={w}x{h}:rate={fps},colorchannelmixer=rr=1.0:gg=0.35:bb=0.3"
+OUTSIDE = "testsrc2=size={w}x{h}:rate={fps}"
+
+
+def plan_fixture(length, density, seed=SEED):
+    """[(inside, start, end), ...] with `density` transitions per minute,
+    starting outside the body as a real recording does."""
+    rng = np.random.default_rng([seed, length, int(density * 1000)])
+    n = min(length - 1, int(round(length / 60 * density)))
+    cuts = sorted(rng.choice(np.arange(1, length), size=n, replace=False).tolist()) if n > 0 else []
+    bounds = [0] + cuts + [length]
+    return [(k % 2 == 1, start, end) for k, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+def make_fixture(fixtures_dir, length, height, density, ffmpeg):
+    width = int(round(height * 16 / 9 / 2) * 2)
+    name = f"e2e_{length}s_{height}p_{density:g}tpm"
+    video = Path(fixtures_dir) / f"{name}.mp4"
+    truth = video.with_suffix(".json")
+    segments = plan_fixture(length, density)
+    if video.is_file() and truth.is_file() and json.loads(truth.read_text())["segments"] == [list(s) for s in segments]:
+        return video
+    video.parent.mkdir(parents=True, exist_ok=True)
+    cmd = [ffmpeg, "-y", "-v", "error"]
+    for inside, start, end in segments:
+        source = (INSIDE if inside else OUTSIDE).format(w=width, h=height, fps=FPS)
+        cmd += ["-f", "lavfi", "-t", str(end - start), "-i", source]
+    concat = "".join(f"[{k}:v]" for k in range(len(segments))) + f"concat=n={len(segments)}:v=1:a=0[v]"
+    cmd += [
+        "-filter_complex", concat, "-map", "[v]",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-g", "250",
+        "-pix_fmt", "yuv420p", "-fflags", "+bitexact", "-flags:v", "+bitexact",
+        str(video),
+    ]
+    subprocess.run(cmd, check=True)
+    truth.write_text(json.dumps({"length": length, "height": height, "density": density, "segments": segments}))
+    return video
+
+
+def _max_rss_mb(children=False):
+    """Peak RSS of this process, or of its finished children; None where
+    the platform cannot tell."""
+    if resource is None:
+        # Windows keeps no figure for the children
+        if children:
+            return None
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def run_case(case):
+    """Run one pipeline on one fixture in this process and return its
+    measurements."""
+    from loguru import logger
+    from endoshare.processing import deid, engine as engines
+    from endoshare.utils.metrics import JobMetrics
+    from endoshare.utils.subprocesses import processes
+    from endoshare.utils.types import ProcessingMode
+
+    logger.remove()
+    video = Path(case["video"])
+    duration = json.loads(video.with_suffix(".json").read_text())["length"]
+    work_dir = Path(tempfile.mkdtemp(prefix="e2e_"))
+    metrics = JobMetrics("bench")
+    processes().subscribe(metrics.add_process)
+    start_time = time.perf_counter()
+
+    try:
+        with metrics.stage("load"):
+            engine = engines.create_engine(case["backend"], ckpt_path=case["weights"])
+            engine.load()
+        if case["mode"] == "NORMAL":
+            deid.process_video([video], work_dir / video.name, logger,
+                               engine=engine, strip_metadata=True, work_dir=work_dir, metrics=metrics)
+        else:
+            from endoshare.gui.video_threads import VideoProcessThread
+
+            engines._shared_engines[case["backend"]] = engine
+            thread = VideoProcessThread({}, str(work_dir), str(work_dir), fps=FPS, resolution=case["resolution"],
+                                        mode=ProcessingMode.ADVANCED, backend=case["backend"])
+            thread.patient_name = "bench"
+            thread.metrics = metrics
+            # as in VideoProcessThread.run: what is not inference or rendering
+            # is decoding and preprocessing
+            with metrics.stage("extraction"):
+                thread.run_advanced_inference({str(video): str(video)}, str(work_dir), str(work_dir),
+                                              thread.ckpt_path, 64, thread.device,
+                                              out_video_path=work_dir / video.name)
+        wall = time.perf_counter() - start_time
+        stages = metrics.to_dict()["stages"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "wall_sec": wall,
+        "phases_sec": {name: stage["wall_sec"] for name, stage in stages.items()},
+        "stages": stages,
+        "realtime_factor": duration / wall if wall > 0 else None,
+        "peak_rss_mb": _max_rss_mb(),
+        "peak_rss_children_mb": _max_rss_mb(children=True),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[60, 300], help="seconds")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[480, 720], help="frame heights")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.5, 4], help="transitions per minute")
+    parser.add_argument("--modes", nargs="+", default=["NORMAL", "ADVANCED"], choices=["NORMAL", "ADVANCED"])
+    parser.add_argument("--backend", default="keras")
+    parser.add_argument("--weights", default=None, help="OOBNet checkpoint (default: random weights)")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--fixtures", default=None, help="fixture cache (default: ~/.endoshare/benchmarks)")
+    parser.add_argument("--output", metavar="JSON")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    from endoshare.utils.resources import FFMPEG_BIN, user_data_dir
+
+    fixtures_dir = args.fixtures or user_data_dir("benchmarks")
+    report = {
+        "revision": _git_revision(),
+        "host": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version()},
+        "backend": args.backend,
+        "cases": [],
+    }
+    for length in args.lengths:
+        for height in args.resolutions:
+            for density in args.densities:
+                video = make_fixture(fixtures_dir, length, height, density, FFMPEG_BIN)
+                for mode in args.modes:
+                    case = {"video": str(video), "mode": mode, "backend": args.backend,
+                            "weights": args.weights, "resolution": height}
+                    runs = []
+                    for _ in range(args.repeats):
+                        proc = subprocess.run([sys.executable, "-m", "benchmarks.end_to_end", "--run-case", json.dumps(case)],
+                                              capture_output=True, text=True)
+                        if proc.returncode != 0:
+                            print(proc.stderr[-2000:], file=sys.stderr)
+                            raise SystemExit(f"{mode} failed on {video.name}")
+                        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+                    wall = statistics.median(r["wall_sec"] for r in runs)
+                    report["cases"].append({
+                        "fixture": video.name, "length_sec": length, "height": height, "density_tpm": density,
+                        "mode": mode, "median_wall_sec": wall, "median_realtime_factor": length / wall, "runs": runs,
+                    })
+                    print(f"{mode:>8} {video.name:<28} {wall:8.1f} s  {length / wall:6.2f}x realtime  "
+                          f"peak {max(r['peak_rss_mb'] for r in runs):.0f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
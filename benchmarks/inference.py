@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+OOBNet inference micro-benchmark: model build + weight loading,
+preprocessing, backbone throughput and LSTM throughput, measured separately
+per backend, TensorFlow thread count and batch size.
+
+Every (backend, threads) pair runs in a fresh process, since TensorFlow's
+thread pools can only be set before its first op. Frames are synthesized
+locally, so no recording is needed.
+
+    python -m benchmarks.inference --backends keras tflite-fp16 --threads 1 2 4 \\
+        --batch-sizes 16 32 64 128 256 --output inference.json
+
+For each configuration the summary suggests an Advanced-mode buffer size
+(`inference_buffer_size` in settings.json): the smallest batch size within
+5% of the best frames/s. Larger buffers only cost memory, as that many
+full-resolution frames are held at once. Without --weights the model runs
+with random weights, which is enough for timing. The app's auto-tuner
+(endoshare/processing/autotune.py) makes the same choice per machine.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+import numpy as np
+
+# a batch size "as fast as the best" if within this fraction of it
+TOLERANCE = 0.05
+
+
+def synth_frames(n, height, width, seed=0):
+    """Smooth colour gradients with noise, uint8 RGB."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.integers(0, 32, size=(n, height, width, 3))
+    return np.clip(base[None] + noise, 0, 255).astype(np.uint8)
+
+
+def _per_frame_ms(fn, frames, repeats):
+    fn(frames[0])
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for frame in frames:
+            fn(frame)
+    return 1000 * (time.perf_counter() - start_time) / (repeats * len(frames))
+
+
+def _timed(fn, repeats):
+    """Seconds per call, after one untimed call (tracing, allocation)."""
+    fn()
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start_time) / repeats
+
+
+def bench_config(config):
+    """Measure one backend at one thread count, in this process."""
+    import tensorflow as tf
+    from loguru import logger
+
+    from endoshare.gui.video_threads import VideoProcessThread
+    from endoshare.processing import mutils
+    from endoshare.processing.engine import create_engine
+    from endoshare.utils.governor import ResourceGovernor, set_governor
+
+    logger.remove()
+    gov = ResourceGovernor()
+    gov.inference_threads = config["threads"]
+    set_governor(gov)
+    gov.configure_tensorflow()
+
+    engine = create_engine(config["backend"], ckpt_path=config["weights"])
+    start_time = time.perf_counter()
+    engine.load()
+    load_ms = 1000 * (time.perf_counter() - start_time)
+
+    repeats = config["repeats"]
+    height = config["resolution"]
+    small = synth_frames(max(config["batch_sizes"]), 64, 64)
+    full = synth_frames(8, height, int(round(height * 16 / 9 / 2) * 2), seed=1)
+    # the Fast path preprocesses extracted 64x64 frames, the Advanced path
+    # resizes every full-resolution frame (VideoProcessThread.preprocess)
+    advanced = types.SimpleNamespace(device=engine.device)
+    preprocess = {
+        "fast_ms_per_frame": _per_frame_ms(mutils.preprocess, small[:64], repeats),
+        f"advanced_{height}p_ms_per_frame": _per_frame_ms(
+            lambda f: VideoProcessThread.preprocess(advanced, f), full, repeats),
+    }
+
+    batches = {}
+    for batch_size in config["batch_sizes"]:
+        batch = tf.concat([mutils.preprocess(f) for f in small[:batch_size]], axis=0).numpy()
+        backbone = _timed(lambda: engine.features(batch), repeats)
+        features = engine.features(batch)
+        engine.reset()
+        lstm = _timed(lambda: engine.classify(features), repeats)
+        engine.reset()
+        batches[batch_size] = {
+            "backbone_ms": 1000 * backbone,
+            "lstm_ms": 1000 * lstm,
+            "backbone_fps": batch_size / backbone,
+            "lstm_fps": batch_size / lstm,
+            "fps": batch_size / (backbone + lstm),
+        }
+    best = max(b["fps"] for b in batches.values())
+    recommended = min(size for size, b in batches.items() if b["fps"] >= (1 - TOLERANCE) * best)
+    return {
+        "backend": config["backend"],
+        # False when a tflite backend fell back to float32
+        "quantized": engine.quantized,
+        "threads": config["threads"],
+        "load_ms": load_ms,
+        "preprocess": preprocess,
+        "batches": batches,
+        "recommended_buffer_size": recommended,
+    }
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite-fp16", "tflite-int8"])
+    parser.add_argument("--threads", type=int, nargs="+", default=sorted({1, max(1, cpu_count // 2), cpu_count}))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32, 64, 128, 256])
+    parser.add_argument("--resolution", type=int, default=1080, help="frame height for Advanced preprocessing")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--weights", default=None, help="OOBNet checkpoint (default: random weights)")
+    parser.add_argument("--output", metavar="JSON")
+    parser.add_argument("--run-config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_config:
+        print(json.dumps(bench_config(json.loads(args.run_config))))
+        return
+
+    report = {"host": {"cpu_count": cpu_count, "platform": sys.platform}, "configs": []}
+    for backend in args.backends:
+        for threads in args.threads:
+            config = {"backend": backend, "threads": threads, "batch_sizes": args.batch_sizes,
+                      "resolution": args.resolution, "repeats": args.repeats, "weights": args.weights}
+            proc = subprocess.run([sys.executable, "-m", "benchmarks.inference", "--run-config", json.dumps(config)],
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{backend} with {threads} threads failed:\n{proc.stderr[-2000:]}", file=sys.stderr)
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            report["configs"].append(result)
+
+            pre = result["preprocess"]
+            print(f"\n{backend}, {threads} threads: load {result['load_ms']:.0f} ms, preprocess "
+                  + ", ".join(f"{k.replace('_ms_per_frame', '')} {v:.2f} ms/frame" for k, v in pre.items()))
+            print(f"{'batch':>6} {'backbone fps':>13} {'lstm fps':>10} {'fps':>8}")
+            for batch_size, b in result["batches"].items():
+                print(f"{batch_size:>6} {b['backbone_fps']:>13.0f} {b['lstm_fps']:>10.0f} {b['fps']:>8.0f}")
+            print(f"suggested buffer size: {result['recommended_buffer_size']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
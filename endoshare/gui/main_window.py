@@ -11,6 +11,7 @@ from .video_merger import VideoMergerApp
 from .settings import AppSettings
 from .info import Info
 from .help import Help
+from .video_threads import AutoTuneThread
 from .settings import AppSettings
 
 
@@ -52,6 +53,9 @@ from ..utils.resources import (
     ICON_COLORS,
 )
 from ..utils.types import ProcessingMode
+from ..utils import tuning
+from ..utils.governor import governor
+from ..utils.prometheus import exporter
 class MainApp(QMainWindow):
     
 
@@ -69,6 +73,7 @@ class MainApp(QMainWindow):
         self.stacked_widget = QStackedWidget(self.central_widget)
         self.frames = {}
         # self.initialize_frames()
+        self.autotune_thread = None
 
         self.mainlogo = None
 
@@ -87,8 +92,16 @@ class MainApp(QMainWindow):
             "local_folder_path": "",
             "shared_folder_path": "",
             "purge_after": False,
+            "backend": "keras",
+            "inference_shards": 1,
+            "buffer_size": 64,
+            "scratch_folder_path": "",
         }
         self.load_settings()
+        # TensorFlow thread pools can only be set before the first op runs
+        governor().configure_tensorflow()
+        # the metrics endpoint, if configured, is up before the first job
+        exporter()
 
         self.init_ui()
 
@@ -97,6 +110,7 @@ class MainApp(QMainWindow):
     def retrieve_system_hardware(self) -> str:
         return f"""
         {platform.platform()} {platform.system()} {platform.processor()} GPUs available={tf.config.list_physical_devices('GPU')} RAM={round(psutil.virtual_memory().total / (1024.0 **3))}GB
+        {governor().describe()}
         """
     def closeEvent(self, event):
             # look up your merger frame and its thread
@@ -147,8 +161,13 @@ class MainApp(QMainWindow):
         local_path  = os.path.expanduser(local_path)
         shared_path = os.path.expanduser(shared_path)
         self.runtime_settings['purge_after'] = settings.get('purge_after', False)
+        self.runtime_settings['backend'] = settings.get('inference_backend', 'keras')
+        self.runtime_settings['inference_shards'] = int(settings.get('inference_shards', 1))
+        # frames per Advanced-mode batch; see benchmarks/inference.py
+        self.runtime_settings['buffer_size'] = tuning.setting(settings, 'inference_buffer_size', 64)
         self.runtime_settings['local_folder_path'] = local_path
         self.runtime_settings['shared_folder_path'] = shared_path
+        self.runtime_settings['scratch_folder_path'] = os.path.expanduser(settings.get('scratch_folder_path', '') or '')
 
 
         # now set up your logger into the shared folder
@@ -315,6 +334,32 @@ class MainApp(QMainWindow):
             frame.mode_changed.connect(self.frames[VideoMergerApp].update_ready_label)
 
     
+    def start_autotune(self):
+        # measure batch size and thread counts for this machine; see
+        # processing/autotune.py
+        if self.autotune_thread is not None:
+            return
+        self.autotune_thread = AutoTuneThread(self.runtime_settings.get("backend", "keras"), self)
+        self.autotune_thread.done.connect(self.on_autotune_finished)
+        self.autotune_thread.done.connect(self.access_video_merger_frame().on_autotune_finished)
+        self.autotune_thread.done.connect(self.access_app_settings_frame().on_autotune_finished)
+        self.autotune_thread.start()
+
+    def stop_autotune(self):
+        # processing has the machine first; the trial running is stopped
+        # too. An unfinished tuning can be run again from the settings
+        if self.autotune_thread is not None:
+            self.autotune_thread.stop()
+
+    def on_autotune_finished(self, ok, detail):
+        self.autotune_thread.wait()
+        self.autotune_thread = None
+        if ok:
+            # the buffer size applies to the next job, thread pools and
+            # ffmpeg limits to the next start
+            self.runtime_settings['buffer_size'] = tuning.setting(tuning.load_settings(), 'inference_buffer_size', 64)
+            logger.log(LOG_PERSIST, f"Tuned for this machine: {detail}")
+
     def access_video_merger_frame(self):
         # Access the VideoMergerApp frame
         video_merger_frame = self.stacked_widget.widget(0)
@@ -30,7 +30,10 @@ from ..utils.resources import (
     resource_path,
     load_icon,
 )
+from ..utils import tuning
 from ..utils.types import ProcessingMode
+from ..processing.engine import BACKENDS
+from ..processing.tflite_backend import has_calibration_frames
 
 class AppSettings(QWidget):
     mode_changed = pyqtSignal(str)  # emits "Fast" or "Advanced"
@@ -105,6 +108,26 @@ class AppSettings(QWidget):
         shared_row.addWidget(self.shared_usage_label)
         form.addRow("De-identified Output:", shared_row)
 
+        # --- Scratch (temporary frames, segments, staged copies) row ---
+        self.scratch_folder_entry = QLineEdit()
+        self.scratch_folder_entry.setReadOnly(True)
+        self.scratch_folder_entry.setMinimumWidth(400)
+        self.scratch_folder_entry.setPlaceholderText("Default: next to the archive output")
+        browse_scratch_btn = QPushButton("Browse…")
+        browse_scratch_btn.setToolTip("Select a fast local folder (NVMe, tmpfs) for temporary files")
+        browse_scratch_btn.setIcon(load_icon("folder_open_24dp_1F1F1F_FILL0_wght400_GRAD0_opsz24.svg"))
+        browse_scratch_btn.clicked.connect(self.select_scratch_folder)
+        clear_scratch_btn = QPushButton("Default")
+        clear_scratch_btn.setToolTip("Keep temporary files next to the archive output")
+        clear_scratch_btn.clicked.connect(self.scratch_folder_entry.clear)
+        self.scratch_usage_label = QLabel()
+        scratch_row = QHBoxLayout()
+        scratch_row.addWidget(self.scratch_folder_entry)
+        scratch_row.addWidget(browse_scratch_btn)
+        scratch_row.addWidget(clear_scratch_btn)
+        scratch_row.addWidget(self.scratch_usage_label)
+        form.addRow("Scratch Folder:", scratch_row)
+
         # --- SAVE + ARCHIVE MODE ON SAME LINE ---
         save_button = QPushButton("Save Settings")
         save_button.setIcon(load_icon("save_24dp_1F1F1F_FILL0_wght400_GRAD0_opsz24.svg"))
@@ -131,6 +154,7 @@ class AppSettings(QWidget):
         # --- hook validation ---
         self.local_folder_entry.textChanged.connect(self.archive_entry_changed)
         self.shared_folder_entry.textChanged.connect(self.archive_entry_changed)
+        self.scratch_folder_entry.textChanged.connect(self.archive_entry_changed)
 
 
         # MODE & SETTINGS
@@ -196,7 +220,44 @@ class AppSettings(QWidget):
 
         mode_layout.addWidget(mode_stack)
 
-        # 3) Wire combo → stacked pages + runtime_settings
+        # 3) Inference backend (applies to both modes)
+        backend_labels = {
+            "keras": "Standard (float32)",
+            "tflite-fp16": "TFLite float16",
+            "tflite-int8": "TFLite int8 (fastest on CPU)",
+        }
+        backend_row = QHBoxLayout()
+        backend_row.addWidget(QLabel("Inference backend:"))
+        self.backend_combo = QComboBox()
+        for b in BACKENDS:
+            self.backend_combo.addItem(backend_labels[b], b)
+        if not has_calibration_frames():
+            # int8 cannot be calibrated and would silently run float32
+            idx = self.backend_combo.findData("tflite-int8")
+            self.backend_combo.setItemText(idx, "TFLite int8 (needs calibration frames)")
+            self.backend_combo.model().item(idx).setEnabled(False)
+        self.backend_combo.setCurrentIndex(
+            max(0, self.backend_combo.findData(self.controller.runtime_settings.get("backend", "keras")))
+        )
+        self.backend_combo.currentIndexChanged.connect(
+            lambda idx: self.controller.runtime_settings.__setitem__("backend", self.backend_combo.itemData(idx))
+        )
+        backend_row.addWidget(self.backend_combo)
+        backend_row.addStretch()
+        mode_layout.addLayout(backend_row)
+
+        # Batch size and thread counts, measured per machine
+        tune_row = QHBoxLayout()
+        self.tune_button = QPushButton("Tune for This Machine")
+        self.tune_button.setToolTip("Measure the fastest batch size and thread counts on this computer (a few minutes)")
+        self.tune_button.clicked.connect(self._on_tune_clicked)
+        tune_row.addWidget(self.tune_button)
+        self.tune_label = QLabel(self._tuning_summary())
+        self.tune_label.setWordWrap(True)
+        tune_row.addWidget(self.tune_label, 1)
+        mode_layout.addLayout(tune_row)
+
+        # 4) Wire combo → stacked pages + runtime_settings
         self.mode_combo.currentIndexChanged.connect(lambda idx: (
             mode_stack.setCurrentIndex(idx),
             self.controller.runtime_settings.__setitem__(
@@ -216,6 +277,7 @@ class AppSettings(QWidget):
         rt = self.controller.runtime_settings
         self.local_folder_entry.setText(rt.get("local_folder_path", ""))
         self.shared_folder_entry.setText(rt.get("shared_folder_path", ""))
+        self.scratch_folder_entry.setText(rt.get("scratch_folder_path", ""))
         self.purge_checkbox.setChecked(not rt.get("purge_after", False))
         self.archive_entry_changed()
 
@@ -258,33 +320,85 @@ class AppSettings(QWidget):
         else:
             self.shared_usage_label.setText("Invalid directory")
 
+        scratch = self.scratch_folder_entry.text()
+        valid_scratch = not scratch or os.path.isdir(scratch)
+        if scratch and valid_scratch:
+            free_gb = shutil.disk_usage(scratch).free // (1024**3)
+            self.scratch_usage_label.setText(f"{free_gb} GB free")
+        else:
+            self.scratch_usage_label.setText("" if valid_scratch else "Invalid directory")
+
         # Save logic: Archive Mode ON requires both, OFF only export
         if self.purge_checkbox.isChecked():  # Archive Mode ON
             save_enabled = valid_arch and valid_exp
         else:
             save_enabled = valid_exp
+        save_enabled = save_enabled and valid_scratch
 
         for w in self.findChildren(QPushButton):
             if w.text() == "Save Settings":
                 w.setEnabled(save_enabled)
                 break
 
+    def _tuning_summary(self):
+        settings = tuning.load_settings()
+        entry = tuning.tuned(settings)
+        if not entry:
+            return "Not tuned on this machine yet."
+        text = (
+            f"Tuned {entry.get('tuned_at', '')[:10]}: batch {entry.get('inference_buffer_size')}, "
+            f"inference {entry.get('inference_threads')}+{entry.get('inter_op_threads')} threads, "
+            f"{entry.get('max_parallel_ffmpeg')} ffmpeg at once"
+        )
+        overridden = [key for key in tuning.TUNED_KEYS if settings.get(key)]
+        if overridden:
+            text += f" (overridden in settings.json: {', '.join(overridden)})"
+        return text
+
+    def _on_tune_clicked(self):
+        if self.controller.access_video_merger_frame().processing_running():
+            self.tune_label.setText("Processing is running; tune once it has finished.")
+            return
+        self.tune_button.setEnabled(False)
+        self.tune_label.setText("Tuning…")
+        self.controller.start_autotune()
+
+    def on_autotune_finished(self, ok, detail):
+        self.tune_button.setEnabled(True)
+        if ok:
+            self.tune_label.setText(self._tuning_summary() + ". Thread counts apply from the next start.")
+        else:
+            self.tune_label.setText(f"Tuning did not finish: {detail}")
+
     def select_folder(self):
         path = QFileDialog.getExistingDirectory(self, "Select Raw Video Repository folder")
         if path:
             self.local_folder_entry.setText(path)
 
+    def select_scratch_folder(self):
+        path = QFileDialog.getExistingDirectory(self, "Select Scratch folder")
+        if path:
+            self.scratch_folder_entry.setText(path)
+
     def select1_folder(self):
         path = QFileDialog.getExistingDirectory(self, "Select De-identified Output folder")
         if path:
             self.shared_folder_entry.setText(path)
 
     def save_settings(self):
-        cfg = {
+        # keep keys this page does not edit
+        try:
+            with open(resource_path('settings.json')) as f:
+                cfg = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cfg = {}
+        cfg.update({
             'local_folder_path': self.local_folder_entry.text(),
             'shared_folder_path': self.shared_folder_entry.text(),
-            'purge_after': self.purge_checkbox.isChecked() == False  # inverted: Archive Mode ON => purge_after=False
-        }
+            'purge_after': self.purge_checkbox.isChecked() == False,  # inverted: Archive Mode ON => purge_after=False
+            'inference_backend': self.backend_combo.currentData(),
+            'scratch_folder_path': self.scratch_folder_entry.text(),
+        })
         # If Archive Mode is OFF, mirror de-id output into both
         if not self.purge_checkbox.isChecked():
             cfg['local_folder_path'] = cfg['shared_folder_path']
@@ -293,12 +407,14 @@ class AppSettings(QWidget):
         self.controller.runtime_settings["local_folder_path"] = cfg["local_folder_path"]
         self.controller.runtime_settings["shared_folder_path"] = cfg["shared_folder_path"]
         self.controller.runtime_settings["purge_after"] = cfg["purge_after"]
+        self.controller.runtime_settings["scratch_folder_path"] = cfg["scratch_folder_path"]
 
         with open(resource_path('settings.json'), 'w') as f:
             json.dump(cfg, f)
         # push into running frame: both get shared_folder if archive mode off
         self.videomerger.set_local_folder(cfg['local_folder_path'])
         self.videomerger.set_shared_folder(cfg['shared_folder_path'])
+        self.videomerger.set_scratch_folder(cfg['scratch_folder_path'])
         QMessageBox.information(self, "Settings Saved", "Your directories have been updated.")
 
 
@@ -310,5 +426,6 @@ class AppSettings(QWidget):
         # populate fields
         self.local_folder_entry.setText(cfg.get('local_folder_path',''))
         self.shared_folder_entry.setText(cfg.get('shared_folder_path',''))
+        self.scratch_folder_entry.setText(cfg.get('scratch_folder_path',''))
         self.purge_checkbox.setChecked(cfg.get('purge_after', False))
             
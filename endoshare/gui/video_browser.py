@@ -1,6 +1,8 @@
 import os
+import time
+from bisect import bisect
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtWidgets import (
     QWidget,
     QSizePolicy,
@@ -23,6 +25,80 @@ from loguru import logger
 
 VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.mpeg', '.mpg', '.ts', '.m2ts']
 
+# directory -> (mtime_ns, video files, subdirectories), reused while the
+# directory is unchanged: one stat instead of a listing on network shares
+_listing_cache = {}
+LISTING_CACHE_SIZE = 4096
+
+
+def is_video_file(name):
+    return os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS and not name.startswith('._')
+
+
+def list_directory(path):
+    """Return (video files, subdirectories) of one directory, cached."""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _listing_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+    files, dirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif is_video_file(entry.name) and entry.is_file():
+                    files.append(entry.path)
+            except OSError:
+                continue
+    files.sort()
+    dirs.sort()
+    if len(_listing_cache) >= LISTING_CACHE_SIZE:
+        _listing_cache.clear()
+    _listing_cache[path] = (mtime, files, dirs)
+    return files, dirs
+
+
+class FolderScanThread(QThread):
+    """Walks a folder tree off the GUI thread and streams the video files
+    it finds in batches. Stop it with requestInterruption()."""
+
+    found = pyqtSignal(list)
+    done = pyqtSignal(bool)  # False if the scan was cancelled
+
+    BATCH_SIZE = 200
+    BATCH_INTERVAL = 0.1  # seconds
+
+    def __init__(self, root_path, parent=None):
+        super().__init__(parent)
+        self.root_path = root_path
+
+    def run(self):
+        batch = []
+        last_emit = time.monotonic()
+        pending = [self.root_path]
+        while pending:
+            if self.isInterruptionRequested():
+                self.done.emit(False)
+                return
+            path = pending.pop()
+            try:
+                files, dirs = list_directory(path)
+            except OSError as exc:
+                logger.warning(f"Cannot list {path}: {exc}")
+                continue
+            batch.extend(files)
+            # depth-first, in name order
+            pending.extend(reversed(dirs))
+            if len(batch) >= self.BATCH_SIZE or (batch and time.monotonic() - last_emit >= self.BATCH_INTERVAL):
+                self.found.emit(batch)
+                batch = []
+                last_emit = time.monotonic()
+        if batch:
+            self.found.emit(batch)
+        self.done.emit(True)
+
+
 class VideoBrowser(QWidget):
     def __init__(self):
         super().__init__()
@@ -122,8 +198,11 @@ class VideoBrowser(QWidget):
         self.tree_view.clicked.connect(self.update_last_clicked_item)
 
         self.last_clicked_item = None
+        self.scan_thread = None
+        self._scanned_paths = []
 
     def populate_videos(self, folder):
+        self.cancel_scan()
         model = QFileSystemModel()
         model.setNameFilters([f"*{ext}" for ext in VIDEO_EXTENSIONS])
         model.setNameFilterDisables(False)
@@ -156,22 +235,50 @@ class VideoBrowser(QWidget):
                 break
 
     def add_all_videos(self):
-        all_videos = []
-        root_path = self.tree_view.model().rootPath()
-        for root, dirs, files in os.walk(root_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if (os.path.splitext(file_path)[1].lower() in VIDEO_EXTENSIONS
-                    and not os.path.basename(file_path).startswith('._')
-                ):
-                    all_videos.append(file_path)
-        all_videos.sort()
+        # the button doubles as "stop" while a scan is running
+        if self.scan_thread is not None:
+            self.cancel_scan()
+            return
+        model = self.tree_view.model()
+        root_path = model.rootPath() if model is not None else ""
+        if not root_path:
+            return
         self.selected_videos_list.clear()
-        for file_path in all_videos:
-            file_name = os.path.basename(file_path)
-            item = QListWidgetItem(file_name)
+        self._scanned_paths = []
+        self.scan_thread = FolderScanThread(root_path, self)
+        self.scan_thread.found.connect(self.on_videos_found)
+        self.scan_thread.done.connect(self.on_scan_done)
+        self.add_all_button.setText("Stop Scanning")
+        self.scan_thread.start()
+
+    def on_videos_found(self, paths):
+        # keep the list sorted by path, as a full scan followed by sort() would
+        for file_path in paths:
+            row = bisect(self._scanned_paths, file_path)
+            self._scanned_paths.insert(row, file_path)
+            item = QListWidgetItem(os.path.basename(file_path))
             item.setData(Qt.UserRole, file_path)
-            self.selected_videos_list.addItem(item)
+            self.selected_videos_list.insertItem(row, item)
+
+    def on_scan_done(self, completed):
+        logger.info(f"Folder scan found {len(self._scanned_paths)} videos")
+        if self.scan_thread is not None:
+            self.scan_thread.wait()
+            self.scan_thread = None
+        self.add_all_button.setText("Add All Videos")
+
+    def cancel_scan(self):
+        if self.scan_thread is None:
+            return
+        thread = self.scan_thread
+        self.scan_thread = None
+        # results still queued from the cancelled scan are dropped
+        thread.found.disconnect(self.on_videos_found)
+        thread.done.disconnect(self.on_scan_done)
+        thread.requestInterruption()
+        thread.finished.connect(thread.deleteLater)
+        logger.info(f"Folder scan cancelled after {len(self._scanned_paths)} videos")
+        self.add_all_button.setText("Add All Videos")
 
     def remove_selected_videos(self):
         for item in self.selected_videos_list.selectedItems():
@@ -1,18 +1,17 @@
 import os
 import json
-import time
 import shutil
 import datetime
 from pathlib import Path
-import cv2
 
 from loguru import logger
 
-import psutil
 from .video_browser import VideoBrowser
-from .video_threads import VideoCopyThread, VideoProcessThread, extract_vpt_args
+from .video_threads import (VideoCopyThread, VideoProcessThread, ModelWarmupThread, ProbeThread, CalibrationThread,
+                            extract_vpt_args)
 
 from PyQt5.QtCore import (
+    QThread,
     QTimer,
     Qt,
 )
@@ -40,7 +39,13 @@ from ..utils.resources import (
     load_icon,
 )
 
+from ..utils import tuning
 from ..utils.types import ProcessingMode
+from ..processing import timeplan
+from ..processing.staging import StagingArea
+
+# how long Terminate waits for processing to stop before killing the thread
+TERMINATE_TIMEOUT_MS = 15000
 
 class VideoMergerApp(QWidget):
     def __init__(self, parent, controller):
@@ -55,11 +60,20 @@ class VideoMergerApp(QWidget):
         self.local_folder = ""
         self.load_settings()
         self.video_dict = {}
+        # probed duration of every confirmed video, for the time estimate
+        self.video_durations = {}
+        self.staging = StagingArea(self.scratch_folder or None, checksum=self.staging_checksum) if self.stage_inputs else None
 
         # Declare thread instances as class variables
         self.video_copy_thread = None
+        # copy threads still staging files in the background
+        self.staging_threads = []
         self.video_merge_thread = None
         self.video_browser_thread = None
+        self.model_warmup_thread = None
+        self.probe_thread = None
+        self.calibration_thread = None
+        self._term_timer = None
         self.finished_threads = 0
         self.total_threads = 0
 
@@ -67,6 +81,9 @@ class VideoMergerApp(QWidget):
 
         self.init_ui()
 
+        # fires once the event loop is idle, i.e. after the window is shown
+        QTimer.singleShot(0, self.start_model_warmup)
+
     def onFolderProvided(self, folder):
         self.output_folder = folder
         # Recheck if output folder is provided
@@ -128,8 +145,23 @@ class VideoMergerApp(QWidget):
         self.patient_list_label = QLabel("Ready to Process", self)
         layout.addWidget(self.patient_list_label)
 
+        estimate_layout = QHBoxLayout()
+        self.estimate_label = QLabel("", self)
+        self.estimate_label.setStyleSheet("color: #757575;")
+        self.estimate_label.setWordWrap(True)
+        estimate_layout.addWidget(self.estimate_label, 1)
+        self.calibrate_button = QPushButton("Measure Speed", self)
+        self.calibrate_button.setToolTip("Process a one-minute test clip to calibrate the time estimate on this machine")
+        self.calibrate_button.clicked.connect(self.start_calibration)
+        estimate_layout.addWidget(self.calibrate_button)
+        layout.addLayout(estimate_layout)
+
         self.update_ready_label()
 
+        self.model_status_label = QLabel("Inference engine: waiting…", self)
+        self.model_status_label.setStyleSheet("color: #757575;")
+        layout.addWidget(self.model_status_label)
+
         self.name_list = QListWidget(self)
         self.name_list.setFixedHeight(150)
         layout.addWidget(self.name_list)
@@ -181,6 +213,39 @@ class VideoMergerApp(QWidget):
         self.move(100, 100)
 
 
+    def start_model_warmup(self):
+        if self.model_warmup_thread is not None:
+            return
+        self.model_status_label.setText("Inference engine: warming up…")
+        backend = self.controller.runtime_settings.get("backend", "keras")
+        self.model_warmup_thread = ModelWarmupThread(backend, self)
+        self.model_warmup_thread.ready.connect(self.on_model_warmup_finished)
+        self.model_warmup_thread.start()
+
+    def on_model_warmup_finished(self, ok, detail):
+        if ok:
+            self.model_status_label.setText(f"Inference engine: ready ({detail})")
+            self.model_status_label.setStyleSheet("color: #4CAF50;")
+        else:
+            self.model_status_label.setText("Inference engine: will load when processing starts")
+            self.model_status_label.setToolTip(detail)
+        # first start on this machine: tuning keeps every CPU busy for
+        # minutes, so it only starts by itself when the settings ask for it
+        settings = tuning.load_settings()
+        if tuning.needs_tuning(settings):
+            if settings.get("tune_on_first_start", False) and not self.processing_running():
+                self.model_status_label.setText(self.model_status_label.text() + ", tuning for this machine…")
+                self.controller.start_autotune()
+            else:
+                self.model_status_label.setText(self.model_status_label.text() + ", not tuned for this machine")
+
+    def on_autotune_finished(self, ok, detail):
+        text = self.model_status_label.text().replace(", tuning for this machine…", "")
+        self.model_status_label.setText(text)
+        if ok:
+            self.model_status_label.setText(text.replace(", not tuned for this machine", ""))
+            self.model_status_label.setToolTip(f"Tuned for this machine: {detail}")
+
     def reset_application(self):
         # Reset input fields and clear video list
         self.selected_folder = ""
@@ -188,6 +253,7 @@ class VideoMergerApp(QWidget):
         self.patient_name = ""
         self.video_items = []
         self.video_dict = {}
+        self.video_durations = {}
         self.patient_name_input.clear()
         self.selected_videos.clear()
         self.video_dict.clear()
@@ -202,12 +268,14 @@ class VideoMergerApp(QWidget):
         self.terminate_button.setEnabled(False)
         self.process_button.setEnabled(False)
         if hasattr(self, 'video_browser'):
+            self.video_browser.cancel_scan()
             # remove any model on the tree
             empty_model = QFileSystemModel()
             empty_model.setRootPath('')
             self.video_browser.tree_view.setModel(empty_model)
             self.video_browser.selected_videos_list.clear()
         self.load_settings()
+        self.reset_staging()
 
         # Reset threads
         if hasattr(self, 'video_copy_thread') and self.video_copy_thread is not None and self.video_copy_thread.isRunning():
@@ -216,6 +284,7 @@ class VideoMergerApp(QWidget):
         if hasattr(self, 'video_process_thread') and self.video_process_thread is not None and self.video_process_thread.isRunning():
             self.video_process_thread.quit()
             self.video_process_thread.wait()
+        self.update_estimate()
 
     def load_settings(self):
         try:
@@ -228,6 +297,19 @@ class VideoMergerApp(QWidget):
         # now pull the right keys
         self.local_folder  = settings.get('local_folder_path', '')
         self.shared_folder = settings.get('shared_folder_path', '')
+        self.stage_inputs  = settings.get('stage_inputs', True)
+        self.staging_checksum = settings.get('staging_checksum') or None
+        self.scratch_folder = settings.get('scratch_folder_path', '')
+
+    def reset_staging(self):
+        # drop every staged copy; copies in flight fail and their threads end
+        if getattr(self, "staging", None) is not None:
+            self.staging.close()
+        self.staging = StagingArea(self.scratch_folder or None, checksum=self.staging_checksum) if self.stage_inputs else None
+
+    def processing_running(self):
+        thread = getattr(self, "video_process_thread", None)
+        return thread is not None and thread.isRunning()
     
     
     def add_new_patient(self):
@@ -251,6 +333,7 @@ class VideoMergerApp(QWidget):
                 item = QListWidgetItem(self.patient_name)
                 item.setForeground(QColor("red"))
                 self.name_list.addItem(item)
+                self.update_estimate()
         self.folder_button.setEnabled(True)
         self.patient_name_input.setEnabled(True)
         self.select_button.setEnabled(True)
@@ -281,24 +364,6 @@ class VideoMergerApp(QWidget):
         # 2) reset UI state so the user can re‑start
         self.reset_application()
     
-    def _gather_resolutions(self, paths: list[str]) -> dict[str, tuple[int, int] | None]:
-        """
-        Return {path: (w,h)} for every video.
-        If a file cannot be opened, its value is None.
-        """
-        resolutions = {}
-        for p in paths:
-            cap = cv2.VideoCapture(p)
-            if not cap.isOpened():
-                resolutions[p] = None          # unreadable → flag as None
-            else:
-                res = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                    int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-                resolutions[p] = res
-            cap.release()
-        return resolutions
-
-        
     def copy_selected_videos(self):
         # Video Copy Thread is called when they confirm selected videos#
         if not self.selected_folder:
@@ -311,12 +376,46 @@ class VideoMergerApp(QWidget):
         self.folder_button.setEnabled(False)
         self.patient_name_input.setEnabled(False)
         self.select_button.setEnabled(False)
-        self.process_button.setEnabled(True)
+        # the probe adds the patient to video_dict when it finishes, so
+        # processing may only start after that
+        self.process_button.setEnabled(False)
         video_list = self.video_browser.get_selected_video_list()
         pending      = [video_list.item(i).data(Qt.UserRole) for i in range(video_list.count())]
 
-        # 🚦 collect resolutions
-        res_map      = self._gather_resolutions(pending)
+        # 🚦 collect resolutions on a worker pool; the rest of the
+        # confirmation continues in on_probe_finished
+        self.progress_bar.reset()
+        self.progress_label.setText(f"Checking {len(pending)} videos…")
+        self.probe_thread = ProbeThread(pending, parent=self)
+        self.probe_thread.probed.connect(self.on_video_probed)
+        self.probe_thread.results.connect(self.on_probe_finished)
+        self.probe_thread.start()
+
+    def refresh_process_button(self):
+        self.process_button.setEnabled(
+            bool(self.video_dict) and not self.processing_running() and self.calibration_thread is None
+        )
+
+    def on_video_probed(self, path, res, done, total):
+        name = Path(path).name
+        video_list = self.video_browser.get_selected_video_list()
+        for i in range(video_list.count()):
+            item = video_list.item(i)
+            if item.data(Qt.UserRole) == path:
+                if res is None:
+                    item.setForeground(QColor("red"))
+                    item.setToolTip("unreadable")
+                else:
+                    item.setToolTip(f"{res[0]} × {res[1]}")
+                break
+        status = "unreadable ❌" if res is None else f"{res[0]} × {res[1]}"
+        self.update_progress(done, total, f"Checked {name}: {status} ({done}/{total})", True)
+
+    def on_probe_finished(self, res_map):
+        self.probe_thread.wait()
+        self.video_durations.update(self.probe_thread.durations)
+        self.probe_thread = None
+        self.refresh_process_button()
         unique_sizes = {r for r in res_map.values() if r is not None}
 
         if len(unique_sizes) > 1 or None in res_map.values():
@@ -340,47 +439,65 @@ class VideoMergerApp(QWidget):
             self.folder_button.setEnabled(True)
             self.select_button.setEnabled(True)
             return 
-        if not video_list:
+        if not res_map:
             self.progress_bar.reset()
             self.progress_label.setText("Please add videos to continue!")
             self.select_button.setEnabled(True)
             return
-        for index in range(video_list.count()):
-            item = video_list.item(index)
-            self.selected_videos.append(item.data(Qt.UserRole))
+        # the videos as they were when confirmed, in list order
+        self.selected_videos.extend(res_map.keys())
 
         logger.info("selected_videos", len(self.selected_videos))
         
         # Initialize the video_copy_thread instance with selected videos
-        self.video_copy_thread = VideoCopyThread(self.selected_videos, self.selected_folder)
-        self.video_copy_thread.update_progress.connect(self.update_progress)
+        copy_thread = VideoCopyThread(self.selected_videos, self.selected_folder, self.staging)
+        copy_thread.update_progress.connect(self.on_staging_progress)
+        copy_thread.queued.connect(self.on_copy_queued)
+        #Clean up after connecting
+        copy_thread.finished.connect(self.cleanup_after_copy)
+        self.video_copy_thread = copy_thread
+        self.staging_threads.append(copy_thread)
 
         # Start the thread
-        self.video_copy_thread.start()
+        copy_thread.start()
         if not self.patient_name:
             self.progress_label.setText("Please enter a patient name.")
             return
-        self.video_dict[self.patient_name] = self.video_copy_thread.get_video_dict()
+        self.video_dict[self.patient_name] = copy_thread.get_video_dict()
         # Patient is added to name_list and color is set as red
         n_item = QListWidgetItem(self.patient_name)
         n_item.setForeground(QColor("red"))
         self.name_list.addItem(n_item)
+        self.refresh_process_button()
+        self.update_estimate()
         
-        #Clean up after connecting
-        self.video_copy_thread.finished.connect(self.cleanup_after_copy)
         if not self.selected_folder:
             return
         self.patient_name = self.patient_name_input.text()
 
        
-    def cleanup_after_copy(self):
-        # This method will be called when the video_copy_thread finishes
-        self.add_button.setEnabled(True)
-        self.video_copy_thread.quit()
-        self.video_copy_thread.wait()
-
+    def on_copy_queued(self):
+        # the copies go on in the background (the thread stays referenced in
+        # staging_threads), so the next patient can be added right away
+        if not self.processing_running():
+            self.add_button.setEnabled(True)
         self.video_copy_thread = None
 
+    def on_staging_progress(self, current, total, message, is_copying=True):
+        # processing owns the progress bar while it runs
+        if not self.processing_running():
+            self.update_progress(current, total, message, is_copying)
+
+    def cleanup_after_copy(self):
+        # This method will be called when a copy thread finishes
+        if not self.processing_running():
+            self.add_button.setEnabled(True)
+        for thread in [t for t in self.staging_threads if t.isFinished()]:
+            thread.wait()
+            self.staging_threads.remove(thread)
+        if self.video_copy_thread is not None and self.video_copy_thread.isFinished():
+            self.video_copy_thread = None
+
     def merge_files(self):
         
         logger.info(f"Processing started for {len(self.video_dict)} patients.")# Check if there are any videos to process
@@ -398,10 +515,15 @@ class VideoMergerApp(QWidget):
             self.progress_label.setText("Please add destination folders in the settings.")
             return
     
-        self.video_process_thread = VideoProcessThread(self.video_dict,
+        # a tuning still running would compete for the CPUs
+        self.controller.stop_autotune()
+        # the thread iterates its own copy; patients added meanwhile wait
+        # for the next run
+        self.video_process_thread = VideoProcessThread(dict(self.video_dict),
                                                        self.shared_folder,
                                                        self.local_folder,
                                                        **extract_vpt_args(self.controller.runtime_settings),
+                                                       staging=self.staging,
                                                        )
         self.select_button.setEnabled(False)
         self.add_button.setEnabled(False)
@@ -409,13 +531,16 @@ class VideoMergerApp(QWidget):
         self.terminate_button.setEnabled(True)
         self.remove_patient_button.setEnabled(False)
         self.process_button.setEnabled(False)
-        self.video_process_thread.update_progress.connect(self.update_progress)
+        self.calibrate_button.setEnabled(False)
+        self.video_process_thread.job_progress.connect(self.update_job_progress)
         self.video_process_thread.update_color.connect(self.update_color)
         self.video_process_thread.error.connect(self._on_processing_error)
 
-        self._progress_start = time.time()
-        self.video_process_thread.start()
+        # one process thread per run; cleanup_after_merge runs once it is done
+        self.total_threads = 1
+        self.finished_threads = 0
         self.video_process_thread.finished.connect(self.on_process_thread_finished)
+        self.video_process_thread.start()
         
 
 
@@ -431,10 +556,13 @@ class VideoMergerApp(QWidget):
 
     def cleanup_after_merge(self):
         # This method will be called when the video_merge_thread finishes
-        self.process_button.setEnabled(True)
+        self.calibrate_button.setEnabled(True)
         self.video_process_thread.quit()
         self.video_process_thread.wait()
         self.video_process_thread = None
+        self.refresh_process_button()
+        # the run just refined this machine's throughput
+        self.update_estimate()
 
     def update_color(self, item_text, color):
         # Find the item with the specified text
@@ -446,41 +574,20 @@ class VideoMergerApp(QWidget):
 
 
     def update_progress(self, current, total, message, is_copying=True):
-        # compute raw pct
-        if total > 0:
-            pct = int((current / total) * 100)
-        else:
-            pct = 0
-
-        # clamp to [0,100]
-        pct = max(0, min(100, pct))
-
-        # update bar
+        # copying and probing; processing reports through update_job_progress
+        pct = int((current / total) * 100) if total > 0 else 0
+        self.progress_bar.setValue(max(0, min(100, pct)))
+        self.progress_label.setText(message)
+
+    def update_job_progress(self, fraction, message, eta):
+        # the thread's ProgressModel already throttles, smooths and times it
+        pct = max(0, min(100, int(fraction * 100)))
         self.progress_bar.setValue(pct)
-
-        if is_copying:
-            self.progress_label.setText(message)
+        if eta >= 0:
+            eta_str = str(datetime.timedelta(seconds=int(eta)))
+            self.progress_label.setText(f"{message}\n{pct}%  •  ETA: {eta_str}")
         else:
-            # init timer if needed
-            if not hasattr(self, "_progress_start") or self._progress_start is None:
-                self._progress_start = time.time()
-            now     = time.time()
-            elapsed = now - self._progress_start
-
-            if current > 0:
-                total_est = elapsed * (total / current)
-                eta       = total_est - elapsed
-                eta_str   = str(datetime.timedelta(seconds=int(eta)))
-                text = f"{message}\n{pct}%  •  ETA: {eta_str}"
-            else:
-                text = f"{message}\n{pct}%"
-
-            self.progress_label.setText(text)
-
-        # clear the timer when done
-        if current >= total:
-            self._progress_start = None
-
+            self.progress_label.setText(f"{message}\n{pct}%")
 
     
     def set_shared_folder(self, folder_path):
@@ -494,6 +601,13 @@ class VideoMergerApp(QWidget):
     
     def get_local_folder(self):
         return self.local_folder
+
+    def set_scratch_folder(self, folder_path):
+        self.scratch_folder = folder_path
+        # staged copies move with the scratch folder; queued patients keep
+        # theirs until the next reset
+        if not self.video_dict:
+            self.reset_staging()
     
     def terminate_confirmation_dialog(self):
         confirmation = QMessageBox.question(
@@ -511,50 +625,40 @@ class VideoMergerApp(QWidget):
         if not thread or not thread.isRunning():
             return
 
-        # politely flag interruption
-        thread.requestInterruption()
+        finished = False
 
-        def _do_terminate():
-            # stop any pending timer
-            if hasattr(self, "_term_timer"):
+        def _finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            if self._term_timer is not None:
                 self._term_timer.stop()
-                del self._term_timer
-            thread.terminate()
-            self._cleanup_after_termination()
-
-        # see if ffmpeg is _right now_ in the process list
-        ffmpegs = [
-            p for p in psutil.process_iter(['name', 'cmdline'])
-            if p.info['name'] == 'ffmpeg'
-               or ('ffmpeg' in ' '.join(p.info.get('cmdline') or []))
-        ]
-
-        if ffmpegs:
-            # case A: it's already running → kill immediately
-            _do_terminate()
-        else:
-            # case B: no ffmpeg yet → wait for the _next_ spawn
-            QMessageBox.information(
-                self,
-                "Termination Deferred",
-                "I'll terminate as soon as the next encoding job starts."
-            )
-            self.progress_label.setText("Waiting to terminate the process...")
-            self._term_timer = QTimer(self)
-            self._term_timer.setInterval(1000)
-            def _poll_for_ffmpeg():
-                # once we see ffmpeg, do the kill
-                for p in psutil.process_iter(['name', 'cmdline']):
-                    if p.info['name'] == 'ffmpeg' \
-                       or ('ffmpeg' in ' '.join(p.info.get('cmdline') or [])):
-                        _do_terminate()
-                        return
-            self._term_timer.timeout.connect(_poll_for_ffmpeg)
-            self._term_timer.start()
-
-    def _cleanup_after_termination(self):
+                self._term_timer = None
+            self._cleanup_after_termination(thread)
+
+        def _force_terminate():
+            # last resort for a step that never reaches a cancellation point
+            if thread.isRunning():
+                logger.warning("Processing did not stop in time, killing the thread")
+                QThread.terminate(thread)
+                thread.wait()
+            _finish()
+
+        # signals exactly the ffmpeg processes this app started and stops
+        # pending work; the thread unwinds through ProcessingInterrupted
+        thread.finished.connect(_finish)
+        thread.terminate()
+        self.progress_label.setText("Terminating…")
+        self._term_timer = QTimer(self)
+        self._term_timer.setSingleShot(True)
+        self._term_timer.timeout.connect(_force_terminate)
+        self._term_timer.start(TERMINATE_TIMEOUT_MS)
+
+    def _cleanup_after_termination(self, thread=None):
+        thread = thread or self.video_process_thread
         # 1) remove any deid temp‐folders
-        for patient_id, vid_map in self.video_process_thread.video_in_root_dir.items():
+        for patient_id, vid_map in thread.video_in_root_dir.items():
             # vid_map keys are full paths to each original video
             for orig_path in vid_map.keys():
                 parent = Path(orig_path).parent
@@ -566,6 +670,8 @@ class VideoMergerApp(QWidget):
                         except Exception:
                             logger.exception(f"Failed to remove temp folder {entry}")
 
+        self.reset_staging()
+
         # 2) now do your normal UI cleanup
         self.patient_name_input.clear()
         self.video_dict.clear()
@@ -583,8 +689,11 @@ class VideoMergerApp(QWidget):
             if selected_item:
                 selected_patient_name = selected_item.text()
                 if selected_patient_name in self.video_dict:
+                    if self.staging is not None:
+                        self.staging.release(self.video_dict[selected_patient_name].values())
                     del self.video_dict[selected_patient_name]
                 self.name_list.takeItem(self.name_list.row(selected_item))
+                self.update_estimate()
                 logger.info("Patient removed")
                 self.progress_bar.reset()
                 self.progress_label.setText("Patient removed.")
@@ -600,4 +709,51 @@ class VideoMergerApp(QWidget):
             mode = self.controller.runtime_settings.get("mode", ProcessingMode.NORMAL)
             mode_str = "Fast" if mode == ProcessingMode.NORMAL else "Advanced"
         self.patient_list_label.setText(f"Ready to Process in {mode_str} Mode")
+        self.update_estimate()
+
+    def update_estimate(self):
+        # how long the queued patients take in the chosen mode, from the
+        # probed durations and this machine's measured throughput
+        mode = self.controller.runtime_settings.get("mode", ProcessingMode.NORMAL)
+        mode_str = "Fast" if mode == ProcessingMode.NORMAL else "Advanced"
+        durations = [
+            sum(self.video_durations.get(video, 0.0) for video in videos)
+            for videos in self.video_dict.values()
+        ]
+        if not durations:
+            self.estimate_label.setText("")
+            return
+        queued = f"{len(durations)} patient{'s' if len(durations) > 1 else ''}, " \
+                 f"{timeplan.format_duration(sum(durations))} of video"
+        seconds = timeplan.estimate(durations, mode)
+        if seconds is None:
+            self.estimate_label.setText(
+                f"{queued}. No {mode_str} mode run measured on this machine yet: "
+                "click Measure Speed for a time estimate."
+            )
+        else:
+            self.estimate_label.setText(f"{queued}: about {timeplan.format_duration(seconds)} in {mode_str} mode")
+
+    def start_calibration(self):
+        if self.processing_running() or self.calibration_thread is not None:
+            return
+        self.controller.stop_autotune()
+        self.calibration_thread = CalibrationThread(**extract_vpt_args(self.controller.runtime_settings))
+        self.calibration_thread.job_progress.connect(self.update_job_progress)
+        self.calibration_thread.error.connect(
+            lambda message: QMessageBox.warning(self, "Calibration failed", message)
+        )
+        self.calibration_thread.finished.connect(self.on_calibration_finished)
+        self.calibrate_button.setEnabled(False)
+        self.process_button.setEnabled(False)
+        self.calibration_thread.start()
+
+    def on_calibration_finished(self):
+        self.calibration_thread.wait()
+        self.calibration_thread = None
+        self.calibrate_button.setEnabled(True)
+        self.refresh_process_button()
+        self.progress_bar.reset()
+        self.progress_label.clear()
+        self.update_estimate()
 
@@ -7,7 +7,9 @@ import shutil
 from pathlib import Path
 import subprocess
 import csv
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
 
 import numpy as np
@@ -18,8 +20,19 @@ from tqdm import tqdm
 from vidgear.gears import WriteGear
 
 from ..utils.resources import FFMPEG_BIN, resource_path
+from ..utils.fileops import partial_path, publish
+from ..utils.metrics import JobMetrics
+from ..utils.registry import NameRegistry
+from ..utils.sampling import ResourceSampler
+from ..utils.subprocesses import ProcessRegistry, processes
+from ..utils.profiling import job_profiler, tensorflow_profile
+from ..utils.progress import ProgressModel, input_shares
+from ..utils.prometheus import exporter
+from ..utils.tracing import tracer
+from ..utils.governor import governor
 from ..utils.types import ProcessingMode, ProcessingInterrupted
-from ..processing import deid
+from ..processing import autotune, deid, diskplan, engine, timeplan
+from ..processing.vutils import STRIP_METADATA
 from .video_browser import VIDEO_EXTENSIONS
 from uuid import uuid4
 
@@ -36,38 +49,177 @@ def extract_vpt_args(rt: dict):
         "resolution": rt["resolution"],
         "mode": rt["mode"],
         "purge_after": rt.get("purge_after", False),
+        "backend": rt.get("backend", "keras"),
+        "shards": rt.get("inference_shards", 1),
+        "buffer_size": rt.get("buffer_size", 64),
+        "scratch_folder": rt.get("scratch_folder_path", ""),
     }
 
 ##########################Video Copy Thread for updating the video dictionary about the location; no need to save video################
 
 class VideoCopyThread(QThread):
     update_progress = pyqtSignal(int, int, str, bool)
+    queued = pyqtSignal()
 
-    def __init__(self, video_files, selected_folder):
+    def __init__(self, video_files, selected_folder, staging=None):
         super().__init__()
-        self.video_files = video_files  
+        self.video_files = list(video_files)
         self.selected_folder = selected_folder
-        self.video_dict = {}  # Dictionary to store the mapping of original file names to new names
+        self.staging = staging
+        # the mapping always points at the originals; VideoProcessThread
+        # swaps in the staged copies once they are ready
+        self.video_dict = {
+            video_file: os.path.join(self.selected_folder, video_file)
+            for video_file in self.video_files
+        }
 
     def run(self):
         total_videos = len(self.video_files)
-        logger.info("total_videos:", total_videos)
-        for i, video_file in enumerate(self.video_files):
-            self.video_dict[video_file] = os.path.join(self.selected_folder, video_file)
-            progress = int(((i + 1) / total_videos) * 100)
-            self.update_progress.emit(i + 1, total_videos, f"Arranging file {video_file}... ({progress}%)", True)
-        self.update_progress.emit(total_videos, total_videos, "Arranging completed successfully!" , True)
+        logger.info(f"total_videos: {total_videos}")
+        if self.staging is None:
+            for i, video_file in enumerate(self.video_files):
+                progress = int(((i + 1) / total_videos) * 100)
+                self.update_progress.emit(i + 1, total_videos, f"Arranging file {video_file}... ({progress}%)", True)
+            self.queued.emit()
+            self.update_progress.emit(total_videos, total_videos, "Arranging completed successfully!" , True)
+            return
+
+        jobs = dict(zip(self.staging.stage(list(self.video_dict.values())), self.video_files))
+        # the next patient can be added while these copies run
+        self.queued.emit()
+        self.update_progress.emit(0, total_videos, f"Staging {total_videos} files...", True)
+        for i, job in enumerate(as_completed(jobs)):
+            name = Path(jobs[job]).name
+            if job.cancelled() or job.exception() is not None:
+                message = f"Staging failed for {name}, it will be read in place ({i + 1}/{total_videos})"
+            else:
+                message = f"Staged {name} ({i + 1}/{total_videos})"
+            self.update_progress.emit(i + 1, total_videos, message, True)
+        self.update_progress.emit(total_videos, total_videos, "Staging completed successfully!", True)
 
     def get_video_dict(self):
         return self.video_dict
     
 
 
+#####################################Probe Thread, checks the resolution of the selected videos#######################
+
+def probe_video(path):
+    """((width, height), duration in seconds) of a video, or (None, 0.0)
+    if it cannot be opened."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None, 0.0
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        return ((int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))),
+                frames / fps if fps > 0 else 0.0)
+    finally:
+        cap.release()
+
+
+class ProbeThread(QThread):
+    """Opens the selected videos in parallel (cv2 releases the GIL while
+    demuxing) and reports each result as soon as it is known. The
+    durations are left in `durations` for the time estimate."""
+
+    probed = pyqtSignal(str, object, int, int)  # path, (w, h) or None, done, total
+    results = pyqtSignal(dict)                  # {path: (w, h) or None}, in input order
+
+    def __init__(self, paths, workers=8, parent=None):
+        super().__init__(parent)
+        self.paths = list(paths)
+        self.workers = workers
+        self.durations = {}
+
+    def run(self):
+        resolutions = {}
+        total = len(self.paths)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, total))) as pool:
+            jobs = {pool.submit(probe_video, p): p for p in self.paths}
+            for done, job in enumerate(as_completed(jobs), 1):
+                path = jobs[job]
+                try:
+                    resolutions[path], self.durations[path] = job.result()
+                except Exception as exc:
+                    logger.warning(f"Could not probe {Path(path).name}: {exc}")
+                    resolutions[path], self.durations[path] = None, 0.0
+                self.probed.emit(path, resolutions[path], done, total)
+        self.results.emit({p: resolutions[p] for p in self.paths})
+
+
+#####################################Model Warm-up Thread, started once the UI is idle#######################
+
+class ModelWarmupThread(QThread):
+    ready = pyqtSignal(bool, str)
+
+    def __init__(self, backend="keras", parent=None):
+        super().__init__(parent)
+        self.backend = backend
+
+    def run(self):
+        start_time = time.time()
+        try:
+            model = engine.shared_engine(self.backend)
+            model.warm_up()
+        except Exception as exc:
+            # not fatal: the engine will simply load on the first real call
+            logger.warning(f"Model warm-up failed: {exc}")
+            self.ready.emit(False, str(exc))
+            return
+        elapsed = time.time() - start_time
+        logger.info(f"Model warm-up finished in {elapsed:.2f} sec")
+        detail = f"{elapsed:.1f} s"
+        if self.backend != "keras" and not model.quantized:
+            # conversion failed (e.g. no int8 calibration frames)
+            detail += f", {self.backend} unavailable, running float32"
+        self.ready.emit(True, detail)
+
+
+#####################################Auto-tune Thread, measures batch size and thread counts for this machine#######################
+
+class AutoTuneThread(QThread):
+    # saved, summary or the reason it was not
+    done = pyqtSignal(bool, str)
+
+    def __init__(self, backend="keras", parent=None):
+        super().__init__(parent)
+        self.backend = backend
+        # the trial encodes are no job's: kept out of the job metrics and
+        # of a Terminate of processing
+        self.registry = ProcessRegistry()
+
+    def stop(self):
+        """Give up now, ending the trial that is running."""
+        self.requestInterruption()
+        self.registry.cancel()
+
+    def run(self):
+        try:
+            result = autotune.tune(self.backend, should_stop=self.isInterruptionRequested,
+                                   registry=self.registry)
+        except (autotune.TuningInterrupted, ProcessingInterrupted):
+            logger.info("Auto-tuning interrupted; it will run again on the next start")
+            self.done.emit(False, "interrupted")
+            return
+        except Exception as exc:
+            logger.warning(f"Auto-tuning failed: {exc}")
+            self.done.emit(False, str(exc))
+            return
+        self.done.emit(True, (
+            f"batch {result['inference_buffer_size']}, "
+            f"inference {result['inference_threads']}+{result['inter_op_threads']} threads, "
+            f"{result['max_parallel_ffmpeg']} ffmpeg at once"
+        ))
+
+
 #####################################Video Process Thread for OOB detection, merging and deidentification#######################
 
 
 class VideoProcessThread(QThread):
-    update_progress = pyqtSignal(int, int, str, bool)
+    # fraction of the whole run, message, ETA in seconds (-1 while unknown)
+    job_progress = pyqtSignal(float, str, float)
     update_color = pyqtSignal(str, str)
     error           = pyqtSignal(str)
 
@@ -75,7 +227,12 @@ class VideoProcessThread(QThread):
                  fps,
                  resolution,
                  mode,
-                 purge_after=False
+                 purge_after=False,
+                 backend="keras",
+                 shards=1,
+                 buffer_size=64,
+                 scratch_folder="",
+                 staging=None,
                  ):
         super().__init__()
         
@@ -101,50 +258,44 @@ class VideoProcessThread(QThread):
         self.device = "/cpu:0"
         self.out_final = shared_folder  ## needs to be changed with hone settings
         self.name_translation_filename = os.path.join(local_folder, "./patientID_log.csv") ## needs to be changed from settings
+        self.name_registry_filename = os.path.join(local_folder, "patientID_log.sqlite3")
         self.patient_name = ""
         self.crf = 20   ## needs to be changed from settings
         self.fps = fps
         self.resolution = resolution
         self.processing_mode = mode
-        self.buffer_size=2048
+        self.buffer_size = buffer_size
         self.default_output_folder = local_folder
         self.purge_after = purge_after
+        self.backend = backend
+        self.shards = shards
+        self.scratch_folder = scratch_folder
+        self.staging = staging
+        # replaced for every patient in run()
+        self.metrics = JobMetrics(None)
+        # replaced by the run's model in run()
+        self.progress = ProgressModel(mode=mode)
+        # completed jobs feed this machine's throughput for the time estimate
+        self.throughput_source = "run"
 
     def preprocess(self, image, shape=[64, 64]):
-        with tf.device(self.device):
+        with governor().device(self.device):
             image = tf.cast(image, tf.float32)
             image = tf.image.resize(image, shape)
             image = tf.reshape(image, shape + [3])
             image = tf.keras.applications.mobilenet_v2.preprocess_input(image)
             return tf.expand_dims(image, 0)
 
-    def build_model(self, input_shape=[64, 64]):
-        model = tf.keras.models.Sequential()
-        model.add(tf.keras.layers.Input(input_shape + [3], dtype=tf.float32))
-        model.add(
-            tf.keras.applications.MobileNetV2(
-                input_shape=input_shape + [3], alpha=1.0, include_top=False, weights=None
-            )
-        )
-        model.add(tf.keras.layers.Flatten())
-        model.add(tf.keras.layers.LayerNormalization())
-        model.add(tf.keras.layers.Dropout(0))
-        model.add(tf.keras.layers.Lambda(lambda x: tf.expand_dims(x, 0)))
-        model.add(tf.keras.layers.LSTM(units=640, return_sequences=True, stateful=True))
-        model.add(tf.keras.layers.LayerNormalization())
-        model.add(tf.keras.layers.Dense(1, activation="sigmoid"))
-        return model
-    
     def terminate(self):
         """
-        When the user hits Terminate:
-          • In ADVANCED mode → soft‑stop so we don’t crash WriteGear.
-          • In NORMAL mode   → fall back to the old hard kill.
+        When the user hits Terminate: soft-stop in both modes. Every
+        tracked ffmpeg child is signalled right away and nothing new is
+        started; the running step raises ProcessingInterrupted and run()
+        returns. In ADVANCED mode WriteGear is closed as well.
         """
+        self.requestInterruption()
+        processes().cancel()
         if self.processing_mode == ProcessingMode.ADVANCED:
-            # soft stop
-            self.requestInterruption()
-
             # close WriteGear if it’s up
             vg = getattr(self, "_vg", None)
             if vg:
@@ -158,9 +309,6 @@ class VideoProcessThread(QThread):
                 except: pass
 
             # don’t call super().terminate() here
-        else:
-            # normal mode: do exactly what you had before
-            super().terminate()
 
     def run_fast_inference(
         self,
@@ -170,28 +318,32 @@ class VideoProcessThread(QThread):
         ckpt_path,
         buffer_size,
         device,
-        curr_progress,
-        max_progress,
+        out_video_path=None,
+        work_dir=None,
     ):
         video_names = list(video_in_root_dir.values())
 
-        self.update_progress.emit(curr_progress, max_progress, "Processing started for " + self.patient_name , False)
         start_time = time.time()
         
-        file_name, file_ext = os.path.splitext(video_names[0])
-        out_name = file_name.split(".")[0]
-        out_ext = file_ext[1:]
-        out_video_path = os.path.join(
-            video_out_root_dir, self.patient_name + "."+ out_ext
-        )
-
-        deid.process_video([Path(p) for p in video_names], Path(out_video_path), logger, self.update_progress, curr_progress, max_progress)
+        if out_video_path is None:
+            file_name, file_ext = os.path.splitext(video_names[0])
+            out_video_path = os.path.join(
+                video_out_root_dir, self.patient_name + file_ext
+            )
+
+        # the final merge drops the metadata, so its output can be shared as is
+        deid.process_video([Path(p) for p in video_names], Path(out_video_path), logger, self.progress,
+                           engine=engine.shared_engine(self.backend), shards=self.shards,
+                           strip_metadata=True, work_dir=Path(work_dir or video_out_root_dir),
+                           metrics=self.metrics)
         end_time = time.time()
 
         # Video duration
-        video      = cv2.VideoCapture(out_video_path)
-        framecount = video.get(cv2.CAP_PROP_FRAME_COUNT) or 0
-        fps        = video.get(cv2.CAP_PROP_FPS) or 0
+        with self.metrics.stage("probe"):
+            video      = cv2.VideoCapture(str(out_video_path))
+            framecount = video.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+            fps        = video.get(cv2.CAP_PROP_FPS) or 0
+            video.release()
         if fps > 0:
             video_duration = framecount / fps
         else:
@@ -209,8 +361,6 @@ class VideoProcessThread(QThread):
         else:
             logger.log(LOG_PERSIST, "processing speed: N/A (zero elapsed time)")
 
-        # Emit the signal to update the progress bar in the main GUI thread
-        self.update_progress.emit(curr_progress+len(video_names), max_progress, "Processing completed for " + self.patient_name , False)
         # Emit the signal to update the color of the patient in the name_list 
         self.update_color.emit(self.patient_name, "green")
 
@@ -222,21 +372,19 @@ class VideoProcessThread(QThread):
         ckpt_path,
         buffer_size,
         device,
-        curr_progress,
-        max_progress,
+        out_video_path=None,
     ):
         videos_duration = 0
         write_out_video = True
-        # build the model
+        # the shared engine is normally warm already; it only loads here
+        # if processing starts before the background warm-up finished
         counter = 0
-        with tf.device(device):
-            model = self.build_model()
-            model.load_weights(ckpt_path)
+        model = engine.shared_engine(self.backend)
+        model.reset()
         init_once = True
         
         video_names = list(video_in_root_dir.values())
        
-        self.update_progress.emit(curr_progress, max_progress, "Processing started for " + self.patient_name , False)
         start_time = time.time()
         rescaled_size = None
         total_chunks = 0
@@ -245,7 +393,7 @@ class VideoProcessThread(QThread):
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             cap.release()
             total_chunks += math.ceil(frame_count / buffer_size)
-        self._total_units = total_chunks
+        self._total_units = max(1, total_chunks)
         self._processed_units = 0
 
         
@@ -282,9 +430,10 @@ class VideoProcessThread(QThread):
                 out_name = file_name.split(".")[0]
                 out_ext = file_ext[1:]
                 #out_name, out_ext = os.path.basename(in_video_path).split(".")
-                out_video_path = os.path.join(
-                    video_out_root_dir, self.patient_name + "." + out_ext
-                )
+                if out_video_path is None:
+                    out_video_path = os.path.join(
+                        video_out_root_dir, self.patient_name + "." + out_ext
+                    )
                 fps = video_in.get(cv2.CAP_PROP_FPS)
                 logger.info(f"fps: {self.fps}, resolution: {self.resolution}p")
                 
@@ -302,7 +451,10 @@ class VideoProcessThread(QThread):
                 output_params = {
                     "-pix_fmt": "yuv420p",
                     "-input_framerate": self.fps,
+                    "-threads": governor().ffmpeg_threads["encode"],
                 }
+                # write the output without metadata, ready to be shared
+                output_params.update(zip(STRIP_METADATA[::2], STRIP_METADATA[1::2]))
 
                 if sys.platform == "darwin":
                     output_params.update({
@@ -324,7 +476,7 @@ class VideoProcessThread(QThread):
                     if rescaled_width%2 != 0:
                         rescaled_width += 1
                     rescaled_size = (int(rescaled_width), self.resolution)
-                video_out = WriteGear(output=out_video_path, logging=False, compression_mode=True, **output_params) 
+                video_out = WriteGear(output=str(out_video_path), logging=False, compression_mode=True, **output_params) 
 
             video_nframes = int(video_in.get(cv2.CAP_PROP_FRAME_COUNT))
             pred_history = []
@@ -356,19 +508,20 @@ class VideoProcessThread(QThread):
                             orig_image_buffer[image_count] = frame
                         image_count += 1
                         if len(image_buffer) == buffer_size:
-                            with tf.device(device):
+                            with self.metrics.stage("inference"):
                                 image_batch = tf.concat(image_buffer, axis=0)
-                                prediction = model(image_batch)
-                            preds = np.round(prediction.numpy()[0, :, 0]).astype(np.uint8)
-                            orig_image_buffer[preds.astype(bool)] = np.zeros_like(orig_image_buffer[preds.astype(bool)])
-                            
-                            for frame in orig_image_buffer:
-                                if rescaled_size is not None:
-                                    frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
-                                # Adjust for FPS-change.
-                                if frame_index % frame_interval < 1:
-                                    video_out.write(frame)
-                                frame_index += 1
+                                preds = np.round(model.predict(image_batch)).astype(np.uint8)
+                            exporter().add_frames(len(preds))
+                            with self.metrics.stage("rendering"):
+                                orig_image_buffer[preds.astype(bool)] = np.zeros_like(orig_image_buffer[preds.astype(bool)])
+
+                                for frame in orig_image_buffer:
+                                    if rescaled_size is not None:
+                                        frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
+                                    # Adjust for FPS-change.
+                                    if frame_index % frame_interval < 1:
+                                        video_out.write(frame)
+                                    frame_index += 1
                             pred_history += preds.tolist()
                             image_buffer = []
                             image_count = 0
@@ -377,33 +530,35 @@ class VideoProcessThread(QThread):
                             ####Need to add to log################
                             # Emit the signal to update the progress bar in the main GUI thread
                             self._processed_units += 1
-                            self.update_progress.emit(self._processed_units,
-                                                    self._total_units,
-                                                    f"Processing {self.patient_name} ({i+1}/{len(video_names)})…",
-                                                    False)
+                            self.progress.report("processing", self._processed_units / self._total_units,
+                                                 f"Processing {self.patient_name} ({i+1}/{len(video_names)})…")
                     else:
                         # at end of file, also obey interruption
                         if self.isInterruptionRequested():
-                            break
+                            logger.info("Advanced inference interrupted at end of video.")
+                            video_out.close()
+                            pbar.close()
+                            raise ProcessingInterrupted()
                         if len(image_buffer) > 0:
-                            with tf.device(self.device):
+                            with self.metrics.stage("inference"):
                                 image_batch = tf.concat(image_buffer, axis=0)
-                                prediction = model(image_batch)
-                            preds = np.round(prediction.numpy()[0, :, 0]).astype(np.uint8)
-                            orig_image_buffer_write = deepcopy(
-                                orig_image_buffer[:image_count]
-                            )
-                            orig_image_buffer_write[preds.astype(bool)] = (
-                                orig_image_buffer_write[preds.astype(bool)]
-                                .mean(1)
-                                .mean(1)
-                                .reshape(preds.sum(), 1, 1, 3)
-                            )
-                           
-                            for frame in orig_image_buffer_write:
-                                if rescaled_size is not None:
-                                    frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
-                                video_out.write(frame)
+                                preds = np.round(model.predict(image_batch)).astype(np.uint8)
+                            exporter().add_frames(len(preds))
+                            with self.metrics.stage("rendering"):
+                                orig_image_buffer_write = deepcopy(
+                                    orig_image_buffer[:image_count]
+                                )
+                                orig_image_buffer_write[preds.astype(bool)] = (
+                                    orig_image_buffer_write[preds.astype(bool)]
+                                    .mean(1)
+                                    .mean(1)
+                                    .reshape(preds.sum(), 1, 1, 3)
+                                )
+
+                                for frame in orig_image_buffer_write:
+                                    if rescaled_size is not None:
+                                        frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
+                                    video_out.write(frame)
                             pred_history += preds.tolist()
                         break
             else:
@@ -423,23 +578,24 @@ class VideoProcessThread(QThread):
                             orig_image_buffer[image_count] = frame
                         image_count += 1
                         if len(image_buffer) == buffer_size:
-                            with tf.device(device):
+                            with self.metrics.stage("inference"):
                                 image_batch = tf.concat(image_buffer, axis=0)
-                                prediction = model(image_batch)
-                            preds = np.round(prediction.numpy()[0, :, 0]).astype(np.uint8)
-                            orig_image_buffer[preds.astype(bool)] = np.zeros_like(orig_image_buffer[preds.astype(bool)])
-                            #orig_image_buffer[preds.astype(bool)] = (
-                            #    orig_image_buffer[preds.astype(bool)]
-                            #    .mean(1)
-                            #    .mean(1)
-                            #    .reshape(preds.sum(), 1, 1, 3)
-                            #)
-                            
-                            for frame in orig_image_buffer:
-                                if rescaled_size is not None:
-                                    frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
-                                # Don't adjust for FPS-change...
-                                video_out.write(frame)
+                                preds = np.round(model.predict(image_batch)).astype(np.uint8)
+                            exporter().add_frames(len(preds))
+                            with self.metrics.stage("rendering"):
+                                orig_image_buffer[preds.astype(bool)] = np.zeros_like(orig_image_buffer[preds.astype(bool)])
+                                #orig_image_buffer[preds.astype(bool)] = (
+                                #    orig_image_buffer[preds.astype(bool)]
+                                #    .mean(1)
+                                #    .mean(1)
+                                #    .reshape(preds.sum(), 1, 1, 3)
+                                #)
+
+                                for frame in orig_image_buffer:
+                                    if rescaled_size is not None:
+                                        frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
+                                    # Don't adjust for FPS-change...
+                                    video_out.write(frame)
                             pred_history += preds.tolist()
                             image_buffer = []
                             image_count = 0
@@ -448,30 +604,29 @@ class VideoProcessThread(QThread):
                             ####Need to add to log################
                             # Emit the signal to update the progress bar in the main GUI thread
                             self._processed_units += 1
-                            self.update_progress.emit(self._processed_units,
-                                                    self._total_units,
-                                                    f"Processing {self.patient_name} ({i+1}/{len(video_names)})…",
-                                                    False)
+                            self.progress.report("processing", self._processed_units / self._total_units,
+                                                 f"Processing {self.patient_name} ({i+1}/{len(video_names)})…")
                     else:
                         if len(image_buffer) > 0:
-                            with tf.device(self.device):
+                            with self.metrics.stage("inference"):
                                 image_batch = tf.concat(image_buffer, axis=0)
-                                prediction = model(image_batch)
-                            preds = np.round(prediction.numpy()[0, :, 0]).astype(np.uint8)
-                            orig_image_buffer_write = deepcopy(
-                                orig_image_buffer[:image_count]
-                            )
-                            orig_image_buffer_write[preds.astype(bool)] = (
-                                orig_image_buffer_write[preds.astype(bool)]
-                                .mean(1)
-                                .mean(1)
-                                .reshape(preds.sum(), 1, 1, 3)
-                            )
-                           
-                            for frame in orig_image_buffer_write:
-                                if rescaled_size is not None:
-                                    frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
-                                video_out.write(frame)
+                                preds = np.round(model.predict(image_batch)).astype(np.uint8)
+                            exporter().add_frames(len(preds))
+                            with self.metrics.stage("rendering"):
+                                orig_image_buffer_write = deepcopy(
+                                    orig_image_buffer[:image_count]
+                                )
+                                orig_image_buffer_write[preds.astype(bool)] = (
+                                    orig_image_buffer_write[preds.astype(bool)]
+                                    .mean(1)
+                                    .mean(1)
+                                    .reshape(preds.sum(), 1, 1, 3)
+                                )
+
+                                for frame in orig_image_buffer_write:
+                                    if rescaled_size is not None:
+                                        frame = cv2.resize(frame, rescaled_size, interpolation=cv2.INTER_AREA)
+                                    video_out.write(frame)
                             pred_history += preds.tolist()
                         break
             
@@ -480,19 +635,18 @@ class VideoProcessThread(QThread):
                 try: video_out.close()
                 except: pass
                 pbar.close()
-                return
+                video_in.release()
+                raise ProcessingInterrupted()
 
             framecount = video_in.get(cv2.CAP_PROP_FRAME_COUNT)
             fps = video_in.get(cv2.CAP_PROP_FPS)
-            duration = (framecount/fps)/1000
+            duration = framecount / fps if fps > 0 else 0.0
             videos_duration += duration
             video_in.release()
             pbar.update(1)
             self._processed_units += 1
-            self.update_progress.emit(self._processed_units,
-                                    self._total_units,
-                                    f"Processing {self.patient_name} ({i+1}/{len(video_names)})…",
-                                    False)
+            self.progress.report("processing", self._processed_units / self._total_units,
+                                 f"Processing {self.patient_name} ({i+1}/{len(video_names)})…")
             progress = int((pbar.n / pbar.total * 100) if pbar.total != 0 else 0)
             self._vg   = None
             self._pbar = None
@@ -501,7 +655,7 @@ class VideoProcessThread(QThread):
             ####Need to add to log################
             # Emit the signal to update the progress bar in the main GUI thread
 
-            self.update_progress.emit(curr_progress+len(video_names), max_progress, f"Processing for {self.patient_name}, file {out_name}...", False)
+            self.progress.report("processing", message=f"Processing for {self.patient_name}, file {out_name}...")
 
         end_time = time.time()
 
@@ -510,14 +664,14 @@ class VideoProcessThread(QThread):
         elapsed = end_time - start_time
         if elapsed > 0:
             speed = videos_duration / elapsed
-            logger.log(LOG_PERSIST, f"processing speed: {speed:.2f} video_duration/processing_time")
+            logger.log(LOG_PERSIST, f"processing speed: {speed:.2f}× real time")
         else:
             logger.log(LOG_PERSIST, "processing speed: N/A (zero elapsed time)")
 
-        video_out.close()
+        # WriteGear flushes the encoder on close
+        with self.metrics.stage("rendering"):
+            video_out.close()
         pbar.close()
-        # Emit the signal to update the progress bar in the main GUI thread
-        self.update_progress.emit(curr_progress+len(video_names), max_progress, "Processing completed for " + self.patient_name , False)
         # Emit the signal to update the color of the patient in the name_list 
         self.update_color.emit(self.patient_name, "green")
 
@@ -601,6 +755,19 @@ class VideoProcessThread(QThread):
         return orig_to_random
 
 
+    def unused_anonymized_path(self, archive_path):
+        """Randomized output path whose name is neither in the name registry
+        nor in the output folder. The names are short enough to collide
+        over years of use, and publishing under a taken name would replace
+        another patient's video."""
+        with NameRegistry(self.name_registry_filename, self.name_translation_filename) as registry:
+            while True:
+                path = self.randomize_paths([archive_path], self.out_final, sequentialize=False)[archive_path]
+                if not registry.is_taken(path.stem) and not path.exists():
+                    return path
+                logger.info("Randomized name already taken, drawing another")
+
+
     def transpose_paths(self,paths, outdir):
         """Returns dict mapping each path in paths to a path from joining
         outdir with the basename of path."""
@@ -618,107 +785,56 @@ class VideoProcessThread(QThread):
         return [path for path in Path(vid_dir).rglob("*") if self.is_video_path(path)]
     
 
-    def strip_metadata(self, input_vid, output_vid):
-        """Strips metadata from input_vid and places stripped video in
-        output_vid. If successful returns output_vid's path, otherwise
-        returns 'FAILED'."""
-        command = [
-            FFMPEG_BIN,
-            "-nostdin",
-            # set input video
-            "-i",
-            str(input_vid),
-            # select all video streams
-            "-map",
-            "0:v",
-            # select all audio streams if present
-            "-map",
-            "0:a?",
-            # just copy streams, do not transcode (much faster and lossless)
-            "-c",
-            "copy",
-            # strip global metadata for the video container
-            "-map_metadata",
-            "-1",
-            # strip metadata for video stream
-            "-map_metadata:s:v",
-            "-1",
-            # strip metadata for audio stream
-            "-map_metadata:s:a",
-            "-1",
-            # remove any chapter information
-            "-map_chapters",
-            "-1",
-            # remove any disposition info
-            "-disposition",
-            "0",
-            str(output_vid),
-        ]
-
-        try:
-            subprocess.run(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=True,
-                text=True,
-            )
-        except subprocess.CalledProcessError as perr:
-            logger.error(f"ffmpeg failed to strip '{input_vid}' with output: {perr.stderr}")
-            # File failed to process so delete it is ffmpeg made an
-            # incomplete one
-            if output_vid.is_file():
-                output_vid.unlink()
-            return "FAILED"
-
-        return output_vid if output_vid.is_file() else None
-
-    def anonymize(self, video_in_root_dir, video_out_root_dir, name_translation_filename):
-        """Will strip metadata and optionally randomize filenames from a
-        directory of videos."""
-
-        vid_paths = self.get_video_paths(video_in_root_dir)
-        outdir = Path(video_out_root_dir)
-        outdir.mkdir(exist_ok=True)
-
-        name_translation_file_path = self.setup_name_translation_file(name_translation_filename)
-
-        vid_map = self.randomize_paths(vid_paths, outdir, sequentialize=False)
-        final_name = None
-
-        for orig_path, new_path in vid_map.items():
-            # strip metadata then save into the csv log file:
-            # orig_path,output (either new_path or "FAILED" if it was not successful)
-            final_name = self.strip_metadata(orig_path, new_path)
-
-            # Extract file names without extensions
-            orig_name = orig_path.stem
-            new_name = new_path.stem
-            
-            # Append to log file
-            with open(name_translation_file_path, mode='a', newline='') as name_translation_file:
-                name_translation_writer = csv.writer(name_translation_file)
-                name_translation_writer.writerow([orig_name, new_name])
-            logger.info(f"Anonymized into {new_path}.")
-
-        return final_name
-
-    
-    def run(self):
-        # ─── 0) Pre‑flight: verify every video can be opened ─────────────────
-        all_paths = [
-            p
-            for vid_map in self.video_in_root_dir.values()
-            for p in vid_map.values()
-        ]
-        for path in all_paths:
+    def anonymize(self, video_path, anonymized_path, translations, move=False):
+        """Publishes a processed video under its randomized name and adds
+        the translation to `translations`, a NameRegistry batch. The final
+        mux already wrote the video without metadata, so publishing is a
+        rename, reflink or hardlink whenever the filesystems allow it, and
+        an atomic copy otherwise."""
+        video_path = Path(video_path)
+        anonymized_path = Path(anonymized_path)
+
+        anonymized_path.parent.mkdir(exist_ok=True)
+        with self.metrics.stage("publish"):
+            method = publish(video_path, anonymized_path, move=move)
+        self.progress.report("publish", 1.0)
+
+        translations.append((self.patient_name, anonymized_path.stem))
+        logger.info(f"Anonymized into {anonymized_path} ({method}).")
+
+        return anonymized_path
+
+    def wait_for_staging(self, videos_iter):
+        """Return a copy of a patient's {original: path} mapping that points
+        at the staged copies, waiting for copies still in flight."""
+        if self.staging is None:
+            return dict(videos_iter)
+        pending = [p for p in videos_iter.values() if not self.staging.is_staged(p)]
+        if pending:
+            self.progress.report("staging", message=f"Waiting for {self.patient_name} to finish staging...")
+        staged = {orig: self.staging.wait(path) for orig, path in videos_iter.items()}
+        if self.staging.checksum_algorithm:
+            # in input order and without file names, which may carry the
+            # patient's ID; None where the original was read in place
+            self.metrics.info["input_checksums"] = {
+                "algorithm": self.staging.checksum_algorithm,
+                "digests": [self.staging.checksum(path) for path in videos_iter.values()],
+            }
+        return staged
+
+    def preflight(self, paths):
+        """Verify every video decodes; on failure report it and return False."""
+        paths = list(paths)
+        for n, path in enumerate(paths):
+            self.progress.report("preflight", n / len(paths), f"Checking {Path(path).name} ({n+1}/{len(paths)})…")
             cmd = [
                 FFMPEG_BIN, "-v", "error",
                 "-i", path,
                 "-f", "null", "-"   # decode but throw away frames
             ]
-            proc = subprocess.run(
+            proc = governor().run(
                 cmd,
+                "decode",
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True
@@ -732,15 +848,23 @@ class VideoProcessThread(QThread):
                     f"{snippet}\n\n"
                     "Processing aborted."
                 )
-                return
+                return False
+        self.progress.report("preflight", 1.0)
+        return True
 
+    def run(self):
+        # a previous Terminate leaves the registry cancelled
+        processes().reset()
         name_translation_file_path = self.setup_name_translation_file(self.name_translation_filename)
         ###############Iteration happens for #of Patients############################
-        n_all_videos = sum([len(videos_iter) for videos_iter in self.video_in_root_dir.values()])
-        curr_n_videos = 0
+        # one bar for the whole run, each patient weighted by its input size
+        self.progress = ProgressModel(self.job_progress.emit, input_shares(self.video_in_root_dir),
+                                      mode=self.processing_mode)
+        queued = len(self.video_in_root_dir)
         for patient_id, videos_iter in self.video_in_root_dir.items():
             if self.isInterruptionRequested():
                 break
+            exporter().set("endoshare_queue_patients", queued)
             temp_folder = self.default_output_folder
             os.makedirs(temp_folder, exist_ok=True)
             if not self.destination_folder:
@@ -755,39 +879,101 @@ class VideoProcessThread(QThread):
                 self.destination_folder = os.path.join(self.destination_folder, patient_id)
                 os.makedirs(self.destination_folder, exist_ok=True)
             self.patient_name = patient_id
+            self.progress.start_patient(patient_id, "Processing started for " + self.patient_name)
+
+            # with purge_after the archive copy would be deleted right away,
+            # so the output is written next to its randomized name under a
+            # hidden partial name and renamed into place once complete
+            sources = list(videos_iter.values())
+            out_ext = Path(sources[0]).suffix
+            archive_path = Path(self.destination_folder) / (self.patient_name + out_ext)
+            out_video_path = None
+            # frames and segments go to the scratch folder when one is set
+            work_dir = Path(self.scratch_folder) / patient_id if self.scratch_folder else Path(self.destination_folder)
+            # the metrics are filed under the anonymized name, never the
+            # patient's; it is set once the name is drawn
+            self.metrics = JobMetrics(None, mode=self.processing_mode.name,
+                                      backend=self.backend, videos=len(sources))
+            # what the finally block has to stop, once started
+            subscribed = False
+            profiler = sampler = None
 
             try:
-                for path in videos_iter.values():
-                    cap = cv2.VideoCapture(path)
-                    if not cap.isOpened():
+                anonymized_path = self.unused_anonymized_path(archive_path)
+                self.metrics.job_id = anonymized_path.stem
+                out_video_path = partial_path(anonymized_path) if self.purge_after else archive_path
+                Path(self.out_final).mkdir(exist_ok=True)
+                # exit status, CPU time and peak RSS of every ffmpeg of the job
+                processes().subscribe(self.metrics.add_process)
+                subscribed = True
+                # ENDOSHARE_PROFILE: profiles go next to the job's metrics
+                profiler = job_profiler(self.metrics.artifact_path(self.out_final, "_profile"))
+                profiler.start()
+                # CPU, memory, disk rates and scratch space, once a second
+                sampler = ResourceSampler(work_dir).start()
+
+                # staged copies are local, so the pre-flight decode no longer
+                # reads every recording from the source media an extra time
+                with self.metrics.stage("staging"):
+                    videos_iter = self.wait_for_staging(videos_iter)
+                self.progress.report("staging", 1.0)
+                with self.metrics.stage("preflight"):
+                    if not self.preflight(videos_iter.values()):
+                        self.metrics.status = "corrupt"
+                        return
+                # refuse the job up front rather than fill the disk halfway
+                with self.metrics.stage("probe"):
+                    plan = diskplan.estimate_job(list(videos_iter.values()), self.processing_mode)
+                    problems = diskplan.check_space(plan, work_dir, out_video_path.parent)
+                    self.metrics.info.update(input_bytes=plan["output"], duration_sec=plan["duration"])
+                    if problems:
+                        self.metrics.status = "no space"
+                        self.error.emit(
+                            f"Not enough disk space for {patient_id}:\n\n"
+                            + "\n".join(problems)
+                            + "\n\nProcessing aborted."
+                        )
+                        return
+                    work_dir.mkdir(parents=True, exist_ok=True)
+                    for path in videos_iter.values():
+                        cap = cv2.VideoCapture(path)
+                        if not cap.isOpened():
+                            cap.release()
+                            raise RuntimeError(f"Cannot open “{Path(path).name}”")
                         cap.release()
-                        raise RuntimeError(f"Cannot open “{Path(path).name}”")
-                    cap.release()
+                self.progress.report("probe", 1.0)
                     
                 if self.processing_mode == ProcessingMode.ADVANCED:
-                    self.run_advanced_inference(
-                        video_in_root_dir=videos_iter,
-                        video_out_root_dir=self.destination_folder,
-                        text_root_dir=self.destination_folder,
-                        ckpt_path=self.ckpt_path,
-                        buffer_size=64,
-                        device=self.device,
-                        curr_progress=curr_n_videos,
-                        max_progress=n_all_videos,
-                    )
+                    # decoding and preprocessing; the inference and rendering
+                    # of each batch are charged to their own stages
+                    with self.metrics.stage("extraction"), tensorflow_profile():
+                        self.run_advanced_inference(
+                            video_in_root_dir=videos_iter,
+                            video_out_root_dir=self.destination_folder,
+                            text_root_dir=self.destination_folder,
+                            ckpt_path=self.ckpt_path,
+                            buffer_size=self.buffer_size,
+                            device=self.device,
+                            out_video_path=out_video_path,
+                        )
                 elif self.processing_mode == ProcessingMode.NORMAL:
                     self.run_fast_inference(
                         video_in_root_dir=videos_iter,
                         video_out_root_dir=self.destination_folder,
                         text_root_dir=self.destination_folder,
                         ckpt_path=self.ckpt_path,
-                        buffer_size=64,
+                        buffer_size=self.buffer_size,
                         device=self.device,
-                        curr_progress=curr_n_videos,
-                        max_progress=n_all_videos,
+                        out_video_path=out_video_path,
+                        work_dir=work_dir,
                     )
-                curr_n_videos += len(videos_iter)
-                anonymized_video = self.anonymize(self.destination_folder, self.out_final, self.name_translation_filename)
+                # the patient's rows go into the registry (and the CSV) in
+                # one transaction
+                with self.metrics.stage("anonymize"), \
+                        NameRegistry(self.name_registry_filename, self.name_translation_filename) as registry, \
+                        registry.batch() as translations:
+                    anonymized_video = self.anonymize(out_video_path, anonymized_path, translations,
+                                                      move=self.purge_after)
                 if self.purge_after:
                     orig_folder = Path(self.default_output_folder) / self.patient_name
                     if orig_folder.exists():
@@ -796,16 +982,98 @@ class VideoProcessThread(QThread):
                             logger.info(f"Purged archive folder {orig_folder}")
                         except Exception as e:
                             logger.warning(f"Failed to purge archive folder {orig_folder}: {e}")
+                if self.staging is not None:
+                    self.staging.release(sources)
+                self.metrics.status = "completed"
+                self.progress.finish_patient("Processing completed for " + self.patient_name)
             
             except ProcessingInterrupted:
+                self.metrics.status = "interrupted"
                 logger.info(f"Processing aborted by user at patient {patient_id}")
+                if self.purge_after and out_video_path is not None:
+                    out_video_path.unlink(missing_ok=True)
                 return
             except Exception as exc:
+                self.metrics.status = "failed"
                 # log full traceback
                 logger.error(f"Error processing patient {patient_id}", exc_info=True)
                 # notify UI
                 self.error.emit(str(exc))
                 return
+            finally:
+                if profiler is not None:
+                    profiler.stop()
+                if subscribed:
+                    processes().unsubscribe(self.metrics.add_process)
+                if sampler is not None:
+                    self.metrics.info["resources"] = sampler.stop().report()
+                # the scratch folder is named after the patient: it goes
+                # whatever the outcome
+                if self.scratch_folder:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                # structured per-stage metrics go next to the log file
+                logger.log(LOG_PERSIST, self.metrics.summary())
+                if sampler is not None:
+                    logger.log(LOG_PERSIST, sampler.summary())
+                # a job that failed before its name was drawn has nowhere
+                # to be filed without the patient's name
+                if self.metrics.job_id is not None:
+                    self.metrics.write(self.out_final)
+                tracer().save()
+                report = self.metrics.to_dict()
+                exporter().job_finished(self.metrics.status, report["wall_sec"], report.get("duration_sec"))
+                if self.metrics.status == "completed":
+                    # waiting for the copies says nothing about this machine
+                    staging = report["stages"].get("staging", {}).get("wall_sec", 0.0)
+                    timeplan.record(self.processing_mode, report.get("duration_sec"),
+                                    report["wall_sec"] - staging, source=self.throughput_source)
+                # run() returns after any job that did not complete
+                queued = queued - 1 if self.metrics.status == "completed" else 0
+                exporter().set("endoshare_queue_patients", queued)
+                exporter().flush()
+        exporter().set("endoshare_queue_patients", 0)
+
+
+#####################################Calibration Thread, measures the machine's throughput#######################
+
+# seconds of synthetic 1080p video processed by a calibration run
+CALIBRATION_SECONDS = 60
+
+
+class CalibrationThread(VideoProcessThread):
+    """Measures this machine's throughput in the chosen mode before it has
+    processed any patient: a synthetic clip goes through the whole job in a
+    throwaway folder and is recorded like a real job. The clip has nothing
+    to blank out, so recordings with many out-of-body segments take a
+    little longer; every real job refines the figure."""
+
+    def __init__(self, **kwargs):
+        self.tmp_dir = tempfile.mkdtemp(prefix="endoshare_calibration_")
+        self.clip = os.path.join(self.tmp_dir, "input", "calibration.mp4")
+        super().__init__({"calibration": {self.clip: self.clip}},
+                         os.path.join(self.tmp_dir, "shared"), os.path.join(self.tmp_dir, "local"), **kwargs)
+        # the clip needs no cleaning of its own copy
+        self.purge_after = False
+        self.throughput_source = "calibration"
 
-
-
+    def run(self):
+        try:
+            os.makedirs(os.path.dirname(self.clip))
+            os.makedirs(self.default_output_folder)
+            processes().reset()
+            self.job_progress.emit(0.0, "Preparing the calibration clip…", -1.0)
+            cmd = [
+                FFMPEG_BIN, "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=25:duration={CALIBRATION_SECONDS}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                self.clip,
+            ]
+            proc = governor().run(cmd, "encode", stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                self.error.emit(f"Could not create the calibration clip:\n\n{proc.stderr.strip()[-500:]}")
+                return
+            super().run()
+        except ProcessingInterrupted:
+            logger.info("Calibration aborted by user")
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
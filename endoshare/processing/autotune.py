@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Per-machine tuning of the inference engine and of parallel ffmpeg work.
+
+Inference: every TensorFlow thread configuration runs in a fresh worker
+process (the thread pools can only be set before the first op) and times
+the engine on synthetic frames at each batch size. ffmpeg: N encodes of a
+synthetic clip run side by side with budget/N threads each, for a few N.
+In both, the cheapest configuration within TOLERANCE of the fastest wins:
+fewer threads leave room for the work running alongside, smaller batches
+hold fewer full-resolution frames in memory.
+
+The result is stored per machine in settings.json (utils/tuning.py), where
+top-level settings override it. The app tunes from the settings page, and
+on first start when `tune_on_first_start` is set. Trial ffmpeg runs go
+through their own ProcessRegistry, so they count toward no job and a
+Terminate of processing leaves them alone.
+
+    python -m endoshare.processing.autotune [--backend keras] [--dry-run]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from loguru import logger
+
+from ..utils import tuning
+from ..utils.governor import governor
+from ..utils.resources import FFMPEG_BIN
+from ..utils.subprocesses import ProcessRegistry
+from .sharding import wait_or_stop
+
+BATCH_SIZES = (16, 32, 64, 128, 256)
+# a configuration counts as "as fast as the best" within this fraction
+TOLERANCE = 0.05
+# timed passes per batch size, after one untimed warm-up
+REPEATS = 3
+# seconds of synthetic 720p video encoded by each parallel ffmpeg
+CLIP_SECONDS = 4
+CLIP_FPS = 25
+
+
+class TuningInterrupted(Exception):
+    """Raised between trials when `should_stop()` asks to give up."""
+
+
+def _cheapest(scores, cost):
+    """The key of `scores` ({config: throughput}) with the lowest `cost`
+    among those within TOLERANCE of the best throughput."""
+    best = max(scores.values())
+    return min((k for k, v in scores.items() if v >= (1 - TOLERANCE) * best), key=cost)
+
+
+def _inference_trial(backend, ckpt_path, intra, inter, batch_sizes):
+    # runs in a worker process with its own TensorFlow thread pools
+    import numpy as np
+    import tensorflow as tf
+    from .engine import create_engine
+    from ..utils.governor import ResourceGovernor, set_governor
+
+    gov = ResourceGovernor(inference_threads=intra, inter_op_threads=inter)
+    set_governor(gov)
+    gov.configure_tensorflow()
+
+    engine = create_engine(backend, ckpt_path=ckpt_path)
+    engine.load()
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(max(batch_sizes), 64, 64, 3), dtype=np.uint8)
+    frames = tf.keras.applications.mobilenet_v2.preprocess_input(tf.cast(frames, tf.float32)).numpy()
+    fps = {}
+    for batch_size in batch_sizes:
+        batch = frames[:batch_size]
+        engine.reset()
+        engine.predict(batch)
+        start_time = time.perf_counter()
+        for _ in range(REPEATS):
+            engine.predict(batch)
+        fps[batch_size] = REPEATS * batch_size / (time.perf_counter() - start_time)
+    return fps
+
+
+def thread_candidates(budget):
+    """(intra-op, inter-op) thread counts worth trying on `budget` CPUs."""
+    intra = sorted({max(1, budget // 4), max(1, budget // 2), budget})
+    return [(n, 1 if n <= 4 else 2) for n in intra]
+
+
+def tune_inference(backend, ckpt_path=None, should_stop=lambda: False):
+    """{"inference_threads", "inter_op_threads", "inference_buffer_size"}
+    plus the frames/s measured for every configuration."""
+    from .engine import WEIGHTS_PATH
+
+    budget = governor().budget
+    scores = {}
+    for intra, inter in thread_candidates(budget):
+        if should_stop():
+            raise TuningInterrupted()
+        # a stop request ends the trial itself, not only the wait for it
+        before = set(mp.active_children())
+        # spawn: TensorFlow is not fork-safe once initialised in the parent
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"))
+        try:
+            future = pool.submit(_inference_trial, backend, ckpt_path or WEIGHTS_PATH,
+                                 intra, inter, BATCH_SIZES)
+            wait_or_stop(pool, [future], should_stop, before)
+            fps = future.result()
+        finally:
+            pool.shutdown()
+        logger.info(f"Tuning inference, {intra}+{inter} threads: "
+                    + ", ".join(f"batch {b} {f:.0f} fps" for b, f in fps.items()))
+        for batch_size, value in fps.items():
+            scores[(intra, inter, batch_size)] = value
+    # fewer threads first, then smaller batches
+    intra, inter, batch_size = _cheapest(scores, cost=lambda k: (k[0], k[2]))
+    return {
+        "inference_threads": intra,
+        "inter_op_threads": inter,
+        "inference_buffer_size": batch_size,
+        "inference_fps": {f"{i}+{j}/{b}": round(v, 1) for (i, j, b), v in scores.items()},
+    }
+
+
+def _encode_clip(threads, registry):
+    cmd = [
+        FFMPEG_BIN, "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate={CLIP_FPS}:duration={CLIP_SECONDS}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-threads", str(threads),
+        "-f", "null", "-",
+    ]
+    registry.run(cmd, role="encode", stdout=subprocess.DEVNULL, check=True)
+
+
+def tune_ffmpeg(should_stop=lambda: False, registry=None):
+    """{"max_parallel_ffmpeg", "ffmpeg_encode_threads"} plus the frames/s
+    measured for every degree of parallelism. The encodes run through
+    `registry`, a private ProcessRegistry by default."""
+    registry = registry if registry is not None else ProcessRegistry()
+    budget = governor().budget
+    scores = {}
+    n = 1
+    while n <= min(budget, 8):
+        if should_stop():
+            raise TuningInterrupted()
+        threads = max(1, budget // n)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            list(pool.map(_encode_clip, [threads] * n, [registry] * n))
+        scores[n] = n * CLIP_SECONDS * CLIP_FPS / (time.perf_counter() - start_time)
+        logger.info(f"Tuning ffmpeg, {n} at once with {threads} threads: {scores[n]:.0f} fps")
+        n *= 2
+    parallel = _cheapest(scores, cost=lambda k: k)
+    return {
+        "max_parallel_ffmpeg": parallel,
+        "ffmpeg_encode_threads": max(1, budget // parallel),
+        "ffmpeg_fps": {str(k): round(v, 1) for k, v in scores.items()},
+    }
+
+
+def tune(backend="keras", ckpt_path=None, should_stop=lambda: False, save=True, registry=None):
+    """Run both tunings and store the result for this machine. A running
+    app picks up the buffer size right away; thread counts and ffmpeg
+    limits are set once per process and apply from the next start.
+    Cancelling `registry` stops the ffmpeg trial running."""
+    start_time = time.perf_counter()
+    result = {"backend": backend}
+    result.update(tune_inference(backend, ckpt_path, should_stop))
+    result.update(tune_ffmpeg(should_stop, registry))
+    logger.info(
+        f"Tuned in {time.perf_counter() - start_time:.0f} s: batch {result['inference_buffer_size']}, "
+        f"inference {result['inference_threads']}+{result['inter_op_threads']} threads, "
+        f"{result['max_parallel_ffmpeg']} ffmpeg at once with {result['ffmpeg_encode_threads']} threads"
+    )
+    if save:
+        tuning.save(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=tuning.load_settings().get("inference_backend", "keras"))
+    parser.add_argument("--weights", default=None, help="OOBNet checkpoint (default: the bundled one)")
+    parser.add_argument("--dry-run", action="store_true", help="print the result without saving it")
+    args = parser.parse_args()
+    print(json.dumps(tune(args.backend, args.weights, save=not args.dry_run), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 import shutil
 import threading
 import time
-import random
 from datetime import datetime
 from pathlib import Path
 from typing import List
@@ -11,159 +10,134 @@ from typing import List
 import cv2
 
 from . import mutils, vutils
+from ..utils.metrics import JobMetrics
+from ..utils.subprocesses import processes
+from ..utils.profiling import profiled, tensorflow_profile
+from ..utils.progress import ProgressModel
+from ..utils.prometheus import exporter
+from ..utils.tracing import traced, tracer
 
 
 def mk_timestamp() -> str:
     return datetime.now().strftime("%Y%m%d%H%M%S")
 
 
+def _run_cancellable(target, name, cancellable):
+    """Run `target` on a worker thread, checking for Terminate meanwhile,
+    and re-raise whatever it raised once it has finished."""
+    errors = []
+
+    def run():
+        try:
+            target()
+        except BaseException as exc:
+            errors.append(exc)
+
+    thread = threading.Thread(target=profiled(run), name=name, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        time.sleep(0.1)
+        cancellable.check_cancelled()
+    thread.join()
+    cancellable.check_cancelled()
+    if errors:
+        raise errors[0]
+
+
+@traced("process_video")
 def process_video(
     video_in: List[Path],
     video_out: Path,
     logger,
-    progress_bar_handle,
-    curr_progress: int,
-    max_progress: int
+    progress: ProgressModel = None,
+    engine=None,
+    shards: int = 1,
+    strip_metadata: bool = False,
+    work_dir: Path = None,
+    metrics: JobMetrics = None,
 ):
-    # ── 0) preliminary analysis (fake progress with restarts) ──
-    analysis_duration = 3.0  # seconds to spend in fake analysis
-    analysis_start = time.time()
-    while True:
-        p = 0
-        # one 0→100 pass with random increments
-        while p < 100:
-            p = min(p + random.randint(1, 3), 100)
-            progress_bar_handle.emit(
-                p, 100,
-                "Step 0/4: Analyzing video…",
-                False
-            )
-            time.sleep(1)
-            # bail out early if overall duration exceeded
-            if time.time() - analysis_start >= analysis_duration:
-                break
-        if time.time() - analysis_start >= analysis_duration:
-            break
-        # restart animation
-        progress_bar_handle.emit(
-            0, 100,
-            "Step 0/4: Analyzing video: restarting…",
-            False
-        )
-    # ensure final indication of completion before moving on
-    progress_bar_handle.emit(
-        100, 100,
-        "Step 0/4: Analysis complete ✔",
-        False
-    )
-
-    # ── 1) estimate total segments ─────────────────────────
-    estimate_dir = video_out.parent / f"estimate_{mk_timestamp()}"
-    estimate_dir.mkdir()
-    total_segments = 0
-    try:
-        for v in video_in:
-            tmp = estimate_dir / f"frames_{v.stem}"
-            tmp.mkdir()
-            vutils.VideoWorker(None).extract_frames(str(v), tmp)
-            try:
-                segs = mutils.pipeline(tmp)
-            except ZeroDivisionError as e:
-                logger.error(f"[Phase 0] pipeline empty for {v.name}: {e}")
-                segs = []
-            total_segments += len(segs)
-            shutil.rmtree(tmp)
-    finally:
-        shutil.rmtree(estimate_dir)
-    
-    total_segments = max(1, total_segments)
-
-    # ── 2) real work ───────────────────────────────────────
-    tmp_dir   = video_out.parent / f"tmp_{mk_timestamp()}"
+    # temporary frames and segments live in work_dir (by default next to
+    # the output), so the output itself may sit on a network share
+    work_dir = Path(work_dir) if work_dir is not None else video_out.parent
+    # Terminate stops the ffmpeg children; the phases below notice it here
+    # and raise ProcessingInterrupted instead of carrying on
+    cancellable = processes()
+    # per-stage timings of the job; a throwaway one when nobody asks
+    metrics = metrics if metrics is not None else JobMetrics(None)
+    # how far along each step is, for the progress bar
+    progress = progress if progress is not None else ProgressModel()
+
+    # ── 1) extract the frames of every video ──────────────
+    tmp_dir   = work_dir / f"tmp_{mk_timestamp()}"
     tmp_dir.mkdir()
     logfile   = tmp_dir / "report.log"
     worker    = vutils.VideoWorker(logfile)
-    frame_dir = tmp_dir / "frames"
-    frame_dir.mkdir()
 
     processed = 0
     segment_paths: List[Path] = []
 
     try:
+        frame_dirs = []
         for vid_idx, v in enumerate(video_in):
-            # ── Phase 1: Extract frames ────────────────────────
-            logger.info(f"Step 1/4: Extracting frames {vid_idx+1}/{len(video_in)}: {v.name}")
-            for f in frame_dir.iterdir():
-                if f.is_file(): f.unlink()
-                else:          shutil.rmtree(f)
-
-            extract_thread = threading.Thread(
-                target=lambda: worker.extract_frames(str(v), frame_dir),
-                daemon=True
-            )
-            extract_thread.start()
-
-            # fake‐progress for extraction (0→100, one pass)
-            phase1 = 0
-            while extract_thread.is_alive():
-                phase1 = min(phase1 + random.randint(5, 15), 99)
-                progress_bar_handle.emit(
-                    phase1, 100,
-                    f"Step 1/4: Extracting {vid_idx+1}/{len(video_in)}: {phase1}%",
-                    False
-                )
-                time.sleep(0.1)
-            extract_thread.join()
-            progress_bar_handle.emit(
-                100, 100,
-                f"Step 1/4: Extracted {vid_idx+1}/{len(video_in)} ✔",
-                False
-            )
+            logger.info(f"Step 1/4: Extracting frames {vid_idx+1}/{len(video_in)}: {v.name}")
+            progress.report("extraction", message=f"Step 1/4: Extracting {vid_idx+1}/{len(video_in)}…")
+            frame_dir = tmp_dir / f"frames_{vid_idx}"
+            frame_dir.mkdir()
+            with metrics.stage("extraction"):
+                worker.extract_frames(str(v), frame_dir)
+            cancellable.check_cancelled()
+            frame_dirs.append(frame_dir)
+            progress.report("extraction", (vid_idx + 1) / len(video_in),
+                            f"Step 1/4: Extracted {vid_idx+1}/{len(video_in)} ✔")
+
+        # ── 2) classify every frame once ──────────────────────
+        # the segments to cut come straight from these predictions
+        logger.info("Step 2/4: Classifying frames")
+        counts = [sum(1 for _ in d.iterdir()) for d in frame_dirs]
+        total_frames = sum(counts)
+        all_preds = []
+
+        def on_frames(done, total=total_frames):
+            progress.report("inference", done / max(1, total),
+                            f"Step 2/4: Classifying: {done}/{total} frames")
+
+        def classify():
+            with tracer().span("pipeline"), tensorflow_profile():
+                if shards > 1:
+                    # long recordings are split across worker processes,
+                    # one video after the other
+                    for k, d in enumerate(frame_dirs):
+                        before = sum(counts[:k])
+                        all_preds.append(mutils.find_sensitive(
+                            d, engine, shards=shards,
+                            on_progress=lambda done, _total, before=before: on_frames(before + done),
+                        ))
+                else:
+                    # the videos are independent sequences: classify them side
+                    # by side as separate LSTM streams sharing each forward pass
+                    all_preds.extend(mutils.find_sensitive_many(frame_dirs, engine, on_progress=on_frames))
+
+        with metrics.stage("inference"):
+            _run_cancellable(classify, "pipeline", cancellable)
+            progress.report("inference", 1.0, "Step 2/4: Classification complete ✔")
 
-            # ── Step 2: Preparing segmentation ──────────────
-            logger.info(f"Step 2/4: Preparing segmentation for {v.name}")
-            segment_times: List = []
-            # 2A) start pipeline in background
-            def do_pipeline():
-                nonlocal segment_times
+        all_segments = []
+        with metrics.stage("segments"):
+            for v, preds in zip(video_in, all_preds):
                 try:
-                    segment_times = mutils.pipeline(frame_dir)
+                    segs = mutils.find_segments(preds)
                 except ZeroDivisionError as e:
-                    logger.error(f"[Phase 2] pipeline empty for {v.name}: {e}")
-                    segment_times = []
-                # write to log
+                    logger.error(f"[Step 2] pipeline empty for {v.name}: {e}")
+                    segs = []
+                all_segments.append(segs)
                 with open(logfile, "a") as logf:
-                    logf.write(str(segment_times))
-
-            pipe_thread = threading.Thread(target=do_pipeline, daemon=True)
-            pipe_thread.start()
-
-            # 2B) spin fake 0→100 loops until pipeline actually completes
-            while pipe_thread.is_alive():
-                # one 0→100 pass
-                p = 0
-                while p < 100 and pipe_thread.is_alive():
-                    p = min(p + random.randint(1, 3), 100)
-                    progress_bar_handle.emit(
-                        p, 100,
-                        f"Step 2/4: Preparing segmentation: {p}%",
-                        False
-                    )
-                    time.sleep(1)
-                # if we hit 100 but pipeline still running, restart
-                if pipe_thread.is_alive():
-                    progress_bar_handle.emit(
-                        0, 100,
-                        "Step 2/4: Preparing segmentation: restarting…",
-                        False
-                    )
-            pipe_thread.join()
-            progress_bar_handle.emit(
-                100, 100,
-                "Step 2/4: Preparation complete ✔",
-                False
-            )
+                    logf.write(str(segs))
+        total_segments = max(1, sum(len(segs) for segs in all_segments))
+        # the frames are done with; their scratch space goes to the segments
+        for d in frame_dirs:
+            shutil.rmtree(d)
 
+        for vid_idx, (v, segment_times) in enumerate(zip(video_in, all_segments)):
             # ── Phase 3: Cut/black‐out segments ─────────────────
             logger.info(f"Step 3/4: Segmenting {v.name} …")
             seg_dir = tmp_dir / f"segments{vid_idx}"
@@ -173,53 +147,33 @@ def process_video(
             h = cap2.get(cv2.CAP_PROP_FRAME_HEIGHT)
             cap2.release()
 
-            for seg_idx, (sensitive, st, nd) in enumerate(segment_times):
-                out_seg = seg_dir / (
-                    video_out.stem + f".p{seg_idx:04d}" + video_out.suffix
-                )
-                if not sensitive:
-                    worker.kf_cut(v, str(out_seg), st, nd, tbn=10000)
-                else:
-                    worker.mk_black_video(nd - st, str(out_seg), w, h)
-
-                segment_paths.append(out_seg)
-                processed += 1
-                progress_bar_handle.emit(
-                    curr_progress + processed,
-                    curr_progress + total_segments,
-                    f"Step 3/4: Segment {processed}/{total_segments}",
-                    False
-                )
-
-            # clean up frames
-            for f in frame_dir.iterdir():
-                if f.is_file(): f.unlink()
-                else:          shutil.rmtree(f)
+            with metrics.stage("rendering"):
+                for seg_idx, (sensitive, st, nd) in enumerate(segment_times):
+                    cancellable.check_cancelled()
+                    out_seg = seg_dir / (
+                        video_out.stem + f".p{seg_idx:04d}" + video_out.suffix
+                    )
+                    if not sensitive:
+                        worker.kf_cut(v, str(out_seg), st, nd, tbn=10000)
+                    else:
+                        worker.mk_black_video(nd - st, str(out_seg), w, h)
+
+                    segment_paths.append(out_seg)
+                    processed += 1
+                    exporter().add_segments()
+                    progress.report("rendering", processed / total_segments,
+                                    f"Step 3/4: Segment {processed}/{total_segments}")
 
         # ── Phase 4: Merge ──────────────────────────────────
         logger.info("Step 4/4: Merging all segments…")
-        merge_thread = threading.Thread(
-            target=lambda: worker.merge(segment_paths, str(video_out)),
-            daemon=True
-        )
-        merge_thread.start()
-
-        # fake‐progress for merging
-        m = 0
-        while merge_thread.is_alive():
-            m = min(m + random.randint(2, 5), 99)
-            progress_bar_handle.emit(
-                m, 100,
-                f"Step 4/4: Merging: {m}%",
-                False
+        with metrics.stage("merge"):
+            progress.report("merge", message="Step 4/4: Merging…")
+            # a failed merge raises here, before anything is published
+            _run_cancellable(
+                lambda: worker.merge(segment_paths, str(video_out), tmp_dir / "concat.txt", strip_metadata),
+                "merge", cancellable,
             )
-            time.sleep(0.1)
-        merge_thread.join()
-        progress_bar_handle.emit(
-            100, 100,
-            "Step 4/4: Merge complete ✔",
-            False
-        )
+            progress.report("merge", 1.0, "Step 4/4: Merge complete ✔")
 
     finally:
         logger.info(f"Cleaning up {tmp_dir}")
@@ -0,0 +1,78 @@
+import os
+import shutil
+from pathlib import Path
+
+import cv2
+from loguru import logger
+
+from ..utils.types import ProcessingMode
+
+# Fast mode extracts 1 frame/s as a 64x64 PNG
+FRAME_BYTES = 12 * 1024
+# the segments are stream copies of the input; re-encoded cut heads and
+# black segments add a little on top
+SEGMENT_OVERHEAD = 1.1
+# a plan never counts on the last couple of GB of a disk
+RESERVE_BYTES = 2 * 2**30
+
+
+def probe_duration(path):
+    """Duration of a video in seconds, 0 if unknown."""
+    cap = cv2.VideoCapture(str(path))
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        return frames / fps if fps > 0 else 0.0
+    finally:
+        cap.release()
+
+
+def existing_parent(path):
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def free_bytes(path):
+    return shutil.disk_usage(existing_parent(path)).free
+
+
+def same_filesystem(a, b):
+    return os.stat(existing_parent(a)).st_dev == os.stat(existing_parent(b)).st_dev
+
+
+def estimate_job(paths, mode):
+    """Bytes a patient's job needs: {"scratch": temporary files, "output":
+    the final video}. Fast mode keeps the frames of all videos until they
+    are classified, then the segments; Advanced mode
+    encodes straight into the output."""
+    input_bytes = sum(os.path.getsize(p) for p in paths)
+    duration = sum(probe_duration(p) for p in paths)
+    if mode == ProcessingMode.NORMAL:
+        scratch = int(duration * FRAME_BYTES + input_bytes * SEGMENT_OVERHEAD)
+    else:
+        scratch = 0
+    return {"scratch": scratch, "output": input_bytes, "duration": duration}
+
+
+def check_space(plan, scratch_dir, output_dir):
+    """Return a list of human-readable problems, empty if the plan fits."""
+    needs = {existing_parent(scratch_dir): plan["scratch"]}
+    if same_filesystem(scratch_dir, output_dir):
+        needs[existing_parent(scratch_dir)] += plan["output"]
+    else:
+        needs[existing_parent(output_dir)] = plan["output"]
+    problems = []
+    for path, needed in needs.items():
+        free = free_bytes(path)
+        if needed + RESERVE_BYTES > free:
+            problems.append(
+                f"{path} needs {needed / 2**30:.1f} GB but only {free / 2**30:.1f} GB are free"
+            )
+    if not problems:
+        logger.info(
+            f"Disk plan: {plan['scratch'] / 2**30:.1f} GB scratch in {scratch_dir}, "
+            f"{plan['output'] / 2**30:.1f} GB output in {output_dir}"
+        )
+    return problems
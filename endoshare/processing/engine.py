@@ -0,0 +1,210 @@
+import os
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+from loguru import logger
+
+from .model import build_model
+from ..utils.resources import resource_path
+from ..utils.governor import governor
+
+
+def _find_bundled_ckpt():
+    # inside a .app bundle: use frozen logic
+    if getattr(sys, "frozen", False):
+        exe_dir = Path(sys.executable).parent
+        resources = exe_dir.parent / "Resources"
+        # look both in Resources/ckpt and Resources/Resources/ckpt
+        for candidate in (resources / "ckpt", resources / "Resources" / "ckpt"):
+            p = candidate / "oobnet_weights.h5"
+            if p.exists():
+                return str(p)
+        # fallback
+        return str(resources / "ckpt" / "oobnet_weights.h5")
+    # running from source tree: use resource_path to point into resources/ckpt
+    return resource_path(os.path.join("ckpt", "oobnet_weights.h5"))
+
+WEIGHTS_PATH = _find_bundled_ckpt()
+
+BACKENDS = ("keras", "tflite-fp16", "tflite-int8")
+
+# padded batch shapes the compiled backbone is traced for; larger batches
+# are split into chunks of the largest bucket
+BATCH_BUCKETS = (1, 8, 16, 32, 64, 128, 256)
+
+# build_model(): MobileNetV2 → Flatten → LayerNorm work frame by frame,
+# everything from here on (Dropout, expand_dims, LSTM, ...) is the head
+HEAD_START = 3
+
+
+def bucket_size(n):
+    """Smallest bucket holding n frames."""
+    for size in BATCH_BUCKETS:
+        if n <= size:
+            return size
+    return BATCH_BUCKETS[-1]
+
+
+class InferenceEngine:
+    """Owns one OOBNet instance so that building the model, loading the
+    weights and tracing the first call happen once per application run
+    instead of once per video.
+
+    With `compiled` the backbone runs as a tf.function on a small set of
+    padded batch shapes (BATCH_BUCKETS), optionally XLA-compiled, and the
+    LSTM head as a tf.function with a length-agnostic signature, so each
+    shape is traced once and then reused."""
+
+    backend = "keras"
+    # True only while a quantized backbone is actually in use
+    quantized = False
+
+    def __init__(self, ckpt_path=WEIGHTS_PATH, device="/cpu:0", input_shape=(64, 64),
+                 compiled=True, jit_compile=None):
+        self.ckpt_path = ckpt_path
+        self.device = device
+        self.input_shape = list(input_shape)
+        self.compiled = compiled
+        if jit_compile is None:
+            jit_compile = os.environ.get("ENDOSHARE_XLA", "0") == "1"
+        self.jit_compile = jit_compile
+        self._model = None
+        self._backbone_layers = []
+        self._head_layers = []
+        self._backbone_fn = None
+        self._head_fn = None
+        # the LSTM is stateful, so one sequence at a time may drive the model
+        self._lock = threading.RLock()
+
+    @property
+    def is_ready(self):
+        return self._model is not None
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                with governor().device(self.device):
+                    model = build_model(self.input_shape)
+                    # no checkpoint → random weights, only used by benchmarks
+                    if self.ckpt_path:
+                        model.load_weights(self.ckpt_path)
+                self._model = model
+                self._backbone_layers = model.layers[:HEAD_START]
+                self._head_layers = model.layers[HEAD_START:]
+                feature_dim = int(self._backbone_layers[-1].output.shape[-1])
+                if self.compiled:
+                    self._backbone_fn = tf.function(self._backbone, jit_compile=self.jit_compile)
+                    self._head_fn = tf.function(
+                        self._head,
+                        input_signature=[tf.TensorSpec([None, feature_dim], tf.float32)],
+                    )
+                else:
+                    self._backbone_fn = self._backbone
+                    self._head_fn = self._head
+                logger.info(f"OOBNet loaded from {self.ckpt_path}")
+        return self
+
+    def warm_up(self, batch_size=64):
+        """Build the model and push dummy batches through it so the first
+        real calls do not pay for graph tracing."""
+        with self._lock:
+            self.load()
+            for size in BATCH_BUCKETS:
+                if size > batch_size:
+                    break
+                self.predict(np.zeros([size] + self.input_shape + [3], dtype=np.float32))
+            self.reset()
+
+    @property
+    def head_layers(self):
+        """Layers applied after the backbone (Dropout, expand_dims, LSTM, ...)."""
+        self.load()
+        return list(self._head_layers)
+
+    def reset(self):
+        """Clear the LSTM state before starting a new sequence."""
+        with self._lock:
+            if self._model is not None:
+                self._model.reset_states()
+
+    def backbone_model(self):
+        """Return the per-frame feature extractor as a standalone Keras
+        model sharing the loaded weights (used for conversion)."""
+        self.load()
+        inputs = tf.keras.Input(self.input_shape + [3], dtype=tf.float32)
+        return tf.keras.Model(inputs, self._backbone(inputs))
+
+    def _backbone(self, x):
+        for layer in self._backbone_layers:
+            x = layer(x)
+        return x
+
+    def _head(self, x):
+        for layer in self._head_layers:
+            x = layer(x)
+        return x[0, :, 0]
+
+    def _run_backbone(self, padded):
+        with governor().device(self.device):
+            return self._backbone_fn(tf.convert_to_tensor(padded, dtype=tf.float32)).numpy()
+
+    def features(self, batch):
+        """Return the (n, d) backbone features of a preprocessed batch.
+
+        Frames are independent here, so batches are zero-padded up to the
+        next bucket size and the padding rows are dropped again."""
+        with self._lock:
+            self.load()
+            batch = np.asarray(batch, dtype=np.float32)
+            out = []
+            for start in range(0, len(batch), BATCH_BUCKETS[-1]):
+                chunk = batch[start:start + BATCH_BUCKETS[-1]]
+                n = len(chunk)
+                size = bucket_size(n)
+                if size > n:
+                    pad = np.zeros((size - n,) + chunk.shape[1:], dtype=np.float32)
+                    chunk = np.concatenate([chunk, pad])
+                out.append(self._run_backbone(chunk)[:n])
+            return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+    def classify(self, features):
+        """Advance the LSTM over a run of backbone features and return the
+        per-frame out-of-body probabilities.
+
+        Never padded: padding frames would advance the LSTM state."""
+        with self._lock:
+            self.load()
+            with governor().device(self.device):
+                return self._head_fn(tf.convert_to_tensor(features, dtype=tf.float32)).numpy()
+
+    def predict(self, batch):
+        """Return the per-frame out-of-body probabilities of a
+        (n, h, w, 3) preprocessed batch, in temporal order."""
+        with self._lock:
+            return self.classify(self.features(batch))
+
+
+def create_engine(backend="keras", **kwargs):
+    if backend == "keras":
+        return InferenceEngine(**kwargs)
+    if backend in ("tflite-fp16", "tflite-int8"):
+        from .tflite_backend import TFLiteEngine
+        quantization = "float16" if backend == "tflite-fp16" else "int8"
+        return TFLiteEngine(quantization=quantization, **kwargs)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+_shared_engines = {}
+_shared_engines_lock = threading.Lock()
+
+
+def shared_engine(backend="keras"):
+    """Return the process-wide engine for a backend, creating it (unloaded)
+    on first use."""
+    with _shared_engines_lock:
+        if backend not in _shared_engines:
+            _shared_engines[backend] = create_engine(backend)
+        return _shared_engines[backend]
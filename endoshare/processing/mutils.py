@@ -1,30 +1,14 @@
 import numpy as np
 import tensorflow as tf
 import cv2
-from .model import build_model
 import matplotlib.pyplot as plt
 from pathlib import Path
-import sys
-from ..utils.resources import resource_path
-import os
-
-
-def _find_bundled_ckpt():
-    # inside a .app bundle: use frozen logic
-    if getattr(sys, "frozen", False):
-        exe_dir = Path(sys.executable).parent
-        resources = exe_dir.parent / "Resources"
-        # look both in Resources/ckpt and Resources/Resources/ckpt
-        for candidate in (resources / "ckpt", resources / "Resources" / "ckpt"):
-            p = candidate / "oobnet_weights.h5"
-            if p.exists():
-                return str(p)
-        # fallback
-        return str(resources / "ckpt" / "oobnet_weights.h5")
-    # running from source tree: use resource_path to point into resources/ckpt
-    return resource_path(os.path.join("ckpt", "oobnet_weights.h5"))
-
-WEIGHTS_PATH = _find_bundled_ckpt()
+from .engine import WEIGHTS_PATH, shared_engine
+from .streams import multi_stream_engine
+from . import sharding
+from ..utils.prometheus import exporter
+from ..utils.subprocesses import processes
+from loguru import logger
 
 
 def preprocess(img):
@@ -35,24 +19,74 @@ def preprocess(img):
         axis=0
     )
 
-def find_sensitive(video_frame_dir):
-    m = build_model()
-    m.load_weights(WEIGHTS_PATH)
+def find_sensitive(video_frame_dir, engine=None, batch_size=64, shards=1, on_progress=None):
+    # The LSTM state carries over between calls, so feeding the frames in
+    # batches gives the same predictions as feeding them one at a time.
+    # on_progress(done, total) is called with the frame count after each batch.
+    engine = engine or shared_engine()
     frame_paths = sorted(Path(video_frame_dir).glob("*"))
+    if shards > 1 and len(frame_paths) >= 2 * sharding.MIN_SHARD_FRAMES:
+        shards = min(shards, len(frame_paths) // sharding.MIN_SHARD_FRAMES)
+        logger.info(f"Sharded inference over {len(frame_paths)} frames in {shards} workers")
+        # Terminate stops the shard workers too
+        probs = sharding.sharded_predict(frame_paths, shards, backend=engine.backend,
+                                         ckpt_path=engine.ckpt_path, batch_size=batch_size,
+                                         should_stop=lambda: processes().cancelled)
+        exporter().add_frames(len(probs))
+        if on_progress is not None:
+            on_progress(len(probs), len(probs))
+        return np.round(probs).tolist()
+    engine.reset()
     prediction_buffer = []
     n = len(frame_paths)
-    for j, fp in enumerate(frame_paths):
+    for j in range(0, n, batch_size):
         print("{} / {}".format(j, n))
-        frame = cv2.cvtColor(
-            cv2.imread(str(fp)),
-            cv2.COLOR_BGR2RGB
-        )
-        prediction = np.round(
-            np.squeeze(m(preprocess(frame)).numpy())
-        )
-        prediction_buffer.append(prediction)
+        processes().check_cancelled()
+        batch = tf.concat([
+            preprocess(cv2.cvtColor(cv2.imread(str(fp)), cv2.COLOR_BGR2RGB))
+            for fp in frame_paths[j:j + batch_size]
+        ], axis=0)
+        prediction_buffer.extend(np.round(engine.predict(batch)).tolist())
+        exporter().add_frames(len(batch))
+        if on_progress is not None:
+            on_progress(min(j + batch_size, n), n)
     return prediction_buffer
 
+def find_sensitive_many(video_frame_dirs, engine=None, batch_size=64, on_progress=None):
+    """find_sensitive for several independent videos at once: each video is
+    its own LSTM stream and the frames of all videos share each forward
+    pass. Returns one prediction list per directory, in order; on_progress
+    gets the frames done and the total over all videos."""
+    multi = multi_stream_engine(engine or shared_engine())
+    frame_paths = [sorted(Path(d).glob("*")) for d in video_frame_dirs]
+    stream_ids = [object() for _ in video_frame_dirs]
+    for sid in stream_ids:
+        multi.open_stream(sid)
+    prediction_buffers = [[] for _ in video_frame_dirs]
+    n = max((len(paths) for paths in frame_paths), default=0)
+    total = sum(len(paths) for paths in frame_paths)
+    try:
+        for j in range(0, n, batch_size):
+            processes().check_cancelled()
+            batches = {}
+            for sid, paths in zip(stream_ids, frame_paths):
+                if j < len(paths):
+                    batches[sid] = tf.concat([
+                        preprocess(cv2.cvtColor(cv2.imread(str(fp)), cv2.COLOR_BGR2RGB))
+                        for fp in paths[j:j + batch_size]
+                    ], axis=0)
+            results = multi.step(batches)
+            for sid, buf in zip(stream_ids, prediction_buffers):
+                if sid in results:
+                    buf.extend(np.round(results[sid]).tolist())
+                    exporter().add_frames(len(results[sid]))
+            if on_progress is not None:
+                on_progress(sum(len(buf) for buf in prediction_buffers), total)
+    finally:
+        for sid in stream_ids:
+            multi.close_stream(sid)
+    return prediction_buffers
+
 def mk_plot(arr):
     plt.pcolormesh(arr)
 
@@ -72,6 +106,8 @@ def delete_isolated_non_sensitive(arr):
             arr[j] = 1
 
 def find_segments(arr):
+    if len(arr) == 0:
+        return []
     delete_isolated_non_sensitive(arr)
     segments = []
     curr_run_start = 0
@@ -85,8 +121,8 @@ def find_segments(arr):
                 curr_value = v
     return segments
 
-def pipeline(video_frame_dir):
-    return find_segments(find_sensitive(video_frame_dir))
+def pipeline(video_frame_dir, engine=None, shards=1, on_progress=None):
+    return find_segments(find_sensitive(video_frame_dir, engine, shards=shards, on_progress=on_progress))
 
 if __name__ == "__main__":
     r = find_sensitive("tmp_20240111151241/frames")
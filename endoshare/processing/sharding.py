@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Sharded inference for a single long video.
+
+The stateful LSTM forces one long sequential pass over a recording. Here
+the frame timeline is split into shards that run in parallel worker
+processes. Each shard starts `overlap` frames early so the LSTM state has
+converged by the time its own frames begin; predictions for those warm-up
+frames are discarded and the shards are concatenated back together.
+
+    python -m endoshare.processing.sharding FRAME_DIR --shards 4 --overlap 0 30 120
+
+runs the sequential pass and the sharded one for every overlap and reports
+how often they agree, per shard boundary too.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from ..utils.types import ProcessingInterrupted
+
+# frames fed to a shard before its own range begins (Fast mode extracts
+# 1 frame/s, so this is two minutes of context)
+DEFAULT_OVERLAP = 120
+# below this many frames per shard, process start-up costs more than it saves
+MIN_SHARD_FRAMES = 600
+# frames after each shard start inspected separately in agreement reports
+BOUNDARY_WINDOW = 60
+# seconds between checks of should_stop while the workers run
+STOP_POLL_INTERVAL = 0.2
+# seconds a terminated worker gets to exit before it is killed
+KILL_GRACE = 3.0
+
+
+def plan_shards(n_frames, n_shards, overlap=DEFAULT_OVERLAP):
+    """Return [(warm_start, start, end), ...] covering range(n_frames)."""
+    n_shards = max(1, min(n_shards, n_frames))
+    bounds = np.linspace(0, n_frames, n_shards + 1).astype(int)
+    return [
+        (max(0, int(start) - overlap), int(start), int(end))
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if end > start
+    ]
+
+
+def _predict_shard(frame_paths, n_warmup, backend, ckpt_path, batch_size, max_threads):
+    # runs in a worker process: build a private engine for this shard, on
+    # its share of the parent's CPU budget
+    import cv2
+    import tensorflow as tf
+    from .engine import create_engine
+    from .mutils import preprocess
+    from ..utils.governor import ResourceGovernor, set_governor
+
+    set_governor(ResourceGovernor(max_threads=max_threads, max_subprocesses=1))
+
+    engine = create_engine(backend, ckpt_path=ckpt_path)
+    engine.reset()
+    probs = []
+    for j in range(0, len(frame_paths), batch_size):
+        batch = tf.concat([
+            preprocess(cv2.cvtColor(cv2.imread(fp), cv2.COLOR_BGR2RGB))
+            for fp in frame_paths[j:j + batch_size]
+        ], axis=0)
+        probs.append(engine.predict(batch))
+    probs = np.concatenate(probs) if probs else np.zeros(0, dtype=np.float32)
+    return probs[n_warmup:]
+
+
+def _stop_workers(pool, workers):
+    # drop the tasks not yet started and stop those running; the pool
+    # has no public handle on its processes, hence the caller's list
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in workers:
+        proc.terminate()
+    for proc in workers:
+        proc.join(KILL_GRACE)
+        if proc.is_alive():
+            proc.kill()
+
+
+def wait_or_stop(pool, futures, should_stop, children_before):
+    """Wait for the `futures` of a process pool, polling `should_stop()`.
+    Once it returns True the pool's workers, the multiprocessing children
+    not in `children_before` (mp.active_children() taken before the pool
+    was created), are terminated and ProcessingInterrupted is raised."""
+    while wait(futures, timeout=STOP_POLL_INTERVAL).not_done:
+        if should_stop():
+            _stop_workers(pool, set(mp.active_children()) - children_before)
+            raise ProcessingInterrupted()
+
+
+def sharded_predict(frame_paths, n_shards, overlap=DEFAULT_OVERLAP, backend="keras",
+                    ckpt_path=None, batch_size=64, should_stop=None):
+    """Per-frame probabilities for `frame_paths`, computed in `n_shards`
+    worker processes and stitched back in temporal order.
+
+    `should_stop()` is polled while the shards run; once it returns True
+    the workers are terminated and ProcessingInterrupted is raised."""
+    from .engine import WEIGHTS_PATH
+    from ..utils.governor import governor
+
+    frame_paths = [str(p) for p in frame_paths]
+    shards = plan_shards(len(frame_paths), n_shards, overlap)
+    share = governor().share(len(shards))
+    # the pool's workers are the multiprocessing children started from here
+    before = set(mp.active_children())
+    # spawn: TensorFlow is not fork-safe once initialised in the parent
+    pool = ProcessPoolExecutor(max_workers=len(shards), mp_context=mp.get_context("spawn"))
+    try:
+        futures = [
+            pool.submit(
+                _predict_shard,
+                frame_paths[warm_start:end],
+                start - warm_start,
+                backend,
+                ckpt_path or WEIGHTS_PATH,
+                batch_size,
+                share.budget,
+            )
+            for warm_start, start, end in shards
+        ]
+        if should_stop is not None:
+            wait_or_stop(pool, futures, should_stop, before)
+        parts = [f.result() for f in futures]
+    finally:
+        pool.shutdown()
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+
+def agreement_report(sharded, sequential, shards):
+    """Compare rounded predictions overall and around each shard start."""
+    sharded = np.round(np.asarray(sharded))
+    sequential = np.round(np.asarray(sequential))
+    mismatches = np.flatnonzero(sharded != sequential)
+    boundaries = []
+    for warm_start, start, end in shards[1:]:
+        window = slice(start, min(end, start + BOUNDARY_WINDOW))
+        boundaries.append({
+            "start": start,
+            "warmup": start - warm_start,
+            "mismatches_in_window": int(np.sum(sharded[window] != sequential[window])),
+        })
+    return {
+        "frames": int(len(sequential)),
+        "agreement": float(np.mean(sharded == sequential)) if len(sequential) else 1.0,
+        "mismatches": int(len(mismatches)),
+        "first_mismatches": mismatches[:20].tolist(),
+        "boundaries": boundaries,
+    }
+
+
+def compare_with_sequential(frame_dir, n_shards, overlaps=(DEFAULT_OVERLAP,), backend="keras", batch_size=64):
+    from .engine import create_engine
+    from .mutils import find_sensitive
+
+    frame_paths = sorted(Path(frame_dir).glob("*"))
+    start_time = time.time()
+    sequential = np.asarray(find_sensitive(frame_dir, create_engine(backend), batch_size))
+    sequential_time = time.time() - start_time
+    report = {"frame_dir": str(frame_dir), "shards": n_shards, "sequential_sec": sequential_time, "runs": []}
+    for overlap in overlaps:
+        start_time = time.time()
+        sharded = sharded_predict(frame_paths, n_shards, overlap, backend, batch_size=batch_size)
+        elapsed = time.time() - start_time
+        run = agreement_report(sharded, sequential, plan_shards(len(frame_paths), n_shards, overlap))
+        run.update({"overlap": overlap, "sharded_sec": elapsed, "speedup": sequential_time / elapsed if elapsed else None})
+        report["runs"].append(run)
+        logger.info(f"sharded x{n_shards}, overlap {overlap}: agreement {run['agreement']:.4f}, speed-up {run['speedup']:.2f}x")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("frame_dir")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--overlap", type=int, nargs="+", default=[DEFAULT_OVERLAP])
+    parser.add_argument("--backend", default="keras")
+    parser.add_argument("--output", metavar="JSON")
+    args = parser.parse_args()
+    report = compare_with_sequential(args.frame_dir, args.shards, args.overlap, args.backend)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
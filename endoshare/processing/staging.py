@@ -0,0 +1,145 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uuid import uuid4
+
+from loguru import logger
+
+from ..utils.fileops import copy_file
+from ..utils.tracing import tracer
+from .diskplan import RESERVE_BYTES, free_bytes
+
+# copies running at once; several streams keep network shares busy while
+# a USB stick simply serves them in turn
+STAGING_WORKERS = 4
+# hashing forces the copy through userspace, so it is opt-in
+# (`staging_checksum` in settings.json, e.g. "sha256"); the digests are
+# recorded in the job metrics
+STAGING_CHECKSUM = None
+
+
+class StagingArea:
+    """Local scratch copies of the selected recordings.
+
+    Copies are queued as soon as a patient is confirmed and run in a small
+    thread pool, so the recordings of the next patients are staged while the
+    current one is processed. Processing reads the staged copy through
+    `wait()`, which falls back to the original file if staging failed."""
+
+    def __init__(self, root=None, workers=STAGING_WORKERS, checksum=STAGING_CHECKSUM):
+        base = Path(root) if root else Path(tempfile.gettempdir()) / "endoshare_staging"
+        self.root = base / uuid4().hex[:8]
+        self.checksum_algorithm = checksum
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="staging")
+        # set by close(): copies in flight stop at their next chunk
+        self._closing = threading.Event()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # bytes promised to copies in flight, not yet visible as used space
+        self._reserved = 0
+        # never leave gigabytes of copies behind, even if close() is skipped
+        self._finalizer = weakref.finalize(self, shutil.rmtree, str(self.root), True)
+
+    def staged_path(self, src):
+        key = hashlib.sha1(str(src).encode()).hexdigest()[:12]
+        return self.root / key / Path(src).name
+
+    def stage(self, paths):
+        """Queue copies of `paths` and return their futures, in order."""
+        with self._lock:
+            for src in paths:
+                if src not in self._jobs:
+                    self._jobs[src] = self._pool.submit(self._copy, src)
+            return [self._jobs[src] for src in paths]
+
+    def _reserve(self, size):
+        # copies that would fill the scratch disk are refused, and the
+        # recording is then read in place
+        with self._lock:
+            if free_bytes(self.root) - self._reserved - size < RESERVE_BYTES:
+                raise OSError(errno.ENOSPC, "not enough free space to stage", str(self.root))
+            self._reserved += size
+
+    def _copy(self, src):
+        dst = self.staged_path(src)
+        size = os.path.getsize(src)
+        self._reserve(size)
+        partial = dst.with_name(dst.name + ".partial")
+        start_time = time.time()
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            with tracer().span("copy", "staging", bytes=size):
+                digest = copy_file(src, partial, self.checksum_algorithm, should_stop=self._closing.is_set)
+            os.replace(partial, dst)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        finally:
+            with self._lock:
+                self._reserved -= size
+        elapsed = time.time() - start_time
+        size_mb = dst.stat().st_size / 2**20
+        rate = f"{size_mb / elapsed:.0f} MB/s" if elapsed > 0 else "n/a"
+        logger.info(f"Staged {Path(src).name}: {size_mb:.0f} MB in {elapsed:.1f} sec ({rate})")
+        return dst, digest
+
+    def wait(self, src):
+        """Block until `src` is staged and return the path to read from."""
+        with self._lock:
+            job = self._jobs.get(src)
+        if job is None:
+            return src
+        try:
+            dst, _ = job.result()
+        except Exception as exc:
+            logger.warning(f"Staging failed for {Path(src).name}, reading the original: {exc}")
+            return src
+        return str(dst)
+
+    def is_staged(self, src):
+        with self._lock:
+            job = self._jobs.get(src)
+        return job is not None and job.done()
+
+    def checksum(self, src):
+        """Hex digest of the staged copy of `src`, or None if unavailable."""
+        with self._lock:
+            job = self._jobs.get(src)
+        if job is None or not job.done() or job.cancelled() or job.exception():
+            return None
+        return job.result()[1]
+
+    def release(self, paths):
+        """Drop the staged copies of `paths`. Pending copies are cancelled,
+        copies in flight are removed as soon as they finish."""
+        for src in paths:
+            with self._lock:
+                job = self._jobs.pop(src, None)
+            if job is None:
+                continue
+            job.cancel()
+            staged_dir = self.staged_path(src).parent
+            job.add_done_callback(lambda _, d=staged_dir: shutil.rmtree(d, ignore_errors=True))
+
+    def close(self):
+        """Cancel pending copies, stop those in flight and remove the whole
+        staging directory. The copies are joined first: Windows refuses to
+        delete a file that is still open."""
+        self._closing.set()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._jobs.clear()
+        self._finalizer.detach()
+        try:
+            shutil.rmtree(self.root)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning(f"Could not remove the staging folder {self.root}: {exc}")
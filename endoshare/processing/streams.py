@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+class MultiStreamEngine:
+    """Runs OOBNet over several independent sequences (videos, patients) in
+    one forward pass.
+
+    The stateful LSTM of build_model() can only advance a single sequence,
+    so this engine keeps an explicit (h, c) state per stream and runs a
+    non-stateful copy of the LSTM with the streams stacked in the batch
+    dimension. The backbone of the wrapped InferenceEngine (any backend) is
+    applied once to the frames of all streams together, in `step()`."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._states = {}
+        self._lstm = None
+        self._post_layers = []
+        self._head_fn = None
+        self._build_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _build(self):
+        with self._build_lock:
+            if self._head_fn is not None:
+                return
+            head = self.engine.head_layers
+            stateful = next(layer for layer in head if isinstance(layer, tf.keras.layers.LSTM))
+            self._post_layers = head[head.index(stateful) + 1:]
+            kernel = stateful.get_weights()[0]
+            self.units = stateful.units
+            self._lstm = tf.keras.layers.LSTM(self.units, return_sequences=True, return_state=True)
+            self._lstm.build((None, None, kernel.shape[0]))
+            self._lstm.set_weights(stateful.get_weights())
+            self._head_fn = tf.function(
+                self._head,
+                input_signature=[
+                    tf.TensorSpec([None, None, kernel.shape[0]], tf.float32),
+                    tf.TensorSpec([None, None], tf.bool),
+                    tf.TensorSpec([None, self.units], tf.float32),
+                    tf.TensorSpec([None, self.units], tf.float32),
+                ],
+            )
+
+    def _head(self, x, mask, h, c):
+        # masked (padding) steps leave a stream's state untouched
+        y, h, c = self._lstm(x, mask=mask, initial_state=[h, c])
+        for layer in self._post_layers:
+            y = layer(y)
+        return y[:, :, 0], h, c
+
+    def open_stream(self, stream_id):
+        self._build()
+        zeros = np.zeros(self.units, dtype=np.float32)
+        with self._lock:
+            self._states[stream_id] = (zeros, zeros.copy())
+
+    def close_stream(self, stream_id):
+        with self._lock:
+            self._states.pop(stream_id, None)
+
+    def step(self, batches):
+        """Advance every stream in `batches` ({stream_id: (n, h, w, 3)
+        preprocessed frames}) and return {stream_id: probabilities}."""
+        self._build()
+        ids = [sid for sid, frames in batches.items() if len(frames)]
+        if not ids:
+            return {sid: np.zeros(0, dtype=np.float32) for sid in batches}
+        lengths = [len(batches[sid]) for sid in ids]
+        frames = np.concatenate([np.asarray(batches[sid], dtype=np.float32) for sid in ids])
+        features = np.asarray(self.engine.features(frames))
+
+        x = np.zeros((len(ids), max(lengths), features.shape[1]), dtype=np.float32)
+        mask = np.zeros((len(ids), max(lengths)), dtype=bool)
+        offset = 0
+        for k, n in enumerate(lengths):
+            x[k, :n] = features[offset:offset + n]
+            mask[k, :n] = True
+            offset += n
+        with self._lock:
+            h = np.stack([self._states[sid][0] for sid in ids])
+            c = np.stack([self._states[sid][1] for sid in ids])
+
+        probs, h, c = self._head_fn(x, mask, h, c)
+        probs, h, c = probs.numpy(), h.numpy(), c.numpy()
+
+        results = {sid: np.zeros(0, dtype=np.float32) for sid in batches}
+        with self._lock:
+            for k, (sid, n) in enumerate(zip(ids, lengths)):
+                if sid in self._states:
+                    self._states[sid] = (h[k], c[k])
+                results[sid] = probs[k, :n]
+        return results
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def multi_stream_engine(engine):
+    """Return the MultiStreamEngine wrapping `engine`, so its non-stateful
+    head is built once per engine rather than once per patient."""
+    with _shared_lock:
+        if id(engine) not in _shared:
+            _shared[id(engine)] = MultiStreamEngine(engine)
+        return _shared[id(engine)]
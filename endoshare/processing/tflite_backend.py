@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+TFLite backend for OOBNet on CPU.
+
+Only the MobileNetV2 backbone is converted and quantized: it is where the
+time goes, and it is applied frame by frame. The stateful LSTM head keeps
+running in float32 Keras, so the temporal behaviour is unchanged.
+
+Converted models are cached per weights file and quantization. int8
+calibration uses the frame sample bundled in resources/calibration; run
+`python -m endoshare.processing.tflite_backend --calibrate-from VIDEO` to
+(re)build it, and `--reference DIR` to measure agreement with float32.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from loguru import logger
+
+from .engine import InferenceEngine
+from ..utils.resources import resource_path, user_data_dir
+from ..utils.governor import governor
+
+QUANTIZATIONS = ("float16", "int8")
+CALIBRATION_DIR = resource_path("calibration")
+CALIBRATION_SIZE = 200
+
+
+def _load_frames(frame_dir, limit=None):
+    """Return the frames of a directory as a preprocessed float32 batch."""
+    frame_paths = sorted(p for p in Path(frame_dir).glob("*.png"))
+    if limit and len(frame_paths) > limit:
+        step = len(frame_paths) / limit
+        frame_paths = [frame_paths[int(j * step)] for j in range(limit)]
+    frames = [
+        cv2.cvtColor(cv2.imread(str(fp)), cv2.COLOR_BGR2RGB)
+        for fp in frame_paths
+    ]
+    if not frames:
+        return np.zeros((0, 64, 64, 3), dtype=np.float32)
+    batch = np.stack(frames).astype(np.float32)
+    return tf.keras.applications.mobilenet_v2.preprocess_input(batch)
+
+
+def calibration_frames(calibration_dir=CALIBRATION_DIR):
+    return _load_frames(calibration_dir, limit=CALIBRATION_SIZE)
+
+
+def has_calibration_frames(calibration_dir=CALIBRATION_DIR):
+    """Whether int8 quantization can be calibrated; without frames the
+    tflite-int8 backend falls back to the float32 backbone."""
+    return any(Path(calibration_dir).glob("*.png"))
+
+
+def _fingerprint(ckpt_path, quantization, calibration_dir):
+    digest = hashlib.sha1(quantization.encode())
+    with open(ckpt_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    if quantization == "int8":
+        for p in sorted(Path(calibration_dir).glob("*.png")):
+            digest.update(f"{p.name}:{p.stat().st_size}".encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_model_path(ckpt_path, quantization, calibration_dir=CALIBRATION_DIR):
+    name = f"oobnet_backbone_{quantization}_{_fingerprint(ckpt_path, quantization, calibration_dir)}.tflite"
+    return Path(user_data_dir("cache")) / name
+
+
+def convert_backbone(backbone, quantization, representative_frames=None):
+    """Convert a Keras backbone to a TFLite flatbuffer using post-training
+    quantization. Inputs and outputs stay float32 in both modes."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(backbone)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if representative_frames is None or len(representative_frames) == 0:
+            raise RuntimeError(
+                f"int8 quantization needs calibration frames in {CALIBRATION_DIR}"
+            )
+
+        def representative_dataset():
+            for frame in representative_frames:
+                yield [np.expand_dims(frame, 0).astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    return converter.convert()
+
+
+class TFLiteEngine(InferenceEngine):
+    """InferenceEngine whose backbone runs through a quantized TFLite
+    interpreter. Falls back to the float32 backbone if conversion fails.
+    The LSTM head stays the (compiled) float32 Keras head."""
+
+    def __init__(self, quantization="float16", calibration_dir=CALIBRATION_DIR, num_threads=None, **kwargs):
+        super().__init__(**kwargs)
+        self.backend = "tflite-fp16" if quantization == "float16" else "tflite-int8"
+        self.quantization = quantization
+        self.calibration_dir = calibration_dir
+        self.num_threads = num_threads or governor().inference_threads
+        self._interpreter = None
+        self._batch_size = None
+
+    @property
+    def quantized(self):
+        """False before load() and whenever the float32 fallback is used."""
+        return self._interpreter is not None
+
+    def load(self):
+        with self._lock:
+            if self._model is not None:
+                return self
+            super().load()
+            try:
+                self._interpreter = self._make_interpreter()
+            except Exception as exc:
+                logger.warning(
+                    f"TFLite {self.quantization} backbone unavailable, using float32: {exc}"
+                )
+                self._interpreter = None
+        return self
+
+    def _make_interpreter(self):
+        model_path = cached_model_path(self.ckpt_path, self.quantization, self.calibration_dir)
+        if not model_path.is_file():
+            start_time = time.time()
+            frames = calibration_frames(self.calibration_dir) if self.quantization == "int8" else None
+            flatbuffer = convert_backbone(self.backbone_model(), self.quantization, frames)
+            # write-then-rename so a crash never leaves a truncated cache entry
+            fd, tmp_path = tempfile.mkstemp(dir=model_path.parent, suffix=".partial")
+            with os.fdopen(fd, "wb") as f:
+                f.write(flatbuffer)
+            os.replace(tmp_path, model_path)
+            logger.info(f"Converted OOBNet backbone to TFLite {self.quantization} in {time.time() - start_time:.2f} sec")
+        interpreter = tf.lite.Interpreter(model_path=str(model_path), num_threads=self.num_threads)
+        interpreter.allocate_tensors()
+        self._batch_size = None
+        return interpreter
+
+    def _run_backbone(self, batch):
+        # batches arrive padded to BATCH_BUCKETS, so the interpreter is only
+        # re-allocated when the bucket changes
+        with self._lock:
+            if self._interpreter is None:
+                return super()._run_backbone(batch)
+            input_index = self._interpreter.get_input_details()[0]["index"]
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(input_index, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(input_index, batch)
+            self._interpreter.invoke()
+            output_index = self._interpreter.get_output_details()[0]["index"]
+            return self._interpreter.get_tensor(output_index).copy()
+
+
+def _run_sequence(engine, frames, batch_size):
+    engine.load()
+    engine.reset()
+    start_time = time.time()
+    probs = [engine.predict(frames[j:j + batch_size]) for j in range(0, len(frames), batch_size)]
+    elapsed = time.time() - start_time
+    engine.reset()
+    return np.concatenate(probs) if probs else np.zeros(0), elapsed
+
+
+def compare_with_float32(reference_dir, backends=("tflite-fp16", "tflite-int8"), batch_size=64):
+    """Run the reference frames through float32 Keras and each backend and
+    report per-frame agreement of the rounded predictions and timings."""
+    from .engine import create_engine
+
+    frames = _load_frames(reference_dir)
+    if len(frames) == 0:
+        raise RuntimeError(f"No .png frames found in {reference_dir}")
+    reference, reference_time = _run_sequence(InferenceEngine(), frames, batch_size)
+    report = {
+        "reference_dir": str(reference_dir),
+        "frames": int(len(frames)),
+        "batch_size": batch_size,
+        "keras": {"ms_per_frame": 1000 * reference_time / len(frames)},
+    }
+    for backend in backends:
+        engine = create_engine(backend)
+        probs, elapsed = _run_sequence(engine, frames, batch_size)
+        if not engine.quantized:
+            logger.warning(f"{backend}: no quantized model ran, these are float32 figures")
+        report[backend] = {
+            "quantized": engine.quantized,
+            "agreement": float(np.mean(np.round(probs) == np.round(reference))),
+            "mean_abs_diff": float(np.mean(np.abs(probs - reference))),
+            "max_abs_diff": float(np.max(np.abs(probs - reference))),
+            "ms_per_frame": 1000 * elapsed / len(frames),
+            "speedup": reference_time / elapsed if elapsed > 0 else None,
+        }
+    return report
+
+
+def build_calibration_set(video_in, calibration_dir=CALIBRATION_DIR, size=CALIBRATION_SIZE):
+    """Extract frames from a representative recording at the model's input
+    size and keep an evenly spaced sample of them."""
+    from .vutils import VideoWorker
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix="calibration_"))
+    try:
+        VideoWorker(None).extract_frames(str(video_in), tmp_dir)
+        frame_paths = sorted(tmp_dir.glob("*.png"))
+        if len(frame_paths) > size:
+            step = len(frame_paths) / size
+            frame_paths = [frame_paths[int(j * step)] for j in range(size)]
+        os.makedirs(calibration_dir, exist_ok=True)
+        for fp in frame_paths:
+            shutil.copyfile(fp, Path(calibration_dir) / f"{Path(video_in).stem}_{fp.name}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return len(frame_paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calibrate-from", metavar="VIDEO", help="add frames of VIDEO to the calibration set")
+    parser.add_argument("--reference", metavar="DIR", help="report agreement with float32 on the frames in DIR")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", metavar="JSON", help="also write the agreement report to JSON")
+    args = parser.parse_args()
+
+    if args.calibrate_from:
+        n = build_calibration_set(args.calibrate_from)
+        print(f"added {n} calibration frames to {CALIBRATION_DIR}")
+    if args.reference:
+        report = compare_with_float32(args.reference, batch_size=args.batch_size)
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,95 @@
+import json
+import os
+import platform
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+from ..utils.resources import user_data_dir
+from ..utils.types import ProcessingMode
+
+THROUGHPUT_FILE = "throughput.json"
+# weight of the newest run in the running average, so the figure follows
+# a change of settings or hardware within a few runs
+SMOOTHING = 0.3
+# what a patient costs besides its video: analysis, model reset, process
+# start-ups, merge and publish
+PATIENT_OVERHEAD_SEC = {ProcessingMode.NORMAL: 15.0, ProcessingMode.ADVANCED: 5.0}
+# runs shorter than this say more about the overhead than the throughput
+MIN_SAMPLE_SEC = 10.0
+
+_lock = threading.Lock()
+
+
+def _path():
+    return Path(user_data_dir()) / THROUGHPUT_FILE
+
+
+def _load():
+    try:
+        with open(_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _machine(data):
+    # the data directory may be a roaming home shared by several machines
+    return data.get(platform.node(), {})
+
+
+def throughput(mode):
+    """This machine's measurement for `mode`: {"sec_per_video_sec", "runs",
+    "source", "updated"}, or None if it never processed in that mode."""
+    return _machine(_load()).get(mode.name)
+
+
+def record(mode, duration_sec, wall_sec, source="run"):
+    """Fold a completed job (`wall_sec` spent on `duration_sec` of video)
+    into the machine's throughput for `mode`."""
+    if not duration_sec or duration_sec < MIN_SAMPLE_SEC or wall_sec <= 0:
+        return
+    sample = max(wall_sec - PATIENT_OVERHEAD_SEC[mode], 0.1 * wall_sec) / duration_sec
+    with _lock:
+        data = _load()
+        machine = data.setdefault(platform.node(), {})
+        entry = machine.get(mode.name)
+        if entry is None:
+            entry = {"sec_per_video_sec": sample, "runs": 0}
+        else:
+            entry["sec_per_video_sec"] += SMOOTHING * (sample - entry["sec_per_video_sec"])
+        entry.update(runs=entry["runs"] + 1, source=source,
+                     updated=datetime.now().isoformat(timespec="seconds"))
+        machine[mode.name] = entry
+        tmp = _path().with_suffix(".tmp")
+        try:
+            tmp.write_text(json.dumps(data, indent=2))
+            os.replace(tmp, _path())
+        except OSError as exc:
+            logger.warning(f"Could not save the throughput measurement: {exc}")
+            return
+    logger.info(
+        f"{mode.name} throughput: {1 / sample:.2f}× real time this run, "
+        f"{1 / entry['sec_per_video_sec']:.2f}× on average"
+    )
+
+
+def estimate(durations, mode):
+    """Seconds to process patients with the given total video durations
+    (one entry per patient) in `mode`, or None while the machine has no
+    measurement for it."""
+    entry = throughput(mode)
+    if entry is None:
+        return None
+    return sum(PATIENT_OVERHEAD_SEC[mode] + d * entry["sec_per_video_sec"] for d in durations)
+
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    if minutes < 1:
+        return "under a minute"
+    if minutes < 60:
+        return f"{minutes} min"
+    return f"{minutes // 60} h {minutes % 60:02d} min"
@@ -3,9 +3,22 @@ import subprocess as sp
 from pathlib import Path
 
 from ..utils.resources import FFMPEG_BIN
+from ..utils.governor import governor
+from ..utils.subprocesses import processes
+from ..utils.tracing import tracer
 
 FFPROBE_BIN = FFMPEG_BIN
 
+# output options that drop container, stream and chapter metadata, so the
+# final mux can write the shared copy directly
+STRIP_METADATA = [
+  "-map_metadata", "-1",
+  "-map_metadata:s:v", "-1",
+  "-map_metadata:s:a", "-1",
+  "-map_chapters", "-1",
+  "-disposition", "0",
+]
+
 
 class VideoWorker:
   def __init__(self, logfile=None):
@@ -16,6 +29,15 @@ class VideoWorker:
       with open(self._logfile, "a") as f:
         f.write("_" * 40 + "\n" * 2 + s)
 
+  def _run(self, cmd, role, **kwargs):
+    # every ffmpeg call goes through the governor (thread count per role, a
+    # cap on concurrent processes) and the registry of tracked children
+    cmd = governor().with_threads(cmd, role)
+    self.log(" ".join(cmd))
+    # the span includes the wait for a free subprocess slot
+    with tracer().span(f"ffmpeg {role}", "subprocess"), governor().subprocess_slot():
+      return processes().run(cmd, role=role, **kwargs)
+
   def extract_frames(
     self,
     video_in,
@@ -33,8 +55,7 @@ class VideoWorker:
       ),
       "{}/%05d.png".format(dir_out)
     ]
-    self.log(" ".join(cmd))
-    sp.run(cmd)
+    self._run(cmd, "decode")
 
   def kf_cut(self, video_in, video_out, t1, t2, tbn=10000):
     duration = t2 - t1
@@ -52,8 +73,7 @@ class VideoWorker:
       "{}".format(tbn),
       video_out
     ]
-    self.log(" ".join(cmd))
-    sp.run(cmd)
+    self._run(cmd, "copy")
 
   def non_kf_cut(self, video_in, video_out, t1, t2, tbn=10000):
     duration = t2 - t1
@@ -73,8 +93,7 @@ class VideoWorker:
       "{}".format(tbn),
       video_out
     ]
-    self.log(" ".join(cmd))
-    sp.run(cmd)
+    self._run(cmd, "encode")
 
   def list_kf(self, video_in):
     cmd_1 = [
@@ -90,11 +109,21 @@ class VideoWorker:
       video_in
     ]
     self.log(" ".join(cmd_1))
-    proc_1 = sp.Popen(cmd_1, stdout=sp.PIPE, stderr=sp.STDOUT)
     cmd_2 = "awk -F',' '/K/ {{print $1}}'"
     self.log(" ".join(cmd_2))
-    proc_2 = sp.Popen(cmd_2, stdin=proc_1.stdout, stdout=sp.PIPE, shell=True)
-    out, err = proc_2.communicate()
+    with governor().subprocess_slot():
+      proc_1 = processes().popen(cmd_1, role="probe", stdout=sp.PIPE, stderr=sp.STDOUT)
+      try:
+        proc_2 = processes().popen(cmd_2, stdin=proc_1.stdout, stdout=sp.PIPE, shell=True)
+        try:
+          out, err = proc_2.communicate()
+        finally:
+          processes().release(proc_2)
+      finally:
+        proc_1.stdout.close()
+        proc_1.wait()
+        processes().release(proc_1)
+    processes().check_cancelled()
     raw = out.decode()
     # splitlines() skips trailing newline, and we filter out any empty strings
     lines = [line for line in raw.splitlines() if line.strip()]
@@ -126,7 +155,7 @@ class VideoWorker:
       left.unlink()
       right.unlink()
 
-  def merge(self, video_list, video_out, tmpfile=None):
+  def merge(self, video_list, video_out, tmpfile=None, strip_metadata=False):
     if tmpfile is None:
         # fallback: place next to the final output
         tmpfile = Path(video_out).parent / "tmp_concat.txt"
@@ -145,10 +174,11 @@ class VideoWorker:
       "-i", str(tmpfile),
       "-c",
       "copy",
-      str(video_out)
     ]
-    self.log(" ".join(cmd))
-    sp.run(cmd, check=True)
+    if strip_metadata:
+      cmd += ["-map", "0:v", "-map", "0:a?"] + STRIP_METADATA
+    cmd.append(str(video_out))
+    self._run(cmd, "copy", check=True)
     try: tmpfile.unlink()
     except: pass
 
@@ -172,8 +202,7 @@ class VideoWorker:
       "yuv420p",
       video_out,
     ]
-    self.log(" ".join(cmd))
-    sp.run(cmd)
+    self._run(cmd, "encode")
 
   def reencode(self, video_in, video_out):
     cap = cv2.VideoCapture(video_in)
@@ -0,0 +1,141 @@
+import errno
+import hashlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+from .types import ProcessingInterrupted
+
+# large sequential reads keep USB sticks and network shares streaming
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# ioctl(dst, FICLONE, src): copy-on-write clone on Btrfs, XFS, bcachefs...
+FICLONE = 0x40049409
+
+
+def _check_stop(should_stop):
+    if should_stop is not None and should_stop():
+        raise ProcessingInterrupted()
+
+
+def _kernel_copy(fsrc, fdst, size, should_stop=None):
+    """Copy without passing the data through Python. Returns False when
+    the platform or filesystem pair does not support it."""
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    for fn in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if fn is None:
+            continue
+        try:
+            while copied < size:
+                _check_stop(should_stop)
+                if fn is os.sendfile:
+                    n = fn(dst_fd, src_fd, copied, min(COPY_BUFFER_SIZE * 8, size - copied))
+                else:
+                    n = fn(src_fd, dst_fd, min(COPY_BUFFER_SIZE * 8, size - copied), copied, copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied == size
+        except OSError:
+            if copied:
+                raise
+            # e.g. EXDEV/EINVAL/ENOTSOCK: try the next mechanism
+            continue
+    return False
+
+
+def copy_file(src, dst, checksum=None, should_stop=None):
+    """Copy src to dst and return the hex digest of the copied bytes (or
+    None when no checksum algorithm is given).
+
+    Without a checksum the copy runs in the kernel (copy_file_range, then
+    sendfile) where it can. Otherwise the data is read once into a large
+    reusable buffer, hashed if asked and written in the same pass, so the
+    source is never read twice.
+
+    `should_stop()` is checked between chunks; once it returns True both
+    files are closed and ProcessingInterrupted is raised, leaving dst
+    incomplete."""
+    size = os.path.getsize(src)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if checksum is None and _kernel_copy(fsrc, fdst, size, should_stop):
+            digest = None
+        else:
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            h = hashlib.new(checksum) if checksum else None
+            buf = bytearray(COPY_BUFFER_SIZE)
+            view = memoryview(buf)
+            while True:
+                _check_stop(should_stop)
+                n = fsrc.readinto(buf)
+                if not n:
+                    break
+                if h is not None:
+                    h.update(view[:n])
+                fdst.write(view[:n])
+            digest = h.hexdigest() if h is not None else None
+    shutil.copystat(src, dst)
+    return digest
+
+
+def partial_path(dst):
+    """Hidden name next to `dst` used while it is being written. The
+    extension is kept so that ffmpeg still picks the right muxer."""
+    dst = Path(dst)
+    return dst.with_name(f".{dst.stem}.partial{dst.suffix}")
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        Path(dst).unlink(missing_ok=True)
+        return False
+
+
+def publish(src, dst, move=False):
+    """Make `src` available as `dst` so that readers of the destination
+    folder never see a half-written file. Returns how it was done.
+
+    On the same filesystem a move is a rename and a copy is a reflink or,
+    failing that, a hardlink; no data is written either way. Otherwise the
+    data is copied to a partial name that is renamed once complete."""
+    src, dst = Path(src), Path(dst)
+    tmp = partial_path(dst)
+    if move:
+        try:
+            os.replace(src, dst)
+            return "rename"
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+    else:
+        if _reflink(src, tmp):
+            os.replace(tmp, dst)
+            return "reflink"
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            # other filesystem, or one without hardlinks (FAT, some shares)
+            pass
+    try:
+        copy_file(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if move:
+        src.unlink()
+    return "copy"
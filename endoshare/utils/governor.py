@@ -0,0 +1,137 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from loguru import logger
+
+from . import tuning
+from .subprocesses import processes
+
+
+class ResourceGovernor:
+    """Single CPU budget for everything that spawns threads: the TensorFlow
+    thread pools of the inference engine, OpenCV, the `-threads` of every
+    ffmpeg process and the number of ffmpeg processes running at once.
+
+    The budget is `os.cpu_count()`, optionally capped by the user
+    (`max_cpu_threads` in settings.json). Roughly half of it goes to
+    inference and encoding, which overlap in Advanced mode, and a quarter to
+    decoding; `max_parallel_ffmpeg` caps concurrent subprocesses. The
+    auto-tuner (processing/autotune.py) may replace these splits with
+    measured ones, within the same budget."""
+
+    # -threads placement: before -i for decoders, before the output for encoders
+    ROLES = ("decode", "encode", "probe", "copy")
+
+    def __init__(self, max_threads=0, max_subprocesses=0, cpu_count=None,
+                 inference_threads=0, inter_op_threads=0, encode_threads=0):
+        total = cpu_count or os.cpu_count() or 1
+        self.budget = max(1, min(total, max_threads) if max_threads else total)
+        self.inference_threads = min(self.budget, inference_threads or max(1, self.budget // 2))
+        self.inter_op_threads = inter_op_threads or (1 if self.budget <= 4 else 2)
+        self.ffmpeg_threads = {
+            "decode": max(1, self.budget // 4),
+            "encode": min(self.budget, encode_threads or max(1, self.budget // 2)),
+            "probe": 1,
+            "copy": 1,
+        }
+        self.max_subprocesses = max_subprocesses or max(1, self.budget // self.ffmpeg_threads["encode"])
+        self._slots = threading.BoundedSemaphore(self.max_subprocesses)
+        self._tf_configured = False
+
+    def describe(self):
+        return (
+            f"CPU budget {self.budget}/{os.cpu_count()} threads: inference {self.inference_threads}"
+            f"+{self.inter_op_threads}, ffmpeg decode {self.ffmpeg_threads['decode']} / encode "
+            f"{self.ffmpeg_threads['encode']}, at most {self.max_subprocesses} ffmpeg at once"
+        )
+
+    def share(self, n_workers):
+        """Governor for one of `n_workers` processes splitting this budget."""
+        return ResourceGovernor(max_threads=max(1, self.budget // max(1, n_workers)), max_subprocesses=1)
+
+    def configure_tensorflow(self):
+        """Apply the thread pools. Must run before TensorFlow executes its
+        first op; later calls are ignored by TensorFlow."""
+        if self._tf_configured:
+            return
+        import tensorflow as tf
+
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(self.inference_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError as exc:
+            logger.warning(f"TensorFlow thread pools already initialised: {exc}")
+        try:
+            import cv2
+            cv2.setNumThreads(self.ffmpeg_threads["decode"])
+        except ImportError:
+            pass
+        self._tf_configured = True
+
+    @contextmanager
+    def device(self, device):
+        """tf.device() for inference blocks; makes sure the thread pools are
+        configured before the first op runs."""
+        import tensorflow as tf
+
+        self.configure_tensorflow()
+        with tf.device(device):
+            yield
+
+    def with_threads(self, cmd, role):
+        """Return a copy of an ffmpeg command with `-threads` for `role`."""
+        if role not in self.ROLES:
+            raise ValueError(f"Unknown ffmpeg role: {role}")
+        cmd = list(cmd)
+        if role in ("probe", "copy"):
+            return cmd
+        n = str(self.ffmpeg_threads[role])
+        if role == "decode":
+            return cmd[:1] + ["-threads", n] + cmd[1:]
+        return cmd[:-1] + ["-threads", n] + cmd[-1:]
+
+    @contextmanager
+    def subprocess_slot(self):
+        with self._slots:
+            yield
+
+    def run(self, cmd, role, **kwargs):
+        """subprocess.run for ffmpeg, with the role's thread count and at
+        most `max_subprocesses` running at the same time. The process is
+        tracked by the registry, so Terminate can stop it."""
+        with self.subprocess_slot():
+            return processes().run(self.with_threads(cmd, role), role=role, **kwargs)
+
+
+def _load_limits():
+    settings = tuning.load_settings()
+    return {
+        "max_threads": int(settings.get("max_cpu_threads", 0) or 0),
+        "max_subprocesses": tuning.setting(settings, "max_parallel_ffmpeg"),
+        "inference_threads": tuning.setting(settings, "inference_threads"),
+        "inter_op_threads": tuning.setting(settings, "inter_op_threads"),
+        "encode_threads": tuning.setting(settings, "ffmpeg_encode_threads"),
+    }
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def governor():
+    """Return the process-wide governor, built from settings.json limits
+    and this machine's tuning."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = ResourceGovernor(**_load_limits())
+            logger.info(_governor.describe())
+        return _governor
+
+
+def set_governor(new_governor):
+    """Replace the process-wide governor (worker processes, new limits)."""
+    global _governor
+    with _governor_lock:
+        _governor = new_governor
@@ -0,0 +1,201 @@
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psutil
+from loguru import logger
+
+from .prometheus import exporter
+from .tracing import tracer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# the order stages appear in a report; stages not listed sort after them
+STAGES = (
+    "staging", "probe", "preflight", "extraction", "inference",
+    "segments", "rendering", "merge", "anonymize", "publish",
+)
+METRICS_DIRNAME = "endoshare_metrics"
+
+_process = psutil.Process()
+
+
+def _children_cpu():
+    # CPU of ffmpeg children that have exited and been waited for
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _io_bytes():
+    """(read, written) storage bytes of this process. On Linux the counters
+    include children that have been waited for; where psutil has no I/O
+    counters (macOS) the getrusage block counts of both are used."""
+    try:
+        io = _process.io_counters()
+        return io.read_bytes, io.write_bytes
+    except (AttributeError, psutil.Error):
+        pass
+    if resource is None:
+        return 0, 0
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ((own.ru_inblock + children.ru_inblock) * 512,
+            (own.ru_oublock + children.ru_oublock) * 512)
+
+
+def _sample():
+    read, written = _io_bytes()
+    return (time.perf_counter(), time.process_time(), _children_cpu(), read, written)
+
+
+def _rounded(values):
+    return {
+        k: _rounded(v) if isinstance(v, dict) else round(v, 4) if isinstance(v, float) else v
+        for k, v in values.items()
+    }
+
+
+_FIELDS = ("wall_sec", "cpu_sec", "children_cpu_sec", "read_bytes", "write_bytes")
+_PROCESS_FIELDS = ("wall_sec", "user_sec", "sys_sec")
+
+
+class JobMetrics:
+    """Wall time, CPU time and I/O of one patient's job, per stage.
+
+    Stages nest: while an inner stage runs, the outer one is paused, so
+    every second and byte is charged to exactly one stage. CPU and I/O are
+    process-wide, which includes helper threads (and staging copies of
+    later patients running at the same time). Stages are entered from one
+    thread; `add_process` may be called from any.
+
+    Every ffmpeg run is also summed per stage and role, so the ratio of
+    its CPU to wall time tells decode- or encode-bound work (close to the
+    thread count) from waiting on I/O (close to zero)."""
+
+    def __init__(self, job_id, **info):
+        self.job_id = job_id
+        self.info = info
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.status = "running"
+        self.stages = {}
+        self._stack = []
+        self._since = None
+        self._lock = threading.Lock()
+        self.processes = {}
+        self.failures = []
+        self._start = time.perf_counter()
+
+    def _charge(self, name, now):
+        totals = self.stages.setdefault(name, dict.fromkeys(_FIELDS, 0) | {"calls": 0})
+        for field, end, begin in zip(_FIELDS, now, self._since):
+            totals[field] += end - begin
+
+    @contextmanager
+    def stage(self, name):
+        now = _sample()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        entered = now
+        self._stack.append(name)
+        self._since = now
+        try:
+            with tracer().span(name, "stage"):
+                yield
+        finally:
+            now = _sample()
+            self._charge(self._stack.pop(), now)
+            self.stages[name]["calls"] += 1
+            self._since = now
+            exporter().observe_stage(name, now[0] - entered[0])
+
+    def add_process(self, usage):
+        """Account one finished subprocess (see ProcessRegistry.usage) to
+        the stage running now. A process stopped by Terminate counts as a
+        run, not as a failure."""
+        stage = self._stack[-1] if self._stack else "other"
+        with self._lock:
+            roles = self.processes.setdefault(stage, {})
+            totals = roles.setdefault(usage["role"], dict.fromkeys(_PROCESS_FIELDS, 0.0) | {"runs": 0, "max_rss_mb": 0.0})
+            totals["runs"] += 1
+            for field in _PROCESS_FIELDS:
+                totals[field] += usage[field] or 0.0
+            totals["max_rss_mb"] = max(totals["max_rss_mb"], usage["max_rss_mb"] or 0.0)
+            if usage["returncode"] != 0 and not usage.get("cancelled"):
+                exporter().inc("endoshare_ffmpeg_failures_total", role=usage["role"])
+                self.failures.append({
+                    "stage": stage, "program": usage["program"], "role": usage["role"],
+                    "returncode": usage["returncode"], "stderr_tail": usage["stderr_tail"],
+                })
+
+    def to_dict(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        with self._lock:
+            processes = {stage: {role: dict(t) for role, t in roles.items()} for stage, roles in self.processes.items()}
+            failures = list(self.failures)
+        names = sorted(set(self.stages) | set(processes), key=lambda name: order.get(name, len(STAGES)))
+        return {
+            "job": self.job_id,
+            "started_at": self.started_at,
+            "status": self.status,
+            "wall_sec": time.perf_counter() - self._start,
+            "host": {"platform": platform.platform(), "cpu_count": os.cpu_count()},
+            **self.info,
+            "stages": {
+                name: _rounded(self.stages.get(name, {}))
+                | ({"ffmpeg": _rounded(processes[name])} if name in processes else {})
+                for name in names
+            },
+            "ffmpeg_failures": failures,
+        }
+
+    def summary(self):
+        """Lines for the human-readable log: time per stage, and ffmpeg
+        runs per role with their CPU use."""
+        report = self.to_dict()
+        lines = ["stage times: " + ", ".join(
+            f"{name} {totals['wall_sec']:.1f}s" for name, totals in report["stages"].items() if "wall_sec" in totals
+        )]
+        roles = {}
+        for totals in report["stages"].values():
+            for role, usage in totals.get("ffmpeg", {}).items():
+                acc = roles.setdefault(role, dict.fromkeys(_PROCESS_FIELDS, 0.0) | {"runs": 0, "max_rss_mb": 0.0})
+                for field in _PROCESS_FIELDS + ("runs",):
+                    acc[field] += usage[field]
+                acc["max_rss_mb"] = max(acc["max_rss_mb"], usage["max_rss_mb"])
+        if roles:
+            lines.append("ffmpeg: " + ", ".join(
+                f"{role} {u['runs']}x {u['wall_sec']:.1f}s wall "
+                f"{u['user_sec'] + u['sys_sec']:.1f}s cpu {u['max_rss_mb']:.0f} MB peak"
+                for role, u in roles.items()
+            ))
+        if report["ffmpeg_failures"]:
+            lines.append(f"ffmpeg failures: {len(report['ffmpeg_failures'])}")
+        return "\n".join(lines)
+
+    def artifact_path(self, folder, suffix):
+        """<folder>/endoshare_metrics/<start time>_<job><suffix>, where the
+        report and the other files of the job go."""
+        return Path(folder) / METRICS_DIRNAME / f"{self._stamp}_{self.job_id}{suffix}"
+
+    def write(self, folder):
+        """Write the report as <folder>/endoshare_metrics/<time>_<job>.json."""
+        path = self.artifact_path(folder, ".json")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+        except OSError as exc:
+            logger.warning(f"Could not write job metrics to {path}: {exc}")
+            return None
+        return path
@@ -0,0 +1,152 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from loguru import logger
+
+# ENDOSHARE_PROFILE=python profiles every job with cProfile,
+# ENDOSHARE_PROFILE=python,tensorflow also runs the TensorFlow profiler
+# around inference
+PROFILE_ENV = "ENDOSHARE_PROFILE"
+# functions listed in the summary, per sort order
+TOP_N = 25
+
+
+def profile_modes():
+    """The profilers asked for in ENDOSHARE_PROFILE: a subset of
+    {"python", "tensorflow"} ("1" means python, "all" both)."""
+    value = os.environ.get(PROFILE_ENV, "").lower()
+    modes = {m.strip() for m in value.split(",") if m.strip() and m.strip() != "0"}
+    if "all" in modes:
+        return {"python", "tensorflow"}
+    if "1" in modes:
+        modes = (modes - {"1"}) | {"python"}
+    return {"tensorflow" if m == "tf" else m for m in modes} & {"python", "tensorflow"}
+
+
+class JobProfiler:
+    """Profiles one patient's job and writes python.prof, a top-N summary
+    (summary.txt) and the TensorFlow profile (tensorflow/) into `out_dir`.
+
+    cProfile only sees the thread that enables it; worker threads started
+    by the job are profiled by running their target through `profiled()`,
+    and all profiles are merged when the job ends."""
+
+    def __init__(self, out_dir, modes):
+        self.out_dir = Path(out_dir)
+        self.modes = set(modes)
+        self._main = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._tf_depth = 0
+
+    def start(self):
+        global _active
+        _active = self
+        if "python" in self.modes:
+            self._main = cProfile.Profile()
+            self._main.enable()
+
+    def stop(self):
+        global _active
+        _active = None
+        if self._main is not None:
+            self._main.disable()
+            self.write()
+
+    def run_thread(self, fn, *args, **kwargs):
+        if "python" not in self.modes:
+            return fn(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._threads.append(profile)
+
+    @contextmanager
+    def tensorflow(self):
+        """Run the TensorFlow profiler for the duration of the block; nested
+        blocks share the outermost session."""
+        if "tensorflow" not in self.modes or self._tf_depth:
+            self._tf_depth += 1
+            try:
+                yield
+            finally:
+                self._tf_depth -= 1
+            return
+        import tensorflow as tf
+
+        logdir = self.out_dir / "tensorflow"
+        logdir.mkdir(parents=True, exist_ok=True)
+        try:
+            tf.profiler.experimental.start(str(logdir))
+        except Exception as exc:
+            # e.g. another session running; profiling must never fail a job
+            logger.warning(f"TensorFlow profiler not started: {exc}")
+            yield
+            return
+        self._tf_depth += 1
+        try:
+            yield
+        finally:
+            self._tf_depth -= 1
+            tf.profiler.experimental.stop()
+
+    def write(self):
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for profile in self._threads:
+                stats.add(profile)
+        summary = io.StringIO()
+        stats.stream = summary
+        for order in ("cumulative", "tottime"):
+            summary.write(f"Top {TOP_N} functions by {order} time\n")
+            stats.sort_stats(order).print_stats(TOP_N)
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(self.out_dir / "python.prof")
+            (self.out_dir / "summary.txt").write_text(summary.getvalue())
+        except OSError as exc:
+            logger.warning(f"Could not write profile to {self.out_dir}: {exc}")
+            return
+        logger.info(f"Profile written to {self.out_dir}")
+
+
+class _NoProfiler:
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+_active = None
+
+
+def job_profiler(out_dir):
+    """A profiler for one job, doing nothing unless ENDOSHARE_PROFILE is
+    set. Call start() when the job begins and stop() when it ends."""
+    modes = profile_modes()
+    return JobProfiler(out_dir, modes) if modes else _NoProfiler()
+
+
+def profiled(fn):
+    """Wrap a thread target so that it is profiled with the running job."""
+    def target(*args, **kwargs):
+        profiler = _active
+        if profiler is None:
+            return fn(*args, **kwargs)
+        return profiler.run_thread(fn, *args, **kwargs)
+    return target
+
+
+def tensorflow_profile():
+    """Context manager around an inference section: the TensorFlow
+    profiler runs inside it when the job asked for it."""
+    profiler = _active
+    return profiler.tensorflow() if profiler is not None else nullcontext()
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import deque
+
+from .types import ProcessingMode
+
+# the bar and its label are repainted at most this many times per second
+UI_RATE_HZ = 4
+# the ETA follows the pace of the last ETA_WINDOW seconds
+ETA_WINDOW = 120.0
+# no ETA until the run is this far along, and this old
+ETA_MIN_FRACTION = 0.01
+ETA_MIN_SECONDS = 10.0
+
+# rough share of a patient's wall time per step. They decide how far the
+# bar moves per step; the ETA comes from the pace actually measured.
+STAGE_WEIGHTS = {
+    ProcessingMode.NORMAL: {
+        "staging": 2, "preflight": 10, "probe": 1, "extraction": 22,
+        "inference": 35, "rendering": 20, "merge": 8, "publish": 2,
+    },
+    # decoding, inference and encoding run interleaved, batch by batch
+    ProcessingMode.ADVANCED: {
+        "staging": 2, "preflight": 10, "probe": 1, "processing": 85, "publish": 2,
+    },
+}
+
+
+def input_shares(jobs):
+    """{patient: bytes of input}, the share of each patient in a run; a
+    two-hour recording counts for more than a ten-minute one."""
+    shares = {}
+    for patient, videos in jobs.items():
+        size = 0
+        for path in videos.values():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        shares[patient] = size or 1
+    return shares
+
+
+class ProgressModel:
+    """The progress of a whole run as one fraction that never goes back.
+
+    Each patient counts for its share of the run, each step of a patient
+    for its STAGE_WEIGHTS entry; the code doing the work reports how far
+    along a step is with `report()`. Reports only carrying a message keep
+    the label current without moving the bar. At most UI_RATE_HZ updates
+    per second reach `emit(fraction, message, eta_sec)`, eta_sec being -1
+    while unknown. Safe to call from worker threads."""
+
+    def __init__(self, emit=None, shares=None, mode=ProcessingMode.NORMAL, rate=UI_RATE_HZ):
+        self._emit = emit
+        self._shares = dict(shares or {})
+        self._total = sum(self._shares.values()) or 1
+        weights = STAGE_WEIGHTS[mode]
+        self._weights = {stage: w / sum(weights.values()) for stage, w in weights.items()}
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._done = 0
+        self._share = 0
+        self._stages = {}
+        self._fraction = 0.0
+        self._message = ""
+        self._start = time.monotonic()
+        self._emitted = float("-inf")
+        # (time, fraction) of every real step forward
+        self._history = deque([(self._start, 0.0)])
+
+    @property
+    def fraction(self):
+        return self._fraction
+
+    def start_patient(self, patient, message=None):
+        with self._lock:
+            self._share = self._shares.get(patient, 0) / self._total
+            self._stages = {}
+            if message is not None:
+                self._message = message
+        self._publish(force=True)
+
+    def finish_patient(self, message=None):
+        with self._lock:
+            self._done += self._share
+            self._share = 0
+            self._stages = {}
+            self._advance(self._done)
+            if message is not None:
+                self._message = message
+        self._publish(force=True)
+
+    def report(self, stage, fraction=None, message=None):
+        """`fraction` (0-1) of `stage` of the current patient is done."""
+        with self._lock:
+            if message is not None:
+                self._message = message
+            if fraction is not None and stage in self._weights:
+                fraction = min(max(fraction, 0.0), 1.0)
+                self._stages[stage] = max(self._stages.get(stage, 0.0), fraction)
+                patient = sum(self._weights[s] * f for s, f in self._stages.items())
+                self._advance(self._done + self._share * patient)
+        self._publish(force=fraction == 1.0)
+
+    def _advance(self, fraction):
+        fraction = min(fraction, 1.0)
+        if fraction <= self._fraction:
+            return
+        self._fraction = fraction
+        now = time.monotonic()
+        self._history.append((now, fraction))
+        # keep one point older than the window as its starting point
+        while len(self._history) > 2 and self._history[1][0] < now - ETA_WINDOW:
+            self._history.popleft()
+
+    def eta(self):
+        """Seconds left at the measured pace, or None while unknown."""
+        with self._lock:
+            now = time.monotonic()
+            if self._fraction < ETA_MIN_FRACTION or now - self._start < ETA_MIN_SECONDS:
+                return None
+            since, then = self._history[0]
+            if self._fraction <= then:
+                # nothing moved within the window: the average of the run
+                since, then = self._start, 0.0
+            # the time since the last step counts, so a long silent step
+            # (an ffmpeg pass) stretches the ETA instead of freezing it
+            rate = (self._fraction - then) / max(now - since, 1e-6)
+            return (1.0 - self._fraction) / rate
+
+    def _publish(self, force=False):
+        if self._emit is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._emitted < self._interval:
+                return
+            self._emitted = now
+            fraction, message = self._fraction, self._message
+        eta = self.eta()
+        self._emit(fraction, message, -1.0 if eta is None else eta)
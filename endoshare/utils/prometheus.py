@@ -0,0 +1,180 @@
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from loguru import logger
+
+# ENDOSHARE_METRICS_PORT=9464 serves the metrics on http://127.0.0.1:9464/metrics,
+# ENDOSHARE_METRICS_TEXTFILE=/path/endoshare.prom rewrites them for the node
+# exporter's textfile collector every TEXTFILE_INTERVAL seconds
+PORT_ENV = "ENDOSHARE_METRICS_PORT"
+TEXTFILE_ENV = "ENDOSHARE_METRICS_TEXTFILE"
+TEXTFILE_INTERVAL = 15.0
+# frames/s is averaged over this many seconds
+RATE_WINDOW = 30.0
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+# job statuses that are not failures: a Terminate is the user's choice, and
+# shows up in endoshare_jobs_total{status="interrupted"} only
+NOT_FAILED = ("completed", "interrupted")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class MetricsExporter:
+    """Live processing metrics in the Prometheus text format.
+
+    Fed by the job metrics (stage latencies, ffmpeg failures), by the
+    inference loops (frames) and deid (segments), and by VideoProcessThread
+    (queue, job results). Counters only grow while the app runs."""
+
+    def __init__(self, port=None, textfile=None):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._frames = deque()
+        self._textfile = Path(textfile) if textfile else None
+        if port:
+            self._serve(int(port))
+        if self._textfile is not None:
+            threading.Thread(target=self._rewrite_loop, name="metrics-textfile", daemon=True).start()
+
+    # ── feeding ─────────────────────────────────────────────
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(**labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(**labels))] = value
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = (name, _labels(**labels))
+        with self._lock:
+            counts, total = self._histograms.get(key, ([0] * (len(buckets) + 1), 0.0))
+            counts[bisect.bisect_left(buckets, value)] += 1
+            self._histograms[key] = (counts, total + value)
+
+    def add_frames(self, n):
+        now = time.monotonic()
+        self.inc("endoshare_frames_total", n)
+        with self._lock:
+            self._frames.append((now, n))
+
+    def add_segments(self, n=1):
+        self.inc("endoshare_segments_rendered_total", n)
+
+    def observe_stage(self, stage, seconds):
+        self.observe("endoshare_stage_seconds", seconds, stage=stage)
+
+    def job_finished(self, status, wall_sec, duration_sec=None):
+        self.inc("endoshare_jobs_total", status=status)
+        if status not in NOT_FAILED:
+            self.inc("endoshare_job_failures_total")
+        elif status == "completed" and duration_sec and wall_sec > 0:
+            self.set("endoshare_last_job_realtime_factor", duration_sec / wall_sec)
+        self.set("endoshare_last_job_seconds", wall_sec)
+
+    # ── output ──────────────────────────────────────────────
+    def _frames_per_second(self):
+        cutoff = time.monotonic() - RATE_WINDOW
+        while self._frames and self._frames[0][0] < cutoff:
+            self._frames.popleft()
+        return sum(n for _, n in self._frames) / RATE_WINDOW
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            gauges[("endoshare_frames_per_second", "")] = self._frames_per_second()
+            histograms = {k: (list(c), t) for k, (c, t) in self._histograms.items()}
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                lines += [f"{n}{labels} {v}" for (n, labels), v in sorted(values.items()) if n == name]
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (n, labels), (counts, total) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                inner = labels[1:-1] + "," if labels else ""
+                cumulative = 0
+                for bound, count in zip(STAGE_BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f'{n}_bucket{{{inner}le="{bound}"}} {cumulative}')
+                lines.append(f"{n}_sum{labels} {total}")
+                lines.append(f"{n}_count{labels} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Rewrite the textfile now (atomically, as the collector requires)."""
+        if self._textfile is None:
+            return
+        tmp = self._textfile.with_name(self._textfile.name + ".tmp")
+        try:
+            self._textfile.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(self.render())
+            os.replace(tmp, self._textfile)
+        except OSError as exc:
+            logger.warning(f"Could not write metrics to {self._textfile}: {exc}")
+
+    def _rewrite_loop(self):
+        while True:
+            self.flush()
+            time.sleep(TEXTFILE_INTERVAL)
+
+    def _serve(self, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as exc:
+            logger.warning(f"Metrics endpoint not started on port {port}: {exc}")
+            return
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+
+class _NoExporter:
+    """What `exporter()` returns when no export is configured."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def exporter():
+    """Return the process-wide exporter; a no-op one unless
+    ENDOSHARE_METRICS_PORT or ENDOSHARE_METRICS_TEXTFILE is set. The
+    endpoint starts on first use."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            port, textfile = os.environ.get(PORT_ENV), os.environ.get(TEXTFILE_ENV)
+            _exporter = MetricsExporter(port, textfile) if port or textfile else _NoExporter()
+        return _exporter
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Registry of original → anonymized video names.
+
+The mapping lives in an SQLite database next to patientID_log.csv, with
+indexes on both names and on the date, so lookups no longer scan the CSV.
+The CSV is still appended to after every patient for existing tooling, and
+can be regenerated from the database at any time:
+
+    python -m endoshare.utils.registry DB --original PATIENT
+    python -m endoshare.utils.registry DB --since 2024-01-01 --until 2024-12-31
+    python -m endoshare.utils.registry DB --export patientID_log.csv
+
+An existing CSV is imported the first time the database is created.
+"""
+
+import argparse
+import csv
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from loguru import logger
+
+CSV_HEADER = ["original", "anonymized"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    original TEXT NOT NULL,
+    anonymized TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS names_original ON names (original);
+-- not UNIQUE: an old CSV may hold colliding short names, and every audit
+-- row is kept; new names are checked with is_taken() before publishing
+CREATE INDEX IF NOT EXISTS names_anonymized ON names (anonymized);
+CREATE INDEX IF NOT EXISTS names_created_at ON names (created_at);
+"""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _day_after(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+class NameRegistry:
+    """Transactional store of the name translation. Connections are not
+    shared between threads: create the registry in the thread using it."""
+
+    def __init__(self, db_path, csv_path=None):
+        self.db_path = Path(db_path)
+        self.csv_path = Path(csv_path) if csv_path else None
+        is_new = not self.db_path.exists()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        if is_new and self.csv_path is not None and self.csv_path.is_file():
+            n = self.import_csv(self.csv_path)
+            logger.info(f"Imported {n} name translations from {self.csv_path}")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def batch(self):
+        """Collect the rows of one patient and insert them in a single
+        transaction, then append them to the CSV. Yields a list to which
+        (original, anonymized) pairs are appended."""
+        rows = []
+        yield rows
+        if not rows:
+            return
+        created_at = _now()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO names (original, anonymized, created_at) VALUES (?, ?, ?)",
+                [(original, anonymized, created_at) for original, anonymized in rows],
+            )
+        if self.csv_path is not None:
+            self._append_csv(rows)
+
+    def add(self, original, anonymized):
+        with self.batch() as rows:
+            rows.append((original, anonymized))
+
+    def _append_csv(self, rows):
+        write_header = not self.csv_path.exists()
+        with open(self.csv_path, mode="a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+
+    def _select(self, where="", params=()):
+        cursor = self._conn.execute(
+            f"SELECT original, anonymized, created_at FROM names {where} ORDER BY id", params
+        )
+        return [dict(zip(("original", "anonymized", "created_at"), row)) for row in cursor]
+
+    def by_original(self, original):
+        return self._select("WHERE original = ?", (original,))
+
+    def by_anonymized(self, anonymized):
+        return self._select("WHERE anonymized = ?", (anonymized,))
+
+    def is_taken(self, anonymized):
+        return self._conn.execute(
+            "SELECT 1 FROM names WHERE anonymized = ? LIMIT 1", (anonymized,)
+        ).fetchone() is not None
+
+    def between(self, since=None, until=None):
+        """Rows created in [since, until]; dates as ISO strings (YYYY-MM-DD
+        or full timestamps, a bare `until` date includes that whole day)."""
+        clauses, params = [], []
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("created_at < ?")
+            params.append(_day_after(until) if len(until) == 10 else until)
+        where = "WHERE " + " AND ".join(clauses) if clauses else ""
+        return self._select(where, params)
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+
+    def import_csv(self, csv_path):
+        """Load an existing patientID_log.csv. Its rows carry no date, so
+        they are stamped with the file's modification time. Rows already in
+        the registry (same original and anonymized name) are skipped, so a
+        CSV can be imported twice; returns the number of rows added."""
+        csv_path = Path(csv_path)
+        stamp = datetime.fromtimestamp(csv_path.stat().st_mtime, timezone.utc).isoformat(timespec="seconds")
+        known = set(self._conn.execute("SELECT original, anonymized FROM names"))
+        rows, skipped = [], 0
+        with open(csv_path, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[:2] == CSV_HEADER:
+                    continue
+                if (row[0], row[1]) in known:
+                    skipped += 1
+                    continue
+                rows.append((row[0], row[1], stamp))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO names (original, anonymized, created_at) VALUES (?, ?, ?)", rows
+            )
+        if skipped:
+            logger.info(f"Skipped {skipped} rows of {csv_path} already in the registry")
+        return len(rows)
+
+    def export_csv(self, csv_path):
+        """Write the whole mapping in the patientID_log.csv format."""
+        with open(csv_path, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(self._conn.execute("SELECT original, anonymized FROM names ORDER BY id"))
+        return len(self)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db")
+    parser.add_argument("--original", help="list the anonymized names of an original name")
+    parser.add_argument("--anonymized", help="show the original name of an anonymized name")
+    parser.add_argument("--since", help="list entries from this date (YYYY-MM-DD)")
+    parser.add_argument("--until", help="list entries up to this date (YYYY-MM-DD)")
+    parser.add_argument("--export", metavar="CSV", help="write the whole mapping to CSV")
+    parser.add_argument("--import-csv", metavar="CSV", help="add the rows of an existing CSV")
+    args = parser.parse_args()
+
+    with NameRegistry(args.db) as registry:
+        if args.import_csv:
+            print(f"imported {registry.import_csv(args.import_csv)} rows")
+        if args.original:
+            rows = registry.by_original(args.original)
+        elif args.anonymized:
+            rows = registry.by_anonymized(args.anonymized)
+        elif args.since or args.until:
+            rows = registry.between(args.since, args.until)
+        else:
+            rows = []
+        for row in rows:
+            print(f"{row['created_at']}\t{row['original']}\t{row['anonymized']}")
+        if args.export:
+            print(f"exported {registry.export_csv(args.export)} rows to {args.export}")
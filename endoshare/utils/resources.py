@@ -78,6 +78,14 @@ def resource_path(relative_path: str) -> str:
     return os.path.normpath(resolved)
 
 
+def user_data_dir(*parts: str) -> str:
+    """Return (and create) a writable per-user directory for caches and
+    machine-specific state. The bundle's resources may be read-only."""
+    base = os.environ.get("ENDOSHARE_HOME") or os.path.join(os.path.expanduser("~"), ".endoshare")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
 
 ICON_DIR = "icons"
 
@@ -0,0 +1,120 @@
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+# seconds between samples
+SAMPLE_INTERVAL = 1.0
+_COLUMNS = ("t", "cpu_percent", "rss_mb", "read_mb_s", "write_mb_s", "scratch_free_gb")
+
+
+def _free_bytes(path):
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return shutil.disk_usage(path).free
+
+
+class ResourceSampler:
+    """Samples the app's resource use once per SAMPLE_INTERVAL while a job
+    runs: CPU utilisation and RSS of this process and its ffmpeg children,
+    disk read/write rates of the machine and free space in the scratch
+    directory. Costs one psutil round per second on a daemon thread."""
+
+    def __init__(self, scratch_dir, interval=SAMPLE_INTERVAL):
+        self.scratch_dir = scratch_dir
+        self.interval = interval
+        self.timeline = {column: [] for column in _COLUMNS}
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._cpu_count = psutil.cpu_count() or 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        return self
+
+    def _tree(self):
+        try:
+            return [self._process] + self._process.children(recursive=True)
+        except psutil.Error:
+            return [self._process]
+
+    def _run(self):
+        start = time.monotonic()
+        own = self._process.cpu_times()
+        cpu_times = {self._process.pid: own.user + own.system}
+        disk = psutil.disk_io_counters()
+        last = start
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            elapsed = max(now - last, 1e-6)
+            cpu = rss = 0.0
+            for proc in self._tree():
+                try:
+                    with proc.oneshot():
+                        times = proc.cpu_times()
+                        rss += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+                used = times.user + times.system
+                # a child seen for the first time is charged from its start
+                cpu += used - cpu_times.get(proc.pid, 0.0)
+                cpu_times[proc.pid] = used
+            counters = psutil.disk_io_counters()
+            if counters is not None and disk is not None:
+                read = (counters.read_bytes - disk.read_bytes) / elapsed
+                written = (counters.write_bytes - disk.write_bytes) / elapsed
+            else:
+                read = written = 0.0
+            disk, last = counters, now
+            try:
+                free = _free_bytes(self.scratch_dir)
+            except OSError:
+                free = 0
+            sample = (
+                round(now - start, 1),
+                # 100% is the whole machine busy
+                round(100 * cpu / elapsed / self._cpu_count, 1),
+                round(rss / 2**20, 1),
+                round(read / 2**20, 2),
+                round(written / 2**20, 2),
+                round(free / 2**30, 2),
+            )
+            for column, value in zip(_COLUMNS, sample):
+                self.timeline[column].append(value)
+
+    def peaks(self):
+        t = self.timeline
+        if not t["t"]:
+            return {}
+        return {
+            "cpu_percent": max(t["cpu_percent"]),
+            "rss_mb": max(t["rss_mb"]),
+            "read_mb_s": max(t["read_mb_s"]),
+            "write_mb_s": max(t["write_mb_s"]),
+            "scratch_free_gb_min": min(t["scratch_free_gb"]),
+            "rss_mb_at": t["t"][t["rss_mb"].index(max(t["rss_mb"]))],
+        }
+
+    def report(self):
+        """Timeline (one list per column) and peaks, for the job metrics."""
+        return {"interval_sec": self.interval, "peaks": self.peaks(), "timeline": self.timeline}
+
+    def summary(self):
+        peaks = self.peaks()
+        if not peaks:
+            return "resources: no samples"
+        return (
+            f"resources: peak CPU {peaks['cpu_percent']:.0f}%, peak RSS {peaks['rss_mb']:.0f} MB "
+            f"at {peaks['rss_mb_at']:.0f}s, disk read {peaks['read_mb_s']:.0f} / write "
+            f"{peaks['write_mb_s']:.0f} MB/s, scratch free down to {peaks['scratch_free_gb_min']:.1f} GB"
+        )
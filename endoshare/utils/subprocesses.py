@@ -0,0 +1,246 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from loguru import logger
+
+from .tracing import command_args, redact, tracer
+from .types import ProcessingInterrupted
+
+# seconds ffmpeg gets to exit after SIGTERM before it is killed
+KILL_GRACE = 3.0
+# stderr lines kept for the log when a process fails
+STDERR_TAIL_LINES = 20
+
+
+class _AccountedPopen(subprocess.Popen):
+    """Popen whose poll() and wait() reap the child with os.wait4, keeping
+    its resource usage (CPU time, peak RSS) in `rusage`. Only where
+    os.wait4 exists. A child reaped any other way (e.g. by the interpreter's
+    own cleanup of an unreferenced Popen) has no `rusage`, and its CPU and
+    RSS figures are reported as None."""
+
+    rusage = None
+
+    def __init__(self, *args, **kwargs):
+        self._reap_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _reap(self, flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, flags)
+        except ChildProcessError:
+            # reaped elsewhere; the exit status is lost, as in Popen itself
+            self.returncode = 0
+            return
+        if pid == self.pid:
+            self.rusage = rusage
+            self.returncode = os.waitstatus_to_exitcode(status)
+
+    def poll(self):
+        if self.returncode is None and self._reap_lock.acquire(blocking=False):
+            try:
+                if self.returncode is None:
+                    self._reap(os.WNOHANG)
+            finally:
+                self._reap_lock.release()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            with self._reap_lock:
+                if self.returncode is None:
+                    self._reap(0)
+            return self.returncode
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining, 0.05))
+            delay *= 2
+        return self.returncode
+
+
+_Popen = _AccountedPopen if hasattr(os, "wait4") else subprocess.Popen
+
+
+# quoted paths, which may contain spaces
+_QUOTED_PATH = re.compile(r"'[^']*[/\\][^']*'|\"[^\"]*[/\\][^\"]*\"")
+# slashes that are not paths: "size=N/A", "1/25", "tbn=1/90000"
+_NOT_A_PATH = re.compile(r"^[\w.:-]*=?(N/A|[\d.]+/[\d.]+),?$")
+
+
+def _redact_line(line, args):
+    """ffmpeg's messages quote the paths it works on, and those name the
+    patient's folders; the tail goes to the log and the job metrics in the
+    shared folder, so every path in it is blanked like in a trace."""
+    for arg in args:
+        if redact(arg) != arg:
+            line = line.replace(arg, "<path>")
+    line = _QUOTED_PATH.sub("<path>", line)
+    return " ".join(token if _NOT_A_PATH.match(token) else redact(token) for token in line.split(" "))
+
+
+def _stderr_tail(stderr, args=()):
+    if not stderr:
+        return []
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors="replace")
+    # splitlines() also splits ffmpeg's \r-separated progress updates
+    lines = [line for line in stderr.splitlines() if line.strip()]
+    return [_redact_line(line, args)[:500] for line in lines[-STDERR_TAIL_LINES:]]
+
+
+class ProcessRegistry:
+    """The one place ffmpeg/ffprobe processes are started from.
+
+    Every child is tracked while it runs, so `cancel()` can signal exactly
+    those processes at once instead of searching the process table. After
+    a cancel no new process is started: launches and `check_cancelled()`
+    raise ProcessingInterrupted until `reset()`, which lets pending work
+    unwind cooperatively.
+
+    When a process is released its exit status, wall time, CPU time and
+    peak RSS are passed to every subscriber (see `usage()`)."""
+
+    def __init__(self):
+        self._procs = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._subscribers = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise ProcessingInterrupted()
+
+    def reset(self):
+        self._cancelled.clear()
+
+    def running(self):
+        with self._lock:
+            return [p for p in self._procs if p.poll() is None]
+
+    def subscribe(self, callback):
+        """Call `callback(usage)` for every process released from now on,
+        from the thread that ran it."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def popen(self, cmd, role=None, **kwargs):
+        """subprocess.Popen whose handle is tracked until `release()`.
+        `role` ("decode", "encode", ...) labels its resource usage."""
+        with self._lock:
+            self.check_cancelled()
+            proc = _Popen(cmd, **kwargs)
+            self._procs[proc] = (time.perf_counter(), role)
+        tracer().child_started(proc, cmd)
+        return proc
+
+    def release(self, proc, stderr=None):
+        """Stop tracking `proc`; if it has exited, report its usage, with
+        the tail of `stderr` when it failed."""
+        end = time.perf_counter()
+        with self._lock:
+            start, role = self._procs.pop(proc, (end, None))
+            subscribers = list(self._subscribers)
+        tracer().child_finished(proc)
+        if proc.returncode is None:
+            return
+        usage = self.usage(proc, role, end - start, stderr)
+        # a process stopped by cancel() has not failed
+        usage["cancelled"] = self.cancelled
+        if usage["returncode"] != 0 and not usage["cancelled"]:
+            logger.warning(
+                f"{usage['program']} ({role}) exited with {usage['returncode']} after {usage['wall_sec']:.1f} sec"
+                + ("\n" + "\n".join(usage["stderr_tail"]) if usage["stderr_tail"] else "")
+            )
+        for callback in subscribers:
+            callback(usage)
+
+    @staticmethod
+    def usage(proc, role, wall, stderr=None):
+        args = command_args(proc.args)
+        rusage = getattr(proc, "rusage", None)
+        usage = {
+            "program": os.path.basename(str(args[0])) if args else "",
+            "role": role or "other",
+            "returncode": proc.returncode,
+            "wall_sec": wall,
+            "user_sec": rusage.ru_utime if rusage else None,
+            "sys_sec": rusage.ru_stime if rusage else None,
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS
+            "max_rss_mb": (rusage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)) if rusage else None,
+            "stderr_tail": [],
+            "cancelled": False,
+        }
+        if proc.returncode != 0:
+            usage["stderr_tail"] = _stderr_tail(stderr, args)
+        return usage
+
+    def run(self, cmd, input=None, timeout=None, check=False, role=None, **kwargs):
+        """subprocess.run on a tracked process. Raises ProcessingInterrupted
+        if the process was stopped by `cancel()`. stderr is captured unless
+        redirected, so a failure can be reported with its last lines."""
+        if input is not None:
+            kwargs["stdin"] = subprocess.PIPE
+        kwargs.setdefault("stderr", subprocess.PIPE)
+        proc = self.popen(cmd, role=role, **kwargs)
+        stderr = None
+        try:
+            stdout, stderr = proc.communicate(input, timeout=timeout)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            self.release(proc, stderr)
+        self.check_cancelled()
+        completed = subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+        if check:
+            completed.check_returncode()
+        return completed
+
+    def cancel(self):
+        """Stop pending work and terminate every tracked process; those
+        still alive after KILL_GRACE seconds are killed."""
+        self._cancelled.set()
+        procs = self.running()
+        for proc in procs:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+        if procs:
+            logger.info(f"Terminated {len(procs)} ffmpeg process(es)")
+            threading.Timer(KILL_GRACE, self._kill, args=(procs,)).start()
+        return len(procs)
+
+    def _kill(self, procs):
+        for proc in procs:
+            if proc.poll() is None:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+
+_registry = ProcessRegistry()
+
+
+def processes():
+    """Return the process-wide registry of ffmpeg children."""
+    return _registry
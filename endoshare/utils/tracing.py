@@ -0,0 +1,141 @@
+import functools
+import json
+import os
+import shlex
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from loguru import logger
+
+# ENDOSHARE_TRACE=/path/to/trace.json records a timeline of the run in the
+# Chrome trace-event format (chrome://tracing, https://ui.perfetto.dev)
+TRACE_ENV = "ENDOSHARE_TRACE"
+
+
+def redact(arg):
+    # command lines name the patient's files; a trace only keeps the flags
+    return "<path>" if "/" in arg or "\\" in arg else arg
+
+
+def command_args(cmd):
+    """The arguments of a Popen command, which may be a shell string."""
+    if isinstance(cmd, (list, tuple)):
+        return [str(a) for a in cmd]
+    try:
+        return shlex.split(str(cmd))
+    except ValueError:  # unbalanced quotes
+        return str(cmd).split()
+
+
+class Tracer:
+    """Collects trace events: spans on one track per thread, and one track
+    per ffmpeg/ffprobe child for as long as it runs. Events are kept in
+    memory and `save()` rewrites the whole file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._events = []
+        self._lock = threading.Lock()
+        self._named = set()
+        self._children = {}
+        self._pid = os.getpid()
+        self._t0 = time.perf_counter_ns()
+
+    def _now(self):
+        return (time.perf_counter_ns() - self._t0) / 1000
+
+    def _thread_id(self):
+        tid = threading.get_native_id()
+        if tid not in self._named:
+            self._named.add(tid)
+            self._events.append({
+                "ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid,
+                "args": {"name": threading.current_thread().name},
+            })
+        return tid
+
+    @contextmanager
+    def span(self, name, cat="app", **args):
+        start = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            with self._lock:
+                self._events.append({
+                    "ph": "X", "name": name, "cat": cat, "pid": self._pid, "tid": self._thread_id(),
+                    "ts": start, "dur": end - start, "args": args,
+                })
+
+    def child_started(self, proc, cmd):
+        with self._lock:
+            self._children[proc.pid] = (self._now(), cmd)
+
+    def child_finished(self, proc):
+        end = self._now()
+        with self._lock:
+            started = self._children.pop(proc.pid, None)
+            if started is None:
+                return
+            start, cmd = started
+            args = command_args(cmd)
+            program = Path(args[0]).stem if args else ""
+            self._events += [
+                {"ph": "M", "name": "process_name", "pid": proc.pid, "args": {"name": f"{program} {proc.pid}"}},
+                {
+                    "ph": "X", "name": program, "cat": "subprocess", "pid": proc.pid, "tid": proc.pid,
+                    "ts": start, "dur": end - start,
+                    "args": {"cmd": " ".join(redact(a) for a in args[1:]), "returncode": proc.returncode},
+                },
+            ]
+
+    def save(self):
+        with self._lock:
+            events = list(self._events)
+        events.append({"ph": "M", "name": "process_name", "pid": self._pid, "args": {"name": "endoshare"}})
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        except OSError as exc:
+            logger.warning(f"Could not write trace to {self.path}: {exc}")
+            return
+        logger.info(f"Trace with {len(events)} events written to {self.path}")
+
+
+class _NoTracer:
+    """What `tracer()` returns when tracing is off: every call is a no-op."""
+
+    def span(self, name, cat="app", **args):
+        return nullcontext()
+
+    def child_started(self, proc, cmd):
+        pass
+
+    def child_finished(self, proc):
+        pass
+
+    def save(self):
+        pass
+
+
+_tracer = Tracer(os.environ[TRACE_ENV]) if os.environ.get(TRACE_ENV) else _NoTracer()
+
+
+def tracer():
+    """Return the process-wide tracer, a no-op one unless ENDOSHARE_TRACE
+    is set."""
+    return _tracer
+
+
+def traced(name, cat="app"):
+    """Decorator recording every call of a function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(name, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,67 @@
+import json
+import os
+import platform
+from datetime import datetime
+
+from loguru import logger
+
+from .resources import resource_path
+
+# settings.json keeps the auto-tuner's result per machine under this key,
+# {host name: {setting: value, ...}}, since one settings file may travel
+# between machines. A setting given at the top level of settings.json is a
+# user override and always wins.
+SETTINGS_KEY = "autotune"
+# the settings the tuner chooses; 0 or absent at the top level means "not
+# overridden"
+TUNED_KEYS = (
+    "inference_buffer_size",
+    "inference_threads",
+    "inter_op_threads",
+    "ffmpeg_encode_threads",
+    "max_parallel_ffmpeg",
+)
+
+
+def load_settings():
+    try:
+        with open(resource_path("settings.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def tuned(settings):
+    """This machine's tuning result, {} if it was never tuned."""
+    return settings.get(SETTINGS_KEY, {}).get(platform.node(), {})
+
+
+def needs_tuning(settings):
+    # a resized VM or a new CPU makes the old result meaningless
+    entry = tuned(settings)
+    return not entry or entry.get("cpu_count") != os.cpu_count()
+
+
+def setting(settings, key, default=0):
+    """The value of a tunable setting: the user's override, else this
+    machine's tuned value, else `default`."""
+    return int(settings.get(key) or tuned(settings).get(key) or default)
+
+
+def save(result):
+    """Store a tuning result for this machine, keeping everything else in
+    settings.json."""
+    settings = load_settings()
+    entry = {key: int(result[key]) for key in TUNED_KEYS if key in result}
+    entry.update(cpu_count=os.cpu_count(), tuned_at=datetime.now().isoformat(timespec="seconds"),
+                 **{k: v for k, v in result.items() if k not in TUNED_KEYS})
+    settings.setdefault(SETTINGS_KEY, {})[platform.node()] = entry
+    try:
+        with open(resource_path("settings.json"), "w") as f:
+            json.dump(settings, f)
+    except OSError as exc:
+        logger.warning(f"Could not save the tuning result: {exc}")
+        return
+    overridden = [key for key in TUNED_KEYS if settings.get(key)]
+    if overridden:
+        logger.info(f"Tuned values of {', '.join(overridden)} are overridden in settings.json")
@@ -1,4 +1,8 @@
+import multiprocessing as mp
+
 from endoshare.app import run
 
 if __name__ == "__main__":
+    # sharded inference spawns worker processes, also from frozen builds
+    mp.freeze_support()
     run()